@@ -1,7 +1,8 @@
 from django.db import transaction
+from django.db.models import Prefetch
 from django.utils import timezone
 
-from contract.models import Contract
+from contract.models import Contract, ContractComment, ContractCalculateHours, ContractAllowance
 from master.models import BatchManage
 from utils import common, constants
 from utils.django_base import BaseBatch
@@ -10,11 +11,35 @@ from utils.django_base import BaseBatch
 class Command(BaseBatch):
     BATCH_NAME = 'contract_auto_update'
     BATCH_TITLE = '契約自動更新'
+    BATCH_ATOMIC = False  # チャンクごとにコミットする
+    # 契約と一緒にコピーする子データ（紐づき名、Prefetch時の属性名、クラス）
+    CHILD_MODELS = (
+        ('contractcomment_set', 'list_contract_comment', ContractComment),  # 契約項目
+        ('contractcalculatehours_set', 'list_contract_calculate_hours', ContractCalculateHours),  # 契約計算用時間
+        ('contractallowance_set', 'list_contract_allowance', ContractAllowance),  # 契約手当
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='更新対象の契約を出力するだけで、契約は作成しない',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            dest='chunk_size',
+            default=constants.BATCH_CHUNK_SIZE,
+            help='一回でコミットする契約件数',
+        )
 
-    @transaction.atomic
     def handle(self, *args, **options):
         today = timezone.now().date()
         next_month = common.add_months(today, 1)
+        dry_run = options.get('dry_run', False)
+        chunk_size = options.get('chunk_size') or constants.BATCH_CHUNK_SIZE
         qs = Contract.objects.public_all().filter(
             contract_type__in=['0010', '0011', '0012'],  # 契約社員、パート、アルバイト
             status__lt='90',  # 破棄してない
@@ -22,48 +47,112 @@ class Command(BaseBatch):
             end_date__gte=today,
             end_date__lte=next_month,  # 一か月前に更新する
             children__isnull=True,
-        ).distinct()
-        for contract in qs:
-            list_contract_comment = list(contract.contractcomment_set.filter(is_deleted=False))
-            list_contract_calculate_hours = list(contract.contractcalculatehours_set.filter(is_deleted=False))
-            list_contract_allowance = list(contract.contractallowance_set.filter(is_deleted=False))
+        ).distinct().order_by('pk')
+        # 更新対象の契約、契約の子データと契約者をまとめて取得する
+        contracts = list(qs.prefetch_related(
+            'company_content_object',
+            'content_object',
+            *[Prefetch(
+                related_name,
+                queryset=model.objects.filter(is_deleted=False),
+                to_attr=attr_name,
+            ) for related_name, attr_name, model in self.CHILD_MODELS]
+        ))
+        contract_no_list = self.allocate_contract_no(contracts)
+        if dry_run:
+            for contract, contract_no in zip(contracts, contract_no_list):
+                start_date, end_date, auto_update_period = self.get_next_period(contract)
+                message = constants.INFO_CONTRACT_AUTO_UPDATE_DRY_RUN.format(
+                    name=contract.content_object,
+                    start_date=start_date,
+                    end_date=end_date,
+                    contract_no=contract_no,
+                )
+                self.logger.info(message)
+                self.stdout.write(message)
+            return
+
+        cnt = 0
+        for i in range(0, len(contracts), chunk_size):
+            with transaction.atomic():
+                cnt += self.update_contracts(
+                    today,
+                    contracts[i:i + chunk_size],
+                    contract_no_list[i:i + chunk_size],
+                )
+        self.logger.info(constants.INFO_CONTRACT_UPDATED_COUNT.format(count=cnt))
+
+    @classmethod
+    def allocate_contract_no(cls, contracts):
+        """更新後の契約番号をまとめて採番する。
+
+        同じ社員に更新対象の契約が複数ある場合、二件目以降は直前の番号からカウントアップする。
+
+        :param contracts: 更新対象の契約リスト
+        :return: 契約と同じ順番の契約番号リスト
+        """
+        dict_contract_no = dict()
+        contract_no_list = []
+        for contract in contracts:
+            key = (contract.content_type_id, contract.object_id)
+            contract_no = common.increase_number_tail(dict_contract_no.get(key))
+            if contract_no is None:
+                contract_no = Contract.get_next_contract_no(
+                    content_type=contract.content_type,
+                    object_id=contract.object_id,
+                    company_code=contract.company_content_object.code,
+                    object_code=contract.content_object.code,
+                )
+            dict_contract_no[key] = contract_no
+            contract_no_list.append(contract_no)
+        return contract_no_list
+
+    @classmethod
+    def get_next_period(cls, contract):
+        """更新後の契約期間を取得する。
+
+        :param contract: 更新対象の契約
+        :return: 開始日、終了日、自動更新期間
+        """
+        auto_update_period = contract.auto_update_period or 12
+        start_date = common.add_days(contract.end_date)
+        end_date = common.add_months(contract.end_date, auto_update_period)
+        return start_date, end_date, auto_update_period
+
+    def update_contracts(self, today, contracts, contract_no_list):
+        """契約を更新し、子データを一括で作成する。
+
+        :param today: 契約日
+        :param contracts: 更新対象の契約リスト
+        :param contract_no_list: 更新後の契約番号リスト
+        :return: 更新件数
+        """
+        dict_children = {model: [] for related_name, attr_name, model in self.CHILD_MODELS}
+        for contract, contract_no in zip(contracts, contract_no_list):
             parent_id = contract.pk
-            auto_update_period = contract.auto_update_period or 12
+            start_date, end_date, auto_update_period = self.get_next_period(contract)
             contract.pk = None
             contract.contract_date = today
-            contract.contract_no = Contract.get_next_contract_no(
-                content_type=contract.content_type,
-                object_id=contract.object_id,
-                company_code=contract.company_content_object.code,
-                object_code=contract.content_object.code,
-            )
-            contract.start_date = common.add_days(contract.end_date)
-            contract.end_date = common.add_months(contract.end_date, contract.auto_update_period or 12)
+            contract.contract_no = contract_no
+            contract.start_date = start_date
+            contract.end_date = end_date
             contract.parent_id = parent_id
             contract.auto_update_period = auto_update_period
             contract.status = '10'  # 自動更新済
             contract.save()
-            # 契約項目
-            for item in list_contract_comment:
-                item.pk = None
-                item.contract = contract
-                item.save()
-            # 契約計算用時間
-            for item in list_contract_calculate_hours:
-                item.pk = None
-                item.contract = contract
-                item.save()
-            # 契約手当
-            for item in list_contract_allowance:
-                item.pk = None
-                item.contract = contract
-                item.save()
+            for related_name, attr_name, model in self.CHILD_MODELS:
+                for item in getattr(contract, attr_name):
+                    item.pk = None
+                    item.contract = contract
+                    dict_children[model].append(item)
             self.logger.info(constants.INFO_CONTRACT_AUTO_UPDATED.format(
                 name=contract.content_object,
                 start_date=contract.start_date,
                 end_date=contract.end_date,
             ))
-        self.logger.info(constants.INFO_CONTRACT_UPDATED_COUNT.format(count=qs.count()))
+        for model, items in dict_children.items():
+            model.objects.bulk_create(items, batch_size=constants.BATCH_CHUNK_SIZE)
+        return len(contracts)
 
     def get_batch_manager(self):
         """指定名称のバッチを取得する。
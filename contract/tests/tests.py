@@ -1,10 +1,64 @@
 import datetime
+import io
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.management import call_command
 from django.urls import reverse
 from rest_framework import status as rest_status
+from contract.management.commands.contract_auto_update import Command as ContractAutoUpdateCommand
 from contract.models import Contract
 from member.models import MemberWorkingStatus
 from utils import common
-from utils.test_base import BaseAPITestCase
+from utils.test_base import BaseAPITestCase, QueryBudgetMixin
+
+
+def get_member_contract_data(object_id, contract_date, start_date, end_date):
+    """社員の契約を追加するAPIのデータを取得する。
+
+    :param object_id: 社員ID
+    :param contract_date: 契約日
+    :param start_date: 開始日
+    :param end_date: 終了日
+    :return:
+    """
+    return {
+        "company_content_type": 11,  # 自社
+        "company_object_id": 1,
+        "content_type": 29,  # 社員
+        "object_id": object_id,
+        "contract_date": contract_date,
+        "contract_type": "0001",  # 正社員
+        "start_date": start_date,
+        "end_date": end_date,
+        "contract_items": [
+            {"code": "0001", "name": "雇用期間",
+             "content": "（期間満了の１ヶ月前までに、双方にいずれから書面による契約終了の申し出がないときは、同じ条件でさらに1年間更新されるものとし、その後も同様とする。）"},
+            {"code": "0002", "name": "職位", "content": "一般社員"},
+            {"code": "0003", "name": "就業の場所", "content": "就業の場所（当社社内および雇用者が指定した場所）"},
+            {"code": "0004", "name": "業務の種類", "content": "業務の種類（一般社員）"},
+            {"code": "0006", "name": "業務のコメント",
+             "content": "就業の場所および業務の種類は、業務の都合により変更することがある。\n出向、転勤、配置転換等の業務命令が発令されることがある。"},
+            {"code": "0007", "name": "就業時間",
+             "content": "始業および終業時刻　午前　9時00分　～　午後　6時00分（1ケ月変形労働時間制による）\n"
+                        "休憩時間　　　　　　　正午～午後1時\n"
+                        "就業時間の変更　　前記にかかわらず業務の都合または就業場所変更により\n"
+                        "　　　　　　　　　　　　　始業および終業時刻の変更を行うことがある。\n"
+                        "所定労働時間を越える労働の有無　有"},
+            {"code": "0200", "name": "給与締め切り日及び支払日", "content": "締切日及び支払日：毎月、月末日締め・翌月２５日払\n支払い方法：銀行振込"},
+            {"code": "0201", "name": "昇給及び降給", "content": "会社の業績および社員個人の業績その他の状況を勘案し、昇給または降給を行うことがある。"},
+            {"code": "0300", "name": "休日", "content": "週休2日制（土・日・祝祭日休み）"},
+            {"code": "0301", "name": "有給休暇", "content": "年次有給休暇：労働基準法の定めによる。"},
+            {"code": "0302", "name": "無給休暇", "content": "産前産後、育児・介護休業、生理休暇、その他就業規則に定めがあるときは当該休暇。"},
+            {"code": "0800", "name": "退職に関する項目",
+             "content": "自己都合退職の場合　退職する１ヶ月前に届け出ること。\n解雇する場合　原則として　３０日前に予告すること。"},
+            {"code": "9900", "name": "その他備考", "content": "1、個別合意又は就業規則の変更により、労働条件及び業務の変更等を行う場合がある\n"
+                                                         "2、服務及び就業に関しては、前記並びに裏面、就業規則、諸規定、労働基準法その他関係法令の定めるところによる。"},
+        ],
+        "allowances": [
+            {"code": "0001", "name": "基本給（税抜）", "amount": 600000, "unit": "01"},
+        ],
+    }
 
 
 # Create your tests here.
@@ -16,43 +70,12 @@ class MemberTest(BaseAPITestCase):
         today = datetime.date.today()
         start_date = common.get_first_day_by_month(common.add_months(today, -1))
         end_date = common.get_last_day_by_month(common.add_months(today, 6))
-        response = self.client.post(url, data={
-            "company_content_type": 11,  # 自社
-            "company_object_id": 1,
-            "content_type": 29,  # 社員
-            "object_id": 11,  # 正社員 契約なし０１
-            "contract_date": today,
-            "contract_type": "0001",  # 正社員
-            "start_date": start_date,
-            "end_date": end_date,
-            "contract_items": [
-                {"code": "0001", "name": "雇用期間",
-                 "content": "（期間満了の１ヶ月前までに、双方にいずれから書面による契約終了の申し出がないときは、同じ条件でさらに1年間更新されるものとし、その後も同様とする。）"},
-                {"code": "0002", "name": "職位", "content": "一般社員"},
-                {"code": "0003", "name": "就業の場所", "content": "就業の場所（当社社内および雇用者が指定した場所）"},
-                {"code": "0004", "name": "業務の種類", "content": "業務の種類（一般社員）"},
-                {"code": "0006", "name": "業務のコメント",
-                 "content": "就業の場所および業務の種類は、業務の都合により変更することがある。\n出向、転勤、配置転換等の業務命令が発令されることがある。"},
-                {"code": "0007", "name": "就業時間",
-                 "content": "始業および終業時刻　午前　9時00分　～　午後　6時00分（1ケ月変形労働時間制による）\n"
-                            "休憩時間　　　　　　　正午～午後1時\n"
-                            "就業時間の変更　　前記にかかわらず業務の都合または就業場所変更により\n"
-                            "　　　　　　　　　　　　　始業および終業時刻の変更を行うことがある。\n"
-                            "所定労働時間を越える労働の有無　有"},
-                {"code": "0200", "name": "給与締め切り日及び支払日", "content": "締切日及び支払日：毎月、月末日締め・翌月２５日払\n支払い方法：銀行振込"},
-                {"code": "0201", "name": "昇給及び降給", "content": "会社の業績および社員個人の業績その他の状況を勘案し、昇給または降給を行うことがある。"},
-                {"code": "0300", "name": "休日", "content": "週休2日制（土・日・祝祭日休み）"},
-                {"code": "0301", "name": "有給休暇", "content": "年次有給休暇：労働基準法の定めによる。"},
-                {"code": "0302", "name": "無給休暇", "content": "産前産後、育児・介護休業、生理休暇、その他就業規則に定めがあるときは当該休暇。"},
-                {"code": "0800", "name": "退職に関する項目",
-                 "content": "自己都合退職の場合　退職する１ヶ月前に届け出ること。\n解雇する場合　原則として　３０日前に予告すること。"},
-                {"code": "9900", "name": "その他備考", "content": "1、個別合意又は就業規則の変更により、労働条件及び業務の変更等を行う場合がある\n"
-                                                             "2、服務及び就業に関しては、前記並びに裏面、就業規則、諸規定、労働基準法その他関係法令の定めるところによる。"},
-            ],
-            "allowances": [
-                {"code": "0001", "name": "基本給（税抜）", "amount": 600000, "unit": "01"},
-            ],
-        })
+        response = self.client.post(url, data=get_member_contract_data(
+            11,  # 正社員 契約なし０１
+            today,
+            start_date,
+            end_date,
+        ))
         # print(response.json())
         self.assertEqual(response.status_code, rest_status.HTTP_201_CREATED)
         if response.status_code == rest_status.HTTP_201_CREATED:
@@ -85,3 +108,91 @@ class MemberTest(BaseAPITestCase):
                 self.assertEqual(item.contract_id, contract.pk)
                 tmp_date = common.add_months(tmp_date, 1)
 
+
+class ContractMasterQueryBudgetTest(QueryBudgetMixin, BaseAPITestCase):
+
+    def setUp(self):
+        self.client.login(username='admin', password='admin')
+
+    def test_contract_item_list(self):
+        response = self.assertApiQueryBudget('/api/master/contract-items/', 5)
+        self.assertEqual(response.status_code, rest_status.HTTP_200_OK)
+
+    def test_contract_allowance_list(self):
+        response = self.assertApiQueryBudget('/api/master/contract-allowances/', 5)
+        self.assertEqual(response.status_code, rest_status.HTTP_200_OK)
+
+
+class ContractAutoUpdateTest(BaseAPITestCase):
+
+    def setUp(self):
+        self.client.login(username='admin', password='admin')
+        self.today = datetime.date.today()
+
+    def add_auto_update_contract(self, start_date, end_date):
+        # 自動更新の契約社員の契約を追加する
+        response = self.client.post(reverse('contract-add-contract'), data=get_member_contract_data(
+            11,  # 正社員 契約なし０１
+            start_date,
+            start_date,
+            end_date,
+        ))
+        self.assertEqual(response.status_code, rest_status.HTTP_201_CREATED)
+        Contract.objects.filter(pk=response.data["id"]).update(
+            contract_type='0010',  # 契約社員
+            is_auto_update=True,
+            auto_update_period=6,
+        )
+        return Contract.objects.get(pk=response.data["id"])
+
+    def test_allocate_contract_no(self):
+        # 同じ社員の二件目以降は直前の番号からカウントアップし、社員ごとに一回だけ採番すること
+        contracts = [SimpleNamespace(
+            content_type=None,
+            content_type_id=29,
+            object_id=object_id,
+            company_content_object=SimpleNamespace(code='C01'),
+            content_object=SimpleNamespace(code='M{}'.format(object_id)),
+        ) for object_id in (10, 11, 10)]
+        with mock.patch.object(Contract, 'get_next_contract_no', side_effect=['M10-0003', 'M11-0001']) as func:
+            contract_no_list = ContractAutoUpdateCommand.allocate_contract_no(contracts)
+        self.assertEqual(contract_no_list, ['M10-0003', 'M11-0001', 'M10-0004'])
+        self.assertEqual(func.call_count, 2)
+
+    def test_dry_run(self):
+        # 更新対象の契約を出力するだけで、契約を作成しないこと
+        contract = self.add_auto_update_contract(common.add_days(self.today, -30), common.add_days(self.today, 10))
+        count = Contract.objects.count()
+        out = io.StringIO()
+        call_command('contract_auto_update', '--dry-run', stdout=out)
+        self.assertEqual(Contract.objects.count(), count)
+        self.assertIn('[DRY RUN] {}（{}～{}'.format(
+            contract.content_object, common.add_days(contract.end_date), common.add_months(contract.end_date, 6),
+        ), out.getvalue())
+
+    def test_update_in_chunks(self):
+        # チャンクごとに更新し、契約番号は社員ごとに連番で、子データもコピーすること
+        contract1 = self.add_auto_update_contract(common.add_days(self.today, -30), common.add_days(self.today, 5))
+        contract2 = self.add_auto_update_contract(common.add_days(self.today, 6), common.add_days(self.today, 20))
+        with mock.patch.object(
+                ContractAutoUpdateCommand, 'update_contracts', autospec=True,
+                side_effect=ContractAutoUpdateCommand.update_contracts,
+        ) as update_contracts:
+            call_command('contract_auto_update', '--chunk-size', '1')
+        self.assertTrue(all(len(call[0][2]) == 1 for call in update_contracts.call_args_list))
+        new_contracts = []
+        for contract in (contract1, contract2):
+            new_contract = Contract.objects.get(parent_id=contract.pk)
+            self.assertEqual(new_contract.status, '10')
+            self.assertEqual(new_contract.start_date, common.add_days(contract.end_date))
+            self.assertEqual(new_contract.end_date, common.add_months(contract.end_date, 6))
+            self.assertEqual(
+                new_contract.contractcomment_set.filter(is_deleted=False).count(),
+                contract.contractcomment_set.filter(is_deleted=False).count(),
+            )
+            self.assertEqual(
+                new_contract.contractallowance_set.filter(is_deleted=False).count(),
+                contract.contractallowance_set.filter(is_deleted=False).count(),
+            )
+            new_contracts.append(new_contract)
+        self.assertEqual(new_contracts[1].contract_no, common.increase_number_tail(new_contracts[0].contract_no))
@@ -0,0 +1,19 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from utils.model_base import YearMonthMixin, YearMonthQuerySet
+
+
+class Command(BaseCommand):
+    help = '''文字列の年月（year/month、end_year/end_month）から整数の年月（ym、end_ym）を再設定する
+    '''
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        for model in apps.get_models():
+            if not issubclass(model, YearMonthMixin) or model._meta.proxy:
+                continue
+            # 論理削除済のデータも含めて更新する
+            cnt = YearMonthQuerySet(model=model).sync_ym()
+            self.stdout.write('{}: {}件の年月を再設定しました。'.format(model._meta.label, cnt))
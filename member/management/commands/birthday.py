@@ -6,7 +6,7 @@ from master.models import BatchManage, FirebaseTopic
 from member.models import Member
 from utils import constants
 from utils.django_base import BaseBatch
-from utils.firebase import send_message_to_topic
+from utils.firebase import NotificationDispatcher
 
 
 class Command(BaseBatch):
@@ -27,13 +27,15 @@ class Command(BaseBatch):
             birthday__day=today.day,
             contracts__end_date__gte=today,  # 退職済は除外
         ).distinct()
-        for member in qs:
-            send_message_to_topic(
-                topic,
-                title='おめでとうございます！',
-                body='{date}は {name} の誕生日です。'.format(date=today.strftime('%m月%d日'), name=member.full_name)
-            )
-            cnt += 1
+        # 全員分のメッセージをまとめて通知する
+        with NotificationDispatcher() as dispatcher:
+            for member in qs:
+                dispatcher.add(
+                    topic,
+                    title='おめでとうございます！',
+                    body='{date}は {name} の誕生日です。'.format(date=today.strftime('%m月%d日'), name=member.full_name)
+                )
+                cnt += 1
         self.logger.info('{}件データを処理しました。'.format(cnt))
 
     def get_batch_manager(self):
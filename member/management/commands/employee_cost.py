@@ -1,9 +1,14 @@
+import functools
+import operator
+from collections import defaultdict
+
 from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
 from django.utils import timezone
 
 from attendance.models import Attendance
 from attendance.biz import get_combined_attendance
+from contract.models import Contract
 from member.biz import get_project_members
 from member.models import Member
 from master.models import BatchManage, Company
@@ -12,6 +17,21 @@ from utils import common, constants
 from utils.django_base import BaseBatch
 
 
+def get_cost_projects(attendance, project_members):
+    """社員コストを作成する案件を決める。
+
+    :param attendance: 出勤情報（複数ある場合は合計したもの）
+    :param project_members: 指定月の案件メンバーのリスト
+    :return: 案件のリスト（案件にアサインしていない場合は[None]）、勤務時間が未入力の場合はNone
+    """
+    if not project_members:
+        return [None]
+    elif attendance is None:
+        return None
+    else:
+        return [project_member.project for project_member in project_members]
+
+
 class Command(BaseBatch):
     BATCH_NAME = 'employee_cost'
     BATCH_TITLE = '社員コスト'
@@ -33,47 +53,75 @@ class Command(BaseBatch):
         last_day = common.get_last_day_by_month(execute_date)
         ct_company = ContentType.objects.get_for_model(Company)
         ct_member = ContentType.objects.get_for_model(Member)
-        # 指定月に契約のある社員を洗い出す
-        qs = Member.objects.filter(
-            is_deleted=False,
-            contracts__is_deleted=False,
-            contracts__status__lt='90',
-            contracts__company_content_type=ct_company,
-            contracts__content_type=ct_member,
-            contracts__start_date__lte=last_day,
-            contracts__end_date__gte=first_day,
-        ).distinct()
-        # MonthlyCost.objects.filter(
-        #     company_content_type=ct_company,
-        #     member_content_type=ct_member,
-        #     year=year,
-        #     month=month,
-        # ).delete()
-        for member in qs:
-            qs_attendance = Attendance.objects.filter(
+        with self.phase('対象社員と契約の取得'):
+            # 指定月の社員の契約を一回で取得し、契約のある社員を洗い出す（契約とのJOINとDISTINCTをしない）
+            member_id_list = set(Contract.objects.filter(
+                is_deleted=False,
+                status__lt='90',
+                company_content_type=ct_company,
+                content_type=ct_member,
+                start_date__lte=last_day,
+                end_date__gte=first_day,
+            ).values_list('object_id', flat=True))
+            members = list(Member.objects.filter(is_deleted=False, pk__in=member_id_list).order_by('pk'))
+        with self.phase('出勤情報の取得'):
+            # 対象社員全員の出勤情報をまとめて取得し、社員ごとに分ける
+            dict_attendances = defaultdict(list)
+            for attendance in Attendance.objects.filter(
                 is_deleted=False,
                 year=year,
                 month=month,
                 content_type=ct_member,
-                object_id=member.pk,
-            )
-            project_members = get_project_members(member, year, month)
-            if qs_attendance.count() == 0:
-                attendance = None
-            elif qs_attendance.count() == 1:
-                attendance = qs_attendance.first()
-            else:
-                # 複数の案件に同時アサインした場合、複数出勤情報を合計する
-                attendance = get_combined_attendance(qs_attendance)
-            if project_members.count() > 0 and attendance is None:
-                self.logger.warn(constants.ERROR_REQUIRE_ATTENDANCE.format(
-                    name=member.full_name, year=year, month=month
-                ))
-            elif project_members.count() > 0:
-                for project_member in project_members:
-                    add_employee_cost(member, year, month, attendance, project_member.project)
-            else:
-                add_employee_cost(member, year, month, attendance, None)
+                object_id__in=[member.pk for member in members],
+            ):
+                dict_attendances[attendance.object_id].append(attendance)
+        with self.phase('案件メンバーの取得'):
+            dict_project_members = self.get_project_members(members, year, month)
+        cnt_add = 0
+        with self.phase('社員コストの作成'):
+            for member in members:
+                attendances = dict_attendances.get(member.pk, [])
+                if len(attendances) == 0:
+                    attendance = None
+                elif len(attendances) == 1:
+                    attendance = attendances[0]
+                else:
+                    # 複数の案件に同時アサインした場合、複数出勤情報を合計する
+                    attendance = get_combined_attendance(
+                        Attendance.objects.filter(pk__in=[item.pk for item in attendances])
+                    )
+                projects = get_cost_projects(attendance, dict_project_members.get(member.pk))
+                if projects is None:
+                    self.logger.warn(constants.ERROR_REQUIRE_ATTENDANCE.format(
+                        name=member.full_name, year=year, month=month
+                    ))
+                    continue
+                for project in projects:
+                    add_employee_cost(member, year, month, attendance, project)
+                    cnt_add += 1
+        self.logger.info('{}件データを処理しました（コスト{}件追加）。'.format(len(members), cnt_add))
+
+    @classmethod
+    def get_project_members(cls, members, year, month, chunk_size=constants.BATCH_CHUNK_SIZE):
+        """対象社員全員の指定月の案件メンバーを取得する。
+
+        案件メンバーの抽出条件はmember.biz.get_project_membersのものを社員ごとにORで結合し、
+        チャンクごとに一回のクエリで取得する。
+
+        :param members: 社員のリスト
+        :param year: 対象年
+        :param month: 対象月
+        :param chunk_size: 一回のクエリで取得する社員数
+        :return: 社員IDをキーとする案件メンバーのリスト
+        """
+        dict_project_members = defaultdict(list)
+        for i in range(0, len(members), chunk_size):
+            qs = functools.reduce(operator.or_, (
+                get_project_members(member, year, month) for member in members[i:i + chunk_size]
+            ))
+            for project_member in qs.select_related('project'):
+                dict_project_members[project_member.member_object_id].append(project_member)
+        return dict_project_members
 
     def get_batch_manager(self):
         """指定名称のバッチを取得する。
@@ -5,8 +5,9 @@ from django.utils import timezone
 from master.models import BatchManage, Config, Company
 from member.biz import get_member_join_date
 from member.models import Member, PaidVacation
-from utils import common
+from utils import common, constants
 from utils.django_base import BaseBatch
+from utils.errors import CustomException
 
 
 class Command(BaseBatch):
@@ -18,6 +19,9 @@ class Command(BaseBatch):
 -------------------------------
 勤続年数  6月   1年6月   2年6月   3年6月  4年6月   5年6月   6年6月   以降1年経過ごと
 付与日数  10日  11日     12日     14日    16日     18日     20日     20日
+-------------------------------
+--from/--toを指定した場合、期間内の月を一か月ずつ計算する。
+有休を作成済みの社員は対象外なので、間違って作成した有休を作り直す場合は--overwriteも指定する。
     """
 
     def add_arguments(self, parser):
@@ -27,13 +31,65 @@ class Command(BaseBatch):
             default=timezone.localtime().date(),
             help='社員有休計算日',
         )
+        parser.add_argument(
+            '--from',
+            dest='date_from',
+            default=None,
+            help='再作成の開始日（例：2020-04-01）、指定した場合は--toまで一か月ずつ計算する',
+        )
+        parser.add_argument(
+            '--to',
+            dest='date_to',
+            default=None,
+            help='再作成の終了日（例：2021-03-31）、省略時は--date',
+        )
+        parser.add_argument(
+            '--overwrite',
+            action='store_true',
+            dest='overwrite',
+            default=False,
+            help='対象期間に開始する作成済みの有休を削除してから作成し直す',
+        )
 
     @transaction.atomic
     def handle(self, *args, **options):
         execute_date = self.get_date_argument('date', **options)
+        if options.get('date_from'):
+            date_from = self.get_date_argument('date_from', **options)
+            date_to = self.get_date_argument('date_to', **options) if options.get('date_to') else execute_date
+            if date_from > date_to:
+                raise CustomException(constants.ERROR_DATE_CONTRADICT.format(start=date_from, end=date_to))
+        elif options.get('date_to'):
+            raise CustomException(constants.ERROR_REQUIRE_FIELD_CASE.format(condition='--toを指定した', name='--from'))
+        else:
+            date_from = date_to = execute_date
+        paid_vacation_period_list = Config.get_paid_vacation_intervals()
+        reserve_month = Config.get_paid_vacation_forward_month()
+        if options.get('overwrite'):
+            delete_cnt, dict_cnt = PaidVacation.objects.filter(
+                member__is_deleted=False,
+                start_date__gte=common.get_first_day_by_month(common.add_months(date_from, reserve_month)),
+                start_date__lte=common.get_last_day_by_month(common.add_months(date_to, reserve_month)),
+            ).delete()
+            self.logger.info('{}件の有休を削除しました。'.format(delete_cnt))
+        cnt = 0
+        # 前の月で作成した有休が次の月の繰越日数に影響するので、一か月ずつ順番に作成する
+        date = common.get_first_day_by_month(date_from)
+        while date <= date_to:
+            cnt += self.create_paid_vacations(date, reserve_month, paid_vacation_period_list)
+            date = common.add_months(date, 1)
+        self.logger.info('{}件データを処理しました。'.format(cnt))
+
+    def create_paid_vacations(self, execute_date, reserve_month, paid_vacation_period_list):
+        """指定年月の社員有休をまとめて作成する。
+
+        :param execute_date: 社員有休計算日
+        :param reserve_month: 何か月前に有休を作成するか
+        :param paid_vacation_period_list: 有休付与期間のリスト（開始月数、終了月数、日数）
+        :return: 作成件数
+        """
         first_day = common.get_first_day_by_month(execute_date)
         last_day = common.get_last_day_by_month(execute_date)
-        reserve_month = Config.get_paid_vacation_forward_month()
         new_start_date = common.get_first_day_by_month(common.add_months(execute_date, reserve_month))
         ct_company = ContentType.objects.get_for_model(Company)
         ct_member = ContentType.objects.get_for_model(Member)
@@ -48,41 +104,91 @@ class Command(BaseBatch):
             contracts__end_date__gte=first_day,
         ).distinct()
         # 有休作成済の社員
-        qs_existed = Member.objects.filter(
-            is_deleted=False,
-            paidvacation__end_date__gt=new_start_date,
-        ).distinct()
-        paid_vacation_period_list = Config.get_paid_vacation_intervals()
-        # 有休上限月数（これ以上超えると有休日数は増えない）
-        max_end_months = max([i[1] for i in paid_vacation_period_list])
-        cnt = 0
-        for member in qs_all_members.exclude(pk__in=qs_existed):
+        existed_member_ids = set(PaidVacation.objects.filter(
+            member__is_deleted=False,
+            end_date__gt=new_start_date,
+        ).values_list('member_id', flat=True).distinct())
+        members = [member for member in qs_all_members if member.pk not in existed_member_ids]
+        dict_period = {}
+        for member in members:
+            # 入社日のルールはmember.bizの一か所だけにする
             join_date = get_member_join_date(member)
-            # 入社月数
-            months = common.get_interval_months(join_date, new_start_date)
-            if months < max_end_months:
-                period_list = [i for i in paid_vacation_period_list if i[0] <= months < i[1]]
-                if len(period_list) == 0:
-                    continue
-                start_months, end_months, days = period_list[0]
+            period = self.get_grant_period(join_date, new_start_date, paid_vacation_period_list) if join_date else None
+            if period is not None:
+                dict_period[member.pk] = period
+        # 前年度の有休をまとめて取得し、前年度の有休がある社員だけ繰越日数を計算する
+        dict_previous = self.get_previous_paid_vacations(dict_period)
+        paid_vacation_list = []
+        for member in members:
+            if member.pk not in dict_period:
+                continue
+            start_date, end_date, days = dict_period[member.pk]
+            if member.pk in dict_previous:
+                carryover_days = PaidVacation.get_carryover_days(member, common.add_months(start_date, -1))
             else:
-                start_months, end_months, days = paid_vacation_period_list[-1]
-                start_index = int((months - 6) / 12)
-                start_months = start_index * 12 + 6
-                end_months = start_months + 12
-            start_date = common.get_first_day_by_month(common.add_months(join_date, start_months))
-            end_date = common.get_last_day_by_month(common.add_months(join_date, end_months - 1))
-            # 前年度の繰越日数を取得する
-            carryover_days = PaidVacation.get_carryover_days(member, common.add_months(start_date, -1))
-            PaidVacation.objects.create(
+                carryover_days = 0
+            paid_vacation_list.append(PaidVacation(
                 member=member,
                 start_date=start_date,
                 end_date=end_date,
                 days=days,
                 carryover_days=carryover_days,
-            )
-            cnt += 1
-        self.logger.info('{}件データを処理しました。'.format(cnt))
+            ))
+        PaidVacation.objects.bulk_create(paid_vacation_list, batch_size=constants.BATCH_CHUNK_SIZE)
+        self.logger.info('{}年{}月　{}件の有休を作成しました。'.format(
+            execute_date.year, execute_date.month, len(paid_vacation_list),
+        ))
+        return len(paid_vacation_list)
+
+    @classmethod
+    def get_previous_paid_vacations(cls, dict_period):
+        """新しい有休の開始日の前月に有効な有休（前年度の有休）を一回のクエリで取得する。
+
+        :param dict_period: 社員IDをキーとする新しい有休の（開始日、終了日、日数）
+        :return: 社員IDをキーとする前年度の有休
+        """
+        if not dict_period:
+            return {}
+        dict_previous_date = {
+            member_id: common.add_months(start_date, -1) for member_id, (start_date, end_date, days) in dict_period.items()
+        }
+        dict_previous = {}
+        for paid_vacation in PaidVacation.objects.filter(
+            member_id__in=list(dict_previous_date),
+            start_date__lte=max(dict_previous_date.values()),
+            end_date__gte=min(dict_previous_date.values()),
+        ):
+            previous_date = dict_previous_date[paid_vacation.member_id]
+            if paid_vacation.start_date <= previous_date <= paid_vacation.end_date:
+                dict_previous[paid_vacation.member_id] = paid_vacation
+        return dict_previous
+
+    @classmethod
+    def get_grant_period(cls, join_date, new_start_date, paid_vacation_period_list):
+        """入社日から有休の付与期間と日数を取得する。
+
+        :param join_date: 入社日
+        :param new_start_date: 新しい有休の開始日
+        :param paid_vacation_period_list: 有休付与期間のリスト（開始月数、終了月数、日数）
+        :return: 開始日、終了日、日数。付与対象外の場合はNone
+        """
+        # 有休上限月数（これ以上超えると有休日数は増えない）
+        max_end_months = max([i[1] for i in paid_vacation_period_list])
+        # 入社月数
+        months = common.get_interval_months(join_date, new_start_date)
+        if months < max_end_months:
+            period_list = [i for i in paid_vacation_period_list if i[0] <= months < i[1]]
+            if len(period_list) == 0:
+                return None
+            start_months, end_months, days = period_list[0]
+        else:
+            start_months, end_months, days = paid_vacation_period_list[-1]
+            start_index = int((months - 6) / 12)
+            start_months = start_index * 12 + 6
+            end_months = start_months + 12
+        start_date = common.get_first_day_by_month(common.add_months(join_date, start_months))
+        end_date = common.get_last_day_by_month(common.add_months(join_date, end_months - 1))
+        return start_date, end_date, days
 
     def get_batch_manager(self):
         """指定名称のバッチを取得する。
@@ -1,44 +1,124 @@
 import datetime
+import math
+import multiprocessing
+import time
+
+from django.apps import apps
+from django.db import connections, transaction
 
 from master.models import BatchManage
 from member.biz import set_member_status
 from member.models import Member
 from partner.models import PartnerMember
+from utils import constants
 from utils.django_base import BaseBatch
 
 
+def set_partition_status(partition):
+    """分割した社員の稼働状態を設定する。
+
+    プロセスプールのワーカーで実行する場合、フォーク元のDB接続を使わず、ワーカー自身の接続で処理する。
+
+    :param partition: (分割番号、モデル名、社員IDのリスト、年、月)
+    :return: (分割番号、モデル名、社員数、稼働数、処理時間)
+    """
+    index, model_label, pk_list, year, month = partition
+    model = apps.get_model(model_label)
+    start_time = time.perf_counter()
+    working_count = 0
+    # 分割ごとにまとめてコミットする
+    with transaction.atomic():
+        for member in model.objects.filter(pk__in=pk_list):
+            info = set_member_status(member, year, month)
+            if info.get('is_working'):
+                working_count += 1
+    return index, model_label, len(pk_list), working_count, time.perf_counter() - start_time
+
+
+def set_partition_status_in_worker(partition):
+    """プロセスプールのワーカーで分割した社員の稼働状態を設定する。
+
+    プールの終了時にワーカーは強制終了されるので、処理が終わったらワーカーのDB接続を閉じておく。
+
+    :param partition: set_partition_statusと同じ
+    :return: set_partition_statusと同じ
+    """
+    try:
+        return set_partition_status(partition)
+    finally:
+        connections.close_all()
+
+
+def split_pk_list(pk_list, workers):
+    """社員IDのリストをワーカー数で分割する。
+
+    :param pk_list: 社員IDのリスト
+    :param workers: ワーカー数
+    :return: 分割した社員IDのリストのリスト
+    """
+    if not pk_list:
+        return []
+    size = int(math.ceil(len(pk_list) / workers))
+    return [pk_list[i:i + size] for i in range(0, len(pk_list), size)]
+
+
 class Command(BaseBatch):
     BATCH_NAME = 'working_status'
     BATCH_TITLE = '稼働状態'
+    BATCH_ATOMIC = False  # ワーカーごとに自分のDB接続でコミットする
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            default=constants.WORKING_STATUS_WORKERS,
+            help='並列で処理するプロセス数（1の場合は並列処理しない）',
+        )
 
     def handle(self, *args, **options):
         today = datetime.date.today()
         year = today.strftime('%Y')
         month = today.strftime('%m')
+        workers = max(options.get('workers') or 1, 1)
+        if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            self.logger.warning('プロセスのフォークができないため、並列処理しません。')
+            workers = 1
         # 現在契約のある社員
-        member_list = list(Member.objects.public_all().filter(
-            contracts__start_date__lte=today,
-            contracts__end_date__gte=today,
-        ).distinct())
-        partner_member_list = list(PartnerMember.objects.public_all().filter(
-            contracts__start_date__lte=today,
-            contracts__end_date__gte=today,
-        ).distinct())
+        partitions = []
+        for model in (Member, PartnerMember):
+            pk_list = list(model.objects.public_all().filter(
+                contracts__start_date__lte=today,
+                contracts__end_date__gte=today,
+            ).distinct().order_by('pk').values_list('pk', flat=True))
+            for partition_pk_list in split_pk_list(pk_list, workers):
+                partitions.append((len(partitions) + 1, model._meta.label, partition_pk_list, year, month))
+
+        if workers > 1:
+            # フォーク前にDB接続を閉じて、ワーカーごとに新しく接続させる
+            connections.close_all()
+            pool = multiprocessing.get_context('fork').Pool(workers)
+            try:
+                results = pool.map(set_partition_status_in_worker, partitions, chunksize=1)
+            finally:
+                # ワーカーを強制終了せずに、DB接続を閉じてから終了させる
+                pool.close()
+                pool.join()
+        else:
+            results = [set_partition_status(partition) for partition in partitions]
+
         member_count = 0
-        waiting_count = 0
         working_count = 0
-        for member in member_list + partner_member_list:
-            member_count += 1
-            info = set_member_status(member, year, month)
-            if info.get('is_working'):
-                working_count += 1
-            else:
-                waiting_count += 1
-
+        for index, model_label, count, working, elapsed in results:
+            member_count += count
+            working_count += working
+            self.logger.info('分割{index}（{model}）：社員数：{count}／稼働数：{working}／処理時間 {elapsed:.3f}秒'.format(
+                index=index, model=model_label, count=count, working=working, elapsed=elapsed,
+            ))
         self.logger.info('社員数：{member_count}／稼働数：{working_count}／待機数：{waiting_count}'.format(
             member_count=member_count,
             working_count=working_count,
-            waiting_count=waiting_count,
+            waiting_count=member_count - working_count,
         ))
 
     def get_batch_manager(self):
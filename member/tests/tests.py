@@ -1,5 +1,16 @@
+import datetime
+import io
+import zipfile
+from unittest import mock
+
+import openpyxl as px
+from django.core.management import call_command
 from django.urls import reverse
-from utils.test_base import BaseAPITestCase
+from member.management.commands import working_status
+from member.models import Member
+from partner.models import PartnerMember
+from utils import constants
+from utils.test_base import BaseAPITestCase, QueryBudgetMixin
 
 
 # Create your tests here.
@@ -56,3 +67,112 @@ class MemberTest(BaseAPITestCase):
             ]
         })
 
+
+class WorkerRosterTest(BaseAPITestCase):
+
+    def setUp(self):
+        self.client.login(username='admin', password='admin')
+
+    def test_download_book(self):
+        response = self.client.get('/api/member/worker-rosters/', {'members': '10'})
+        self.assertEqual(response.status_code, 200)
+        book = px.load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len(book.worksheets), 1)
+
+    def test_download_zip(self):
+        response = self.client.get('/api/member/worker-rosters/', {'members': '10', 'file_type': 'zip'})
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as zf:
+            self.assertEqual(len(zf.infolist()), 1)
+            px.load_workbook(io.BytesIO(zf.read(zf.infolist()[0])))
+
+    def test_download_without_members(self):
+        response = self.client.get('/api/member/worker-rosters/')
+        self.assertEqual(response.status_code, 400)
+
+
+class MemberQueryBudgetTest(QueryBudgetMixin, BaseAPITestCase):
+
+    def setUp(self):
+        self.client.login(username='admin', password='admin')
+
+    def test_member_list(self):
+        response = self.assertApiQueryBudget('/api/member/members/', 10)
+        self.assertEqual(response.status_code, 200)
+
+    def test_organization_list(self):
+        response = self.assertApiQueryBudget('/api/org/organizations/', 10)
+        self.assertEqual(response.status_code, 200)
+
+
+class InProcessPool(object):
+    """プロセスプールの代わり（フォークせずに同じプロセスで実行する）"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.closed = False
+        self.joined = False
+
+    def map(self, func, iterable, chunksize=None):
+        return [func(item) for item in iterable]
+
+    def close(self):
+        self.closed = True
+
+    def join(self):
+        self.joined = True
+
+
+class WorkingStatusTest(BaseAPITestCase):
+
+    def get_target_members(self):
+        # 現在契約のある社員と協力社員
+        today = datetime.date.today()
+        return {
+            (model._meta.label, pk)
+            for model in (Member, PartnerMember)
+            for pk in model.objects.public_all().filter(
+                contracts__start_date__lte=today,
+                contracts__end_date__gte=today,
+            ).values_list('pk', flat=True)
+        }
+
+    def test_split_pk_list(self):
+        self.assertEqual(working_status.split_pk_list([], 2), [])
+        self.assertEqual(working_status.split_pk_list([1, 2, 3, 4, 5], 2), [[1, 2, 3], [4, 5]])
+        self.assertEqual(working_status.split_pk_list([1, 2], 4), [[1], [2]])
+
+    def test_set_status(self):
+        # 並列処理しない場合、現在契約のある社員ごとに稼働状態を設定すること
+        members = []
+
+        def set_member_status(member, year, month):
+            members.append((member._meta.label, member.pk))
+            return {'is_working': True}
+
+        with mock.patch.object(working_status, 'set_member_status', side_effect=set_member_status):
+            call_command('working_status', '--workers', '1')
+        self.assertEqual(sorted(members), sorted(self.get_target_members()))
+
+    def test_set_status_in_pool(self):
+        # 並列処理の場合、フォーク前にDB接続を閉じ、ワーカーは処理後にDB接続を閉じてから終了すること
+        pools = []
+
+        def get_pool(workers):
+            pools.append(InProcessPool(workers))
+            return pools[-1]
+
+        members = []
+        with mock.patch.object(working_status, 'set_member_status', side_effect=lambda member, year, month: (
+            members.append((member._meta.label, member.pk)) or {'is_working': False}
+        )), mock.patch.object(working_status.multiprocessing, 'get_context') as get_context, \
+                mock.patch.object(working_status.connections, 'close_all') as close_all:
+            get_context.return_value.Pool.side_effect = get_pool
+            call_command('working_status')
+        get_context.assert_called_once_with('fork')
+        self.assertEqual(len(pools), 1)
+        self.assertEqual(pools[0].workers, constants.WORKING_STATUS_WORKERS)
+        self.assertTrue(pools[0].closed and pools[0].joined)
+        # フォーク前の一回と、分割ごとの一回
+        self.assertGreater(close_all.call_count, 1)
+        self.assertEqual(sorted(members), sorted(self.get_target_members()))
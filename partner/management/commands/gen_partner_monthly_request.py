@@ -1,19 +1,20 @@
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q, CharField
-from django.db.models.functions import Concat
+from django.db.models import Q
 from django.utils import timezone
 
 from master.models import BatchManage
 from contract.models import Contract
 from partner.models import PartnerCompany, PartnerMember, PartnerMonthlyRequest
 from utils import common, constants
+from utils.app_base import create_monthly_requests, diff_monthly_requests
 from utils.django_base import BaseBatch
 
 
 class Command(BaseBatch):
     BATCH_NAME = 'gen_partner_monthly_request'
     BATCH_TITLE = '月別の協力社員請求情報作成'
-    help = '''今月から六か月まで先の協力社員月別請求を作成
+    help = '''来月から六か月先までの全ての月の協力社員月別請求を作成（六か月先の一か月分だけではない）
+    既存の月別請求と比較して、不要または契約変更後の未使用分だけを削除し、足りない分だけを作成する。
     '''
 
     def add_arguments(self, parser):
@@ -26,43 +27,41 @@ class Command(BaseBatch):
 
     def handle(self, *args, **options):
         execute_date = self.get_date_argument('date', **options)
-        execute_date = common.add_months(execute_date, constants.PARTNER_MEMBER_MONTHLY_REQUEST_FORWARD + 1)
-        year = execute_date.strftime('%Y')
-        month = execute_date.strftime('%m')
+        month_list = [
+            common.add_months(execute_date, i) for i in range(1, constants.PARTNER_MEMBER_MONTHLY_REQUEST_FORWARD + 2)
+        ]
+        first_day = common.get_first_day_by_month(month_list[0])
+        last_day = common.get_last_day_by_month(month_list[-1])
+        ym_from = common.get_ym(first_day.year, first_day.month)
+        ym_to = common.get_ym(last_day.year, last_day.month)
         company_content_type = ContentType.objects.get_for_model(PartnerCompany)
         member_content_type = ContentType.objects.get_for_model(PartnerMember)
-        cnt = 0
-        # 今月から七か月目　注文書またはBP請求書未作成の月別請求情報を削除する。
-        PartnerMonthlyRequest.objects.annotate(
-            start_ym=Concat('year', 'month', output_field=CharField()),
-            end_ym=Concat('end_year', 'end_month', output_field=CharField()),
-        ).filter(
-            Q(year=year, month=month, end_year=None, end_month=None) |
-            Q(start_ym__lte=year + month, end_ym__gte=year + month),
-            is_submitted=False,
-        ).delete()
-        # 注文書またはBP請求書作成済の月別請求情報
-        qs_monthly_request = PartnerMonthlyRequest.objects.filter(
-            year=year,
-            month=month,
-        )
-        # 今月から七か月目の月別請求情報を作成する。
-        for contract in Contract.objects.filter(
+        contracts = {contract.pk: contract for contract in Contract.objects.filter(
             Q(company_content_type=company_content_type) | Q(company_content_type=member_content_type),
             is_deleted=False,
-            start_date__lte=common.get_last_day_by_month(execute_date),
-            end_date__gte=common.get_first_day_by_month(execute_date),
-        ).exclude(
-            partnermonthlyrequest__in=qs_monthly_request,
-        ):
-            PartnerMonthlyRequest.create_monthly_request(None, contract, year, month)
-            self.logger.debug('{}の{}年{}月の請求情報を作成しました。'.format(
-                contract.content_object,
-                year,
-                month,
-            ))
-            cnt += 1
-        self.logger.info('{}年{}月に{}件データを処理しました。'.format(year, month, cnt))
+            start_date__lte=last_day,
+            end_date__gte=first_day,
+        )}
+        # 期間と重なる既存の月別請求、および一括契約の期間前から始まり、期間まで続く月別請求と比較する
+        blanket_contract_id_list = [pk for pk, contract in contracts.items() if contract.is_blanket_contract]
+        qs_monthly_request = PartnerMonthlyRequest.objects.overlapping(ym_from, ym_to) | \
+            PartnerMonthlyRequest.objects.filter(
+                Q(end_ym__isnull=True) | Q(end_ym__gte=ym_from),
+                contract_id__in=blanket_contract_id_list,
+                ym__isnull=False,
+            )
+        if PartnerMonthlyRequest.objects.filter(contract_id__in=list(contracts), ym__isnull=True).exists():
+            self.logger.warn(constants.WARN_YM_NOT_SYNCED.format(name='協力社員の月別請求'))
+        deleted_pk_list, created = diff_monthly_requests(contracts, month_list, qs_monthly_request.values_list(
+            'pk', 'contract_id', 'ym', 'end_ym', 'is_submitted', 'updated_dt',
+        ))
+        if deleted_pk_list:
+            PartnerMonthlyRequest.objects.filter(pk__in=deleted_pk_list).delete()
+        # 期間中の全ての月別請求を一つのトランザクションで登録する
+        cnt = create_monthly_requests(PartnerMonthlyRequest, [
+            (contracts[contract_id], '%04d' % (ym // 100), '%02d' % (ym % 100)) for contract_id, ym in created
+        ], with_content_object=False)
+        self.logger.info('{}件削除、{}件作成しました。'.format(len(deleted_pk_list), cnt))
 
     def get_batch_manager(self):
         """指定名称のバッチを取得する。
@@ -1,18 +1,24 @@
+import datetime
+import uuid
+
 from django.db import transaction
-from django.db.models import CharField
-from django.db.models.functions import Concat
+from django.db.models import Prefetch
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from master.models import BatchManage
-from partner.models import PartnerOrder
+from partner.models import PartnerOrder, PartnerRequestDetail
 from turnover.biz import add_partner_cost
 from turnover.models import MonthlyCost
+from utils import common, constants
 from utils.django_base import BaseBatch
+from utils.model_base import get_ym_lte_q, get_ym_gte_q
 
 
 class Command(BaseBatch):
     BATCH_NAME = 'partner_cost'
     BATCH_TITLE = '協力会社コスト'
+    BATCH_ATOMIC = False  # 注文書のチャンクごとにコミットする
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -21,48 +27,132 @@ class Command(BaseBatch):
             default=timezone.localtime().date(),
             help='コスト計算対象日',
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            dest='chunk_size',
+            default=constants.BATCH_CHUNK_SIZE,
+            help='一回でコミットする注文書件数',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            dest='resume',
+            default=False,
+            help='前回中断した位置から再開する（指定しない場合は最初から作成し直す）\n'
+                 '中断してから1日過ぎた場合、または対象の注文書・明細が変更された場合は再開しない',
+        )
 
-    @transaction.atomic
     def handle(self, *args, **options):
         execute_date = self.get_date_argument('date', **options)
         year = execute_date.strftime('%Y')
         month = execute_date.strftime('%m')
-        # 指定月に作成済のコスト情報を削除
-        # 協力社員以外の社員と個人事業主のpartner_companyは全部空白
-        qs_existed = MonthlyCost.objects.filter(partner_company__isnull=False, year=year, month=month)
-        delete_cnt, dict_cnt = qs_existed.delete()
-        self.logger.info('{year}年{month}月　{count}件の協力社員コスト情報が削除しました。'.format(
-            year=year, month=month, count=delete_cnt,
-        ))
-        qs_order = PartnerOrder.objects.annotate(
-                start_ym=Concat('year', 'month', output_field=CharField()),
-                end_ym=Concat('end_year', 'end_month', output_field=CharField()),
-        ).filter(
-                is_deleted=False,
-                start_ym__lte=year + month,
-                end_ym__gte=year + month,
-                member__isnull=False,
-                company__isnull=False,
+        ym = common.get_ym(year, month)
+        chunk_size = options.get('chunk_size') or constants.BATCH_CHUNK_SIZE
+        # 注文書は年月を文字列結合せずに比較する（インデックスを使うため）
+        qs_order = PartnerOrder.objects.filter(
+            get_ym_lte_q(year, month),
+            get_ym_gte_q(year, month, 'end_year', 'end_month'),
+            is_deleted=False,
+            member__isnull=False,
+            company__isnull=False,
+        ).order_by('pk')
+        qs_detail = PartnerRequestDetail.objects.filter(is_deleted=False)
+        if qs_detail.filter(ym__isnull=True).exists():
+            # 整数の年月が未設定のデータが残っている間は文字列の年月で検索する（未設定の明細のコストが漏れないように）
+            self.logger.warn(constants.WARN_YM_NOT_SYNCED.format(name='協力会社の請求明細'))
+            qs_detail = qs_detail.filter(year=year, month=month)
+        else:
+            qs_detail = qs_detail.filter(ym=ym)
+        checkpoint = self.get_resume_checkpoint(ym, qs_order, qs_detail) if options.get('resume') else None
+        if checkpoint:
+            last_order_id = checkpoint.get('order_id')
+            if last_order_id:
+                self.logger.info(constants.INFO_BATCH_RESUME.format(
+                    year=year, month=month, name='注文書', id=last_order_id,
+                ))
+            else:
+                self.logger.info(constants.INFO_BATCH_RESUME_FROM_START.format(year=year, month=month, name='注文書'))
+        else:
+            last_order_id = None
+            checkpoint = {'run_id': uuid.uuid4().hex, 'ym': ym, 'started': timezone.now().isoformat(), 'order_id': None}
+            # 指定月に作成済のコスト情報を削除
+            # 協力社員以外の社員と個人事業主のpartner_companyは全部空白
+            with transaction.atomic():
+                qs_existed = MonthlyCost.objects.filter(partner_company__isnull=False, year=year, month=month)
+                delete_cnt, dict_cnt = qs_existed.delete()
+                transaction.on_commit(lambda data=dict(checkpoint): self.save_checkpoint(data))
+            self.logger.info('{year}年{month}月　{count}件の協力社員コスト情報が削除しました。'.format(
+                year=year, month=month, count=delete_cnt,
+            ))
+        if last_order_id:
+            qs_order = qs_order.filter(pk__gt=last_order_id)
+        order_id_list = list(qs_order.values_list('pk', flat=True))
+        qs_detail = qs_detail.select_related(
+            'project_member__project',
+        ).prefetch_related(
+            'project_member__member_content_object',
         )
         cnt_add = 0
-        for order in qs_order:
-            for partner_request_detail in order.partnerrequestdetail_set.filter(
-                    is_deleted=False, year=year, month=month
-            ):
-                project_member = partner_request_detail.project_member
-                add_partner_cost(
-                    order.company,
-                    project_member.member_content_object,
-                    year,
-                    month,
-                    project_member.project,
-                    partner_request_detail
+        for i in range(0, len(order_id_list), chunk_size):
+            chunk_order_id_list = order_id_list[i:i + chunk_size]
+            with transaction.atomic():
+                for order in PartnerOrder.objects.filter(
+                    pk__in=chunk_order_id_list,
+                ).select_related(
+                    'company',
+                ).prefetch_related(
+                    Prefetch('partnerrequestdetail_set', queryset=qs_detail, to_attr='target_details'),
+                ).order_by('pk'):
+                    for partner_request_detail in order.target_details:
+                        project_member = partner_request_detail.project_member
+                        add_partner_cost(
+                            order.company,
+                            project_member.member_content_object,
+                            year,
+                            month,
+                            project_member.project,
+                            partner_request_detail
+                        )
+                        cnt_add += 1
+                # コミットしてから処理済の位置を保存する
+                transaction.on_commit(
+                    lambda data=dict(checkpoint, order_id=chunk_order_id_list[-1]): self.save_checkpoint(data)
                 )
-                cnt_add += 1
+        self.clear_checkpoint()
         self.logger.info('{year}年{month}月　{count}件の協力社員コスト情報が追加しました。'.format(
             year=year, month=month, count=cnt_add,
         ))
 
+    def get_resume_checkpoint(self, ym, qs_order, qs_detail):
+        """前回中断した位置を取得する。
+
+        対象月が違う場合、中断してから有効期間が過ぎた場合、
+        または前回の開始後に対象の注文書・明細が変更された場合は、再開しない。
+
+        :param ym: 対象年月（例：202004）
+        :param qs_order: 対象の注文書
+        :param qs_detail: 対象の明細
+        :return: 再開できない場合はNone
+        """
+        checkpoint = self.get_checkpoint()
+        if not checkpoint or not checkpoint.get('run_id'):
+            reason = '中断した位置がありません'
+        elif checkpoint.get('ym') != ym:
+            reason = '対象月が違います'
+        else:
+            started = parse_datetime(checkpoint.get('started') or '')
+            if started is None or timezone.now() - started > datetime.timedelta(
+                    seconds=constants.BATCH_CHECKPOINT_EXPIRE
+            ):
+                reason = '有効期間が過ぎました'
+            elif qs_order.filter(updated_dt__gt=started).exists() or qs_detail.filter(updated_dt__gt=started).exists():
+                reason = '前回の開始後に注文書または明細が変更されました'
+            else:
+                return checkpoint
+        self.logger.warn(constants.WARN_BATCH_CANNOT_RESUME.format(reason=reason))
+        return None
+
     def get_batch_manager(self):
         """指定名称のバッチを取得する。
 
@@ -5,6 +5,7 @@ from contract.models import Contract
 from master.models import BatchManage
 from project.models import ProjectMemberMonthlyRequest, ProjectMember
 from utils import common, constants
+from utils.app_base import create_monthly_requests
 from utils.django_base import BaseBatch
 
 
@@ -19,37 +20,54 @@ class Command(BaseBatch):
             default=timezone.localtime().date(),
             help='請求作成対象日'
         )
+        parser.add_argument(
+            '--months',
+            type=int,
+            dest='months',
+            default=1,
+            help='対象月から何か月分の請求情報を作成する',
+        )
 
     def handle(self, *args, **options):
         execute_date = self.get_date_argument('date', **options)
         execute_date = common.add_months(execute_date, constants.PROJECT_MEMBER_MONTHLY_REQUEST_FORWARD + 1)
-        year = execute_date.strftime('%Y')
-        month = execute_date.strftime('%m')
+        months = max(options.get('months') or 1, 1)
+        month_list = [common.add_months(execute_date, i) for i in range(months)]
+        first_day = common.get_first_day_by_month(month_list[0])
+        last_day = common.get_last_day_by_month(month_list[-1])
+        ym_from = common.get_ym(first_day.year, first_day.month)
+        ym_to = common.get_ym(last_day.year, last_day.month)
         ct_pm = ContentType.objects.get_for_model(ProjectMember)
         # 未使用の月別請求情報を削除してから再作成する。
         ProjectMemberMonthlyRequest.objects.filter(
-            year=year,
-            month=month,
+            ym__gte=ym_from,
+            ym__lte=ym_to,
             is_submitted=False,
         ).delete()
-        cnt = 0
-        for contract in Contract.objects.filter(
+        # 作成済（削除できない）の月別請求情報
+        existed = set(ProjectMemberMonthlyRequest.objects.filter(
+            ym__gte=ym_from,
+            ym__lte=ym_to,
+        ).values_list('contract_id', 'ym'))
+        # 対象期間中の契約をまとめて取得し、月ごとに振り分ける
+        contracts = list(Contract.objects.filter(
             is_deleted=False,
             content_type=ct_pm,
-            start_date__lte=common.get_last_day_by_month(execute_date),
-            end_date__gte=common.get_first_day_by_month(execute_date),
-        ).exclude(
-            projectmembermonthlyrequest__year=year,
-            projectmembermonthlyrequest__month=month,
-        ):
-            project_member = contract.content_object
-            ProjectMemberMonthlyRequest.create_monthly_request(project_member, contract, year, month)
-            self.logger.debug('{}の{}年{}月の請求情報を作成しました。'.format(
-                project_member,
-                year,
-                month,
+            start_date__lte=last_day,
+            end_date__gte=first_day,
+        ))
+        targets = []
+        for date in month_list:
+            year = date.strftime('%Y')
+            month = date.strftime('%m')
+            ym = common.get_ym(year, month)
+            targets.extend((contract, year, month) for contract in contracts if (
+                contract.start_date <= common.get_last_day_by_month(date)
+                and contract.end_date >= common.get_first_day_by_month(date)
+                and (contract.pk, ym) not in existed
             ))
-            cnt += 1
+        # 対象期間の全ての月別請求を一つのトランザクションで登録する
+        cnt = create_monthly_requests(ProjectMemberMonthlyRequest, targets)
         self.logger.info('{}件データを処理しました。'.format(cnt))
 
     def get_batch_manager(self):
@@ -43,6 +43,19 @@ CORS_ORIGIN_ALLOW_ALL = False
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5 * 1024 * 1024
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 EMAIL_USE_TLS = True
+# メール添付ファイルのZIPの暗号化方式（zipcrypto：Windowsで解凍できるがPythonで処理するので遅い／aes：pyzipperが必要）
+EMAIL_ZIP_ENCRYPTION = 'zipcrypto'
+FIREBASE_CREDENTIALS = os.path.join(BASE_DIR, 'data', 'sales-yang-firebase-adminsdk-2ga7e-17745491f0.json')
+# 通知の送信方法（utils.firebase.FirebaseBackend／NullBackend／RecordingBackend）
+FIREBASE_BACKEND = 'utils.firebase.RecordingBackend' if 'test' in sys.argv else 'utils.firebase.FirebaseBackend'
+# PDFの変換方法（utils.pdf.RemotePdfBackend：PDF変換API／LocalPdfBackend：weasyprint）
+PDF_BACKEND = 'utils.pdf.RemotePdfBackend'
+# 書類に埋め込む印鑑画像を縮小するか（Pillowが必要、印刷時の画質が変わるのでデフォルトは無効）
+STAMP_OPTIMIZE = False
+# リクエストごとのSQL件数を記録するか（DEBUGの場合は常に記録する）
+QUERY_COUNT_ENABLED = False
+# 操作ログを別スレッドでまとめて登録するか（テストの場合はその場で登録する）
+AUDIT_LOG_ASYNC = 'test' not in sys.argv
 
 # Application definition
 
@@ -83,6 +96,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'middleware.request.RequestMiddleware',
 ]
+if DEBUG or QUERY_COUNT_ENABLED:
+    MIDDLEWARE.insert(1, 'utils.query_counter.QueryCountMiddleware')
 
 ROOT_URLCONF = 'sales.urls'
 
@@ -100,6 +115,9 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            'libraries': {
+                'stamp': 'utils.templatetags.stamp',
+            },
         },
     },
 ]
@@ -212,6 +230,10 @@ if not os.path.exists(MEDIA_ROOT):
 LOG_ROOT = os.path.join(BASE_DIR, "log")
 if not os.path.exists(LOG_ROOT):
     os.mkdir(LOG_ROOT)
+# 作成したファイルのキャッシュ（/media/で公開されないように、MEDIA_ROOTの外に置く）
+DOCUMENT_CACHE_ROOT = os.path.join(BASE_DIR, "cache", "document")
+# 添付ファイルとして保存する前のアップロードしたファイル（公開しないので、MEDIA_ROOTの外に置く）
+UPLOAD_ROOT = os.path.join(BASE_DIR, "upload")
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
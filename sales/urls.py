@@ -24,6 +24,7 @@ from rest_framework_jwt.views import obtain_jwt_token
 from rest_framework.documentation import include_docs_urls
 
 from utils import constants
+from utils.rest_base import FileUploadApiView, WorkerRosterDownloadApiView
 
 
 def custom404(request, exception=None):
@@ -41,7 +42,9 @@ urlpatterns = [
     url(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
     url(r'^api-auth/', include('rest_framework.urls')),
     url(r'^api/token-auth/', obtain_jwt_token),
+    url(r'^api/upload/$', FileUploadApiView.as_view()),
     url(r'^api/account/', include('account.urls')),
+    url(r'^api/member/worker-rosters/$', WorkerRosterDownloadApiView.as_view()),
     url(r'^api/member/', include('member.urls')),
     url(r'^api/master/', include('master.urls')),
     url(r'^api/org/', include('org.urls')),
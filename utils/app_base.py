@@ -1,22 +1,28 @@
 import os
+import io
 import datetime
-import requests
+import pathlib
+import threading
 import random
 import base64
-import subprocess
+from collections import defaultdict
 
 from django.conf import settings
 from django.core.signing import TimestampSigner, SignatureExpired
-from django.contrib.admin.models import LogEntry, ADDITION, CHANGE, DELETION
-from django.contrib.contenttypes.models import ContentType
+from django.contrib.admin.models import ADDITION, CHANGE, DELETION
 from django.contrib.humanize.templatetags import humanize
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 
-from master.models import Config, Holiday
+from master.models import Config
 from org.models import Organization
-from utils import constants, common, jpholiday
+from utils import constants, common, business_calendar, archive, audit, pdf
+from utils.document_cache import document_cache
 from utils.errors import CustomException
 
 signer = TimestampSigner()
+_stamp_cache = {}
+_stamp_lock = threading.Lock()
 
 
 def get_tmp_path():
@@ -92,12 +98,48 @@ def get_member_expense_template_path(is_row_over=False):
 
 
 def convert_html_to_pdf(html):
-    url = Config.get_convert_to_pdf_api()
-    try:
-        res = requests.post(url, {'content': html})
-    except requests.exceptions.ConnectionError:
-        raise CustomException(constants.ERROR_CANNOT_ESTABLISH_CONNECTION.format(name='PDFサーバー'))
-    return res.status_code, res
+    """HTMLをPDFに変換する。
+
+    同じHTMLから作成済のPDFがあれば、変換APIを呼ばずにキャッシュから返す。
+
+    :param html: HTML
+    :return: ステータスコード、レスポンス
+    """
+    key = document_cache.make_content_key(html)
+    content = document_cache.get(key, '.pdf')
+    if content is not None:
+        return 200, pdf.PdfResponse(content)
+    status_code, res = pdf.render(html)
+    if status_code == 200:
+        document_cache.set(key, '.pdf', res.content)
+    return status_code, res
+
+
+def convert_html_list_to_pdf(html_list):
+    """複数のHTMLを同時にPDFに変換する。
+
+    キャッシュにないHTMLだけを変換し、変換できたPDFはキャッシュする。
+
+    :param html_list: HTMLのリスト
+    :return: HTMLと同じ順番の（ステータスコード、レスポンス）のリスト
+    """
+    keys = [document_cache.make_content_key(html) for html in html_list]
+    dict_results = dict()
+    missing = dict()
+    for key, html in zip(keys, html_list):
+        if key in dict_results or key in missing:
+            continue
+        content = document_cache.get(key, '.pdf')
+        if content is None:
+            missing[key] = html
+        else:
+            dict_results[key] = (200, pdf.PdfResponse(content))
+    # 同じHTMLは一回だけ変換する
+    for key, (status_code, res) in zip(missing, pdf.render_many(list(missing.values()))):
+        if status_code == 200:
+            document_cache.set(key, '.pdf', res.content)
+        dict_results[key] = (status_code, res)
+    return [dict_results[key] for key in keys]
 
 
 def is_date_conflict(cls, pk, **kwargs):
@@ -218,27 +260,20 @@ def check_file_size_limit(data):
 def log_action(user, instance, action_flg, message):
     """ログを記録する
 
+    ログはトランザクションのコミット後にまとめて登録する（utils.audit）。
+
     :param user: ログインユーザー
     :param instance: 変更対象のオブジェクト
     :param action_flg: 操作（追加／変更／削除）
     :param message: メッセージ
     :return:
     """
-    LogEntry.objects.log_action(
-        user.id,
-        ContentType.objects.get_for_model(instance).pk,
-        instance.pk,
-        str(instance),
-        action_flg,
-        change_message=message
-    )
+    audit.log_action(user, instance, action_flg, message)
 
 
 def log_action_for_add(user, instance):
-    added_data = []
-    for field in instance._meta.fields:
-        added_data.append('{}を {} に設定しました。'.format(field.verbose_name, getattr(instance, field.name)))
-    log_action(user, instance, ADDITION, '\n'.join(added_data))
+    # 関連オブジェクトを取得しないように、値はインスタンスの__dict__から取得する
+    log_action(user, instance, ADDITION, audit.get_added_message(instance))
 
 
 def log_action_for_delete(user, instance):
@@ -286,21 +321,107 @@ def create_monthly_request(content_object, contract, cls_monthly_request, qs_mon
     date = datetime.date.today()
     date = common.add_months(date, forward_months)
     last_day = common.get_last_day_by_month(date)
+    # 既存の月別請求を一回で取得する
+    submitted = set()
+    unsubmitted = []
+    for pk, year, month, is_submitted in qs_monthly_request.filter(contract=contract).values_list(
+            'pk', 'year', 'month', 'is_submitted'
+    ):
+        if is_submitted:
+            submitted.add((year, month))
+        else:
+            unsubmitted.append((pk, year, month))
+    target_months = []
     tmp_date = contract.start_date
     while tmp_date <= last_day and tmp_date <= contract.end_date:
         year = tmp_date.strftime('%Y')
         month = tmp_date.strftime('%m')
         tmp_date = common.add_months(tmp_date, 1)
-        qs = qs_monthly_request.filter(year=year, month=month, contract=contract)
-        if qs.filter(is_submitted=True).count() > 0:
+        if (year, month) in submitted:
             continue
-        qs.delete()
-        cls_monthly_request.create_monthly_request(
-            content_object, contract, year, month
-        )
+        target_months.append((year, month))
         if contract.is_blanket_contract:
             # 一括契約の場合月別請求は一件しかないのです。
             break
+    # 再作成する月の未使用の月別請求をまとめて削除する
+    deleted_pk_list = [pk for pk, year, month in unsubmitted if (year, month) in target_months]
+    if deleted_pk_list:
+        qs_monthly_request.filter(pk__in=deleted_pk_list).delete()
+    for year, month in target_months:
+        cls_monthly_request.create_monthly_request(
+            content_object, contract, year, month
+        )
+
+
+def diff_monthly_requests(contracts, month_list, monthly_requests):
+    """期間中にあるべき（契約、年月）と既存の月別請求を比較して、削除・作成する月別請求を決める。
+
+    一括契約の月別請求は一件しかないので、期間前から始まる月別請求（終了年月なしを含む）があれば作成しない。
+
+    :param contracts: 契約IDをキーとする契約の辞書
+    :param month_list: 対象月（各月の日付）のリスト
+    :param monthly_requests: 既存の月別請求（ID、契約ID、年月、終了年月、作成済か、更新日時）のリスト
+    :return: 削除する月別請求IDのリスト、作成する（契約ID、年月）のリスト
+    """
+    ym_from = common.get_ym(month_list[0].year, month_list[0].month)
+    # 期間中にあるべき（契約、年月）
+    desired = set()
+    for contract in contracts.values():
+        for date in month_list:
+            if contract.start_date <= common.get_last_day_by_month(date) and \
+                    contract.end_date >= common.get_first_day_by_month(date):
+                desired.add((contract.pk, common.get_ym(date.year, date.month)))
+                if contract.is_blanket_contract:
+                    # 一括契約の場合月別請求は一件しかないのです。
+                    break
+    deleted_pk_list = []
+    covered = defaultdict(list)  # 契約ごとの残す月別請求の（開始年月、終了年月）
+    for pk, contract_id, ym, end_ym, is_submitted, updated_dt in monthly_requests:
+        if ym is None:
+            # 整数の年月が未設定（sync_ym未実行）の月別請求は比較できない
+            continue
+        contract = contracts.get(contract_id)
+        # 注文書またはBP請求書未作成で、不要または契約が変更された月別請求は削除する。
+        # 期間前から始まる月別請求は対象外
+        if not is_submitted and ym >= ym_from and (
+            (contract_id, ym) not in desired or (contract and contract.updated_dt > updated_dt)
+        ):
+            deleted_pk_list.append(pk)
+        else:
+            covered[contract_id].append((ym, end_ym or ym))
+    # 既存の月別請求で対応できない（契約、年月）を作成する
+    created = []
+    for contract_id, ym in sorted(desired):
+        if contracts[contract_id].is_blanket_contract and covered[contract_id]:
+            continue
+        if not any(start_ym <= ym <= end_ym for start_ym, end_ym in covered[contract_id]):
+            created.append((contract_id, ym))
+    return deleted_pk_list, created
+
+
+def create_monthly_requests(cls_monthly_request, targets, with_content_object=True):
+    """複数契約・複数月の月別請求をまとめて作成する。
+
+    契約者（案件メンバー／協力社員）は一回のクエリでまとめて取得し、
+    基準時間の計算に使う営業日カレンダーも事前に作成しておく。
+    月別請求の内容と登録はモデルのcreate_monthly_requestで行い、全件を一つのトランザクションで登録する。
+
+    :param cls_monthly_request: 月別請求クラス
+    :param targets: （契約、対象年、対象月）のリスト
+    :param with_content_object: 契約者を月別請求に渡すか
+    :return: 作成件数
+    """
+    targets = list(targets)
+    if with_content_object:
+        prefetch_related_objects([contract for contract, year, month in targets], 'content_object')
+    for year in sorted({int(year) for contract, year, month in targets}):
+        business_calendar.get_calendar(year)
+    with transaction.atomic():
+        for contract, year, month in targets:
+            cls_monthly_request.create_monthly_request(
+                contract.content_object if with_content_object else None, contract, year, month
+            )
+    return len(targets)
 
 
 def get_base_amount_memo(amount, is_hourly_pay=False, is_fixed_pay=False):
@@ -346,14 +467,69 @@ def get_plus_per_hour_memo(minus_per_hour, is_hourly_pay, is_fixed_pay):
         return Config.get_partner_order_plus_per_hour().format(amount=humanize.intcomma(minus_per_hour))
 
 
+def get_company_square_signature_path():
+    return os.path.join(get_media_root(), 'stamp/square_signature.png')
+
+
 def get_company_square_signature_base64():
     """会社の角印を取得する。
 
+    エンコード済の画像をファイルの更新日時が変わるまでキャッシュする。
+    設定（STAMP_OPTIMIZE）が有効な場合は、縮小してからエンコードする。
+
+    :return:
+    """
+    path = get_company_square_signature_path()
+    is_optimize = getattr(settings, 'STAMP_OPTIMIZE', False)
+    version = (os.stat(path).st_mtime_ns, is_optimize)
+    with _stamp_lock:
+        cached = _stamp_cache.get(path)
+        if cached and cached[0] == version:
+            return cached[1]
+        if is_optimize:
+            data = optimize_stamp_image(path, constants.STAMP_MAX_PIXELS)
+        else:
+            with open(path, 'rb') as f:
+                data = f.read()
+        value = 'data:image/png;base64,%s' % (base64.b64encode(data).decode("ascii"),)
+        _stamp_cache[path] = (version, value)
+        return value
+
+
+def get_company_square_signature_src():
+    """テンプレートの<img src="">に設定する会社の角印を取得する。
+
+    ローカルでPDFに変換する場合はファイルのパスを参照し、HTMLに画像を埋め込まない。
+    画像を変更した場合にキャッシュしたPDFを使わないように、更新日時をURIのフラグメントに付ける。
+
     :return:
     """
-    path = os.path.join(get_media_root(), 'stamp/square_signature.png')
-    data = open(path, 'rb').read()
-    return 'data:image/png;base64,%s' % (base64.b64encode(data).decode("ascii"),)
+    if isinstance(pdf.get_backend(), pdf.LocalPdfBackend):
+        path = get_company_square_signature_path()
+        return '{}#{}'.format(pathlib.Path(path).as_uri(), os.stat(path).st_mtime_ns)
+    return get_company_square_signature_base64()
+
+
+def optimize_stamp_image(path, max_pixels):
+    """印鑑の画像を縮小する（Pillowがない場合はそのまま）。
+
+    :param path: 画像のパス
+    :param max_pixels: 縦横の最大ピクセル
+    :return: PNGのバイナリーデータ
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+    with Image.open(io.BytesIO(data)) as image:
+        if max(image.size) <= max_pixels:
+            return data
+        image.thumbnail((max_pixels, max_pixels), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
 
 
 def get_user_fullname(user):
@@ -377,8 +553,7 @@ def get_business_days(year, month):
     :param month:
     :return:
     """
-    dates = get_dates(year, month)
-    return [item.get('date') for item in dates if item.get('is_holiday') is False]
+    return business_calendar.business_days(year, month)
 
 
 def get_dates(year, month):
@@ -388,43 +563,7 @@ def get_dates(year, month):
     :param month: 対象月
     :return:
     """
-    first_day = datetime.date(int(year), int(month), 1)
-    last_day = common.get_last_day_by_month(first_day)
-    lst_holiday = list(Holiday.objects.filter(
-        is_deleted=False,
-        date__lte=last_day,
-        date__gte=first_day,
-    ))
-    dates = []
-    tmp_date = first_day
-    while tmp_date <= last_day:
-        if tmp_date.weekday() in (5, 6):
-            dates.append({
-                'date': tmp_date,
-                'is_holiday': True,
-                'name': '休日',
-            })
-        elif jpholiday.is_holiday(tmp_date):
-            dates.append({
-                'date': tmp_date,
-                'is_holiday': True,
-                'name': jpholiday.get_holiday_name(tmp_date),
-            })
-        elif len([i for i in lst_holiday if i.date == tmp_date]) > 0:
-            holiday = [i for i in lst_holiday if i.date == tmp_date][0]
-            dates.append({
-                'date': tmp_date,
-                'is_holiday': True,
-                'name': holiday.name,
-            })
-        else:
-            dates.append({
-                'date': tmp_date,
-                'is_holiday': False,
-                'name': None,
-            })
-        tmp_date += datetime.timedelta(days=1)
-    return dates
+    return business_calendar.get_dates(year, month)
 
 
 def get_min_hours_by_month(calculate_type, year, month, default_hours):
@@ -465,11 +604,7 @@ def get_payment_notice_deadline(year, month):
     """
     date = datetime.date(int(year), int(month), 1)
     next_month = common.add_months(date, 1)
-    business_days = get_business_days(next_month.year, next_month.month)
-    if len(business_days) > 5:
-        return business_days[5]
-    else:
-        return next_month
+    return business_calendar.nth_business_day(next_month.year, next_month.month, 6) or next_month
 
 
 def compress_multi_files(file_bytes, password=None):
@@ -479,28 +614,7 @@ def compress_multi_files(file_bytes, password=None):
     :param password: パスワード
     :return:
     """
-    tmp_files = []
-    # tmpフォルダー配下の一時フォルダーを取得する
-    tmp_path = get_sub_tmp_path()
-    tmp_files.append(tmp_path)
-    tmp_zip = get_tmp_file('zip')
-    tmp_files.append(tmp_zip)
-    for filename, tmp_file in file_bytes:
-        new_path = os.path.join(tmp_path, filename)
-        tmp_files.append(new_path)
-        # バイナリーファイルを一時ファイルに書き込む
-        with open(new_path, 'wb') as f:
-            f.write(tmp_file)
-    # tmpフォルダー配下すべてのファイル名をUTF8からShift-JISに変換する
-    subprocess.call(["convmv", "-r", "-f", "utf8", '-t', 'cp932', '--notest', tmp_path.rstrip('/') + '/'])
-    # 一時フォルダーを圧縮する
-    if password:
-        command = "zip --password {0} -j {1} {2}/*".format(password, tmp_zip, tmp_path.rstrip('/'))
-    else:
-        command = "zip -j {0} {1}/*".format(tmp_zip, tmp_path.rstrip('/'))
-    subprocess.call(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    bytes_data = open(tmp_zip, 'rb', ).read()
-    return bytes_data
+    return archive.compress_files(file_bytes, password=password)
 
 
 def get_signed_value(value):
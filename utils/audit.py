@@ -0,0 +1,224 @@
+import atexit
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.admin.models import LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.utils import timezone
+
+from utils import common, constants
+
+logger = common.get_system_logger()
+_STOP = object()  # 登録スレッドを終了させるための目印
+
+
+def get_tracked_fields(instance, names=None):
+    """変更を記録するモデルのフィールドを取得する（自動採番と編集不可のフィールドは対象外）。
+
+    :param instance: モデルのインスタンス
+    :param names: 対象のフィールド名（指定しない場合は全部）
+    :return:
+    """
+    fields = []
+    for field in instance._meta.concrete_fields:
+        if field.auto_created or not field.editable:
+            continue
+        if names is not None and field.name not in names and field.attname not in names:
+            continue
+        fields.append(field)
+    return fields
+
+
+def get_field_values(instance, fields):
+    """フィールドの値をインスタンスの__dict__から取得する（関連オブジェクトは取得しない）。
+
+    :param instance: モデルのインスタンス
+    :param fields: get_tracked_fieldsで取得したフィールド
+    :return: フィールド名をキーとする辞書
+    """
+    return {field.name: instance.__dict__.get(field.attname) for field in fields}
+
+
+def get_display_value(instance, field, value):
+    """ログに出力する値を取得する。
+
+    外部キーの場合、取得済みの関連オブジェクトがあればその文字列、なければIDとする。
+
+    :param instance: モデルのインスタンス
+    :param field: フィールド
+    :param value: フィールドの値
+    :return:
+    """
+    if field.is_relation and field.is_cached(instance):
+        related = field.get_cached_value(instance)
+        if related is not None and related.pk == value:
+            return related
+    return value
+
+
+def get_added_message(instance):
+    """追加時のログメッセージを取得する。
+
+    :param instance: 追加したオブジェクト
+    :return:
+    """
+    added_data = []
+    for field in instance._meta.fields:
+        value = get_display_value(instance, field, instance.__dict__.get(field.attname))
+        added_data.append('{}を {} に設定しました。'.format(field.verbose_name, value))
+    return '\n'.join(added_data)
+
+
+def get_changed_data(instance, fields, original_values, labels=None, prev_msg=None):
+    """変更前の値と比較して、変更メッセージを取得する。
+
+    変更前の関連オブジェクトは取得していないので、外部キーは変更前と変更後ともにIDで出力する。
+
+    :param instance: 変更後のオブジェクト
+    :param fields: get_tracked_fieldsで取得したフィールド
+    :param original_values: 変更前の値（get_field_valuesで取得）
+    :param labels: フィールド名をキーとする表示名（指定しない場合はモデルのverbose_name）
+    :param prev_msg: 変更メッセージの先頭文字
+    :return: 変更メッセージのリスト
+    """
+    changed_data = []
+    for field in fields:
+        old_value = original_values.get(field.name)
+        new_value = instance.__dict__.get(field.attname)
+        if old_value == new_value:
+            continue
+        label = (labels or {}).get(field.name) or field.verbose_name
+        changed_data.append('{}{} を {} から {} に変更しました。'.format(
+            (prev_msg + 'の') if prev_msg else '',
+            label,
+            old_value if old_value != '' else None,
+            new_value if new_value != '' else None,
+        ))
+    return changed_data
+
+
+class AuditLogWriter(object):
+    """操作ログ（LogEntry）をキューに入れて、別スレッドでまとめて登録する。
+
+    トランザクションがコミットされてからキューに入れるので、ロールバックした操作のログは登録しない。
+    設定のAUDIT_LOG_ASYNCがFalseの場合（テストなど）は、その場で登録する。
+    """
+
+    def __init__(self, batch_size=constants.AUDIT_LOG_BATCH_SIZE, interval=constants.AUDIT_LOG_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                # フォークしたプロセスでは親プロセスのキューとスレッドを使わない
+                self.pid = os.getpid()
+                self.queue = queue.Queue()
+                self.thread = None
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='audit-log-writer', daemon=True)
+                self.thread.start()
+
+    def put(self, entry):
+        """操作ログを登録する。
+
+        :param entry: 未保存のLogEntry
+        :return:
+        """
+        if not getattr(settings, 'AUDIT_LOG_ASYNC', True):
+            self.write([entry])
+            return
+        self.start()
+        self.queue.put(entry)
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            entries = []
+            entry = self.queue.get()
+            deadline = time.monotonic() + self.interval
+            while True:
+                if entry is _STOP:
+                    stopped = True
+                    break
+                entries.append(entry)
+                timeout = deadline - time.monotonic()
+                if len(entries) >= self.batch_size or timeout <= 0:
+                    break
+                try:
+                    entry = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if not entries:
+                continue
+            try:
+                self.write(entries)
+            finally:
+                # 次の登録まで時間が空くことがあるので、スレッドのDB接続は毎回閉じる
+                connection.close()
+
+    def write(self, entries):
+        try:
+            LogEntry.objects.bulk_create(entries)
+        except Exception as ex:
+            logger.error('操作ログ{}件を登録できませんでした：{}'.format(len(entries), ex))
+
+    def flush(self, timeout=constants.AUDIT_LOG_STOP_TIMEOUT):
+        """スレッドを終了させて、キューに残っている操作ログをその場で登録する（プロセス終了時など）。
+
+        スレッドが取り出し済みで登録中の操作ログは、スレッドが登録し終わるまで待つ。
+
+        :param timeout: スレッドの終了を待つ最大時間（秒）
+        :return:
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                # 親プロセスからコピーしたキューは親プロセスが登録する
+                return
+            thread, self.thread = self.thread, None
+        if thread is not None and thread.is_alive():
+            self.queue.put(_STOP)
+            thread.join(timeout)
+        entries = []
+        while True:
+            try:
+                entry = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not _STOP:
+                entries.append(entry)
+        for i in range(0, len(entries), self.batch_size):
+            self.write(entries[i:i + self.batch_size])
+
+
+audit_log_writer = AuditLogWriter()
+atexit.register(audit_log_writer.flush)
+
+
+def log_action(user, instance, action_flag, message):
+    """操作ログを記録する（コミット後にまとめて登録する）。
+
+    :param user: ログインユーザー
+    :param instance: 対象のオブジェクト
+    :param action_flag: 操作（追加／変更／削除）
+    :param message: メッセージ
+    :return:
+    """
+    entry = LogEntry(
+        action_time=timezone.now(),
+        user_id=user.id,
+        content_type_id=ContentType.objects.get_for_model(instance).pk,
+        object_id=str(instance.pk),
+        object_repr=str(instance)[:200],
+        action_flag=action_flag,
+        change_message=message,
+    )
+    transaction.on_commit(lambda: audit_log_writer.put(entry))
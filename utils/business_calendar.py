@@ -0,0 +1,180 @@
+import calendar
+import datetime
+import threading
+import time
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from master.models import Holiday
+from utils import constants, jpholiday
+
+DAY_TYPE_BUSINESS = 0  # 営業日
+DAY_TYPE_WEEKEND = 1  # 土日
+DAY_TYPE_NATIONAL_HOLIDAY = 2  # 国民の祝日
+DAY_TYPE_COMPANY_HOLIDAY = 3  # 会社の休日（マスターに登録した休日）
+
+_calendars = {}
+_lock = threading.Lock()
+
+
+class YearCalendar(object):
+    """一年分の営業日カレンダー
+
+    日ごとの区分は元日からの通し番号をインデックスとする bytearray に保持し、
+    月ごとの営業日は事前に計算しておく。
+    """
+
+    def __init__(self, year, national_holidays=None, company_holidays=None):
+        """
+
+        :param year: 対象年
+        :param national_holidays: 国民の祝日（日付：祝日名）
+        :param company_holidays: 会社の休日（日付：休日名）
+        """
+        national_holidays = national_holidays or {}
+        company_holidays = company_holidays or {}
+        self.year = year
+        self.first_day = datetime.date(year, 1, 1)
+        self.created_time = time.time()
+        self.day_types = bytearray(366 if calendar.isleap(year) else 365)
+        self.names = {}
+        first_weekday = self.first_day.weekday()
+        for i in range(len(self.day_types)):
+            date = self.first_day + datetime.timedelta(days=i)
+            if (first_weekday + i) % 7 in (5, 6):
+                self.day_types[i] = DAY_TYPE_WEEKEND
+                self.names[i] = '休日'
+            elif date in national_holidays:
+                self.day_types[i] = DAY_TYPE_NATIONAL_HOLIDAY
+                self.names[i] = national_holidays[date]
+            elif date in company_holidays:
+                self.day_types[i] = DAY_TYPE_COMPANY_HOLIDAY
+                self.names[i] = company_holidays[date]
+        # 月ごとの営業日（日）
+        self.month_business_days = [()]
+        for month in range(1, 13):
+            offset = self.get_index(datetime.date(year, month, 1))
+            days = calendar.monthrange(year, month)[1]
+            self.month_business_days.append(tuple(
+                day for day in range(1, days + 1) if self.day_types[offset + day - 1] == DAY_TYPE_BUSINESS
+            ))
+
+    def is_expired(self):
+        return time.time() - self.created_time > constants.BUSINESS_CALENDAR_TIMEOUT
+
+    def get_index(self, date):
+        return date.toordinal() - self.first_day.toordinal()
+
+    def get_day_type(self, date):
+        return self.day_types[self.get_index(date)]
+
+    def get_name(self, date):
+        return self.names.get(self.get_index(date))
+
+    def is_business_day(self, date):
+        return self.get_day_type(date) == DAY_TYPE_BUSINESS
+
+    def business_days(self, month):
+        """指定月の営業日リストを取得する。
+
+        :param month: 対象月
+        :return:
+        """
+        return [datetime.date(self.year, month, day) for day in self.month_business_days[month]]
+
+    def nth_business_day(self, month, n):
+        """指定月の第Ｎ営業日を取得する。
+
+        :param month: 対象月
+        :param n: 何番目の営業日（１から）
+        :return: 該当する営業日がない場合は None
+        """
+        days = self.month_business_days[month]
+        if 1 <= n <= len(days):
+            return datetime.date(self.year, month, days[n - 1])
+        else:
+            return None
+
+    def get_dates(self, month):
+        """指定月の日付リストを取得する。
+
+        :param month: 対象月
+        :return:
+        """
+        first_day = datetime.date(self.year, month, 1)
+        offset = self.get_index(first_day)
+        dates = []
+        for i in range(calendar.monthrange(self.year, month)[1]):
+            is_holiday = self.day_types[offset + i] != DAY_TYPE_BUSINESS
+            dates.append({
+                'date': first_day + datetime.timedelta(days=i),
+                'is_holiday': is_holiday,
+                'name': self.names.get(offset + i) if is_holiday else None,
+            })
+        return dates
+
+
+def get_calendar(year):
+    """指定年のカレンダーを取得する。
+
+    プロセス内にキャッシュし、休日マスターが変更された場合または有効期限が切れた場合は再作成する。
+
+    :param year: 対象年
+    :return:
+    """
+    year = int(year)
+    year_calendar = _calendars.get(year)
+    if year_calendar is None or year_calendar.is_expired():
+        year_calendar = create_calendar(year)
+        with _lock:
+            _calendars[year] = year_calendar
+    return year_calendar
+
+
+def create_calendar(year):
+    national_holidays = dict(jpholiday.year_holidays(year))
+    company_holidays = {
+        holiday.date: holiday.name for holiday in Holiday.objects.filter(
+            is_deleted=False,
+            date__gte=datetime.date(year, 1, 1),
+            date__lte=datetime.date(year, 12, 31),
+        )
+    }
+    return YearCalendar(year, national_holidays, company_holidays)
+
+
+def invalidate(year=None):
+    """キャッシュしたカレンダーを破棄する。
+
+    :param year: 対象年、指定しない場合はすべて破棄する
+    :return:
+    """
+    with _lock:
+        if year is None:
+            _calendars.clear()
+        else:
+            _calendars.pop(int(year), None)
+
+
+def is_business_day(date):
+    return get_calendar(date.year).is_business_day(date)
+
+
+def business_days(year, month):
+    return get_calendar(year).business_days(int(month))
+
+
+def nth_business_day(year, month, n):
+    return get_calendar(year).nth_business_day(int(month), n)
+
+
+def get_dates(year, month):
+    return get_calendar(year).get_dates(int(month))
+
+
+@receiver(post_save, sender=Holiday)
+@receiver(post_delete, sender=Holiday)
+def holiday_changed(sender, instance, **kwargs):
+    # 日付が変更された場合もあるので、すべて破棄する
+    invalidate()
@@ -34,6 +34,18 @@ def get_last_day_by_month(source_date):
     return next_month + datetime.timedelta(days=-next_month.day)
 
 
+def get_ym(year, month):
+    """年と月から年月の整数を取得する。
+
+    :param year: 年（例：'2020'、2020）
+    :param month: 月（例：'04'、4）
+    :return: 例：202004、年または月が空白の場合はNone
+    """
+    if not year or not month:
+        return None
+    return int(year) * 100 + int(month)
+
+
 def get_interval_months(start_date, end_date):
     return (end_date.year * 12 + end_date.month) - (start_date.year * 12 + start_date.month)
 
@@ -51,6 +63,22 @@ def dictfetchall(cursor):
     ]
 
 
+def dictfetchiter(cursor, size=constants.BATCH_CHUNK_SIZE):
+    """Yield rows from a cursor as a dict, fetching size rows at a time
+
+    :param cursor:
+    :param size:
+    :return:
+    """
+    columns = [col[0] for col in cursor.description]
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        for row in rows:
+            yield dict(zip(columns, row))
+
+
 def get_ext_from_content_type(content_type):
     try:
         category, ext = content_type.split('/')
@@ -183,6 +211,20 @@ def search_str(s, pattern):
     return m.groups() if m else None
 
 
+def increase_number_tail(s, step=1):
+    """末尾の数字をカウントアップした文字列を取得する（数字の桁数は維持する）
+
+    :param s: 末尾が数字の文字列（例：契約番号）
+    :param step: 増分
+    :return: 末尾が数字ではない場合は None
+    """
+    m = re.search(constants.REG_NUMBER_TAIL, s or '')
+    if m is None:
+        return None
+    num = m.group(1)
+    return s[:m.start(1)] + str(int(num) + step).zfill(len(num))
+
+
 def get_attachment_path(self, filename):
     name, ext = os.path.splitext(filename)
     now = datetime.datetime.now()
@@ -215,8 +257,9 @@ def get_base64_file_size(base64_data):
     :return: バイト数を返す
     """
     if is_base64_string(base64_data):
-        name_and_ext, data = split_base64(base64_data)
-        return len(data) * 3 / 4 - data.count('=', -2)
+        # 大きいファイルの文字列をコピーしないように、分割せずに位置だけで計算する
+        start = base64_data.find(';base64,') + len(';base64,')
+        return (len(base64_data) - start) * 3 / 4 - base64_data.count('=', max(start, len(base64_data) - 2))
     else:
         return 0
 
@@ -10,6 +10,7 @@ REG_BANK_BRANCH_NO = r'[0-9]{3}'
 REG_BANK_ACCOUNT_NO = r'[0-9]{7}'
 REG_BASE64_MIME_TYPE = r'data:([A-Za-z0-9_-]+)/([.A-Za-z0-9_-]+);'
 REG_BASE64_FILENAME = r'name:([^;]+);'
+REG_FILE_UUID = r'^\d{6}_[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
 REG_REQUEST_NO = r"^[0-9]{7}$"
 REG_PARTNER_ORDER_NO = r"^ODR[0-9]{8}$"
 REG_EMAIL = r"[^\s]+@[^\s]+"
@@ -39,12 +40,40 @@ DEFAULT_PAID_VACATION_INTERVALS = [
     (78, 90, 20),
 ]
 DEFAULT_TIMEOUT = 60*30  # URL発行時間が過ぎる。(DEFAULT = 30分)
+BUSINESS_CALENDAR_TIMEOUT = 60*10  # 営業日カレンダーのキャッシュ有効時間(DEFAULT = 10分)
+MAIL_CONFIG_TIMEOUT = 60*10  # メール送信サーバー設定のキャッシュ有効時間(DEFAULT = 10分)
+MAIL_CONNECTION_IDLE_TIMEOUT = 60  # この時間使わなかったSMTP接続は再利用しない(DEFAULT = 1分)
 
+BATCH_CHUNK_SIZE = 500  # バッチで一回にコミットする件数
+BATCH_CHECKPOINT_EXPIRE = 60*60*24  # 中断したバッチを再開できる期間(DEFAULT = 1日)
+FIREBASE_MULTICAST_MAX_TOKENS = 500  # 一回のマルチキャストで送信できるデバイス数の上限
+FIREBASE_SEND_WORKERS = 4  # 同時に送信するマルチキャスト数
+PDF_RENDER_WORKERS = 4  # 同時にPDFに変換する件数
+WORKING_STATUS_WORKERS = 2  # 稼働状態を並列で処理するプロセス数（プロセスごとにDB接続を一つ使う）
+PDF_CONVERT_TIMEOUT = (5, 60)  # PDF変換APIのタイムアウト（接続、読込）(単位：秒)
+PDF_CONVERT_RETRIES = 3  # PDF変換APIに接続できない時の再試行回数（POSTなので送信後は再試行しない）
+DOCUMENT_CACHE_MAX_SIZE = 500 * 1024 * 1024  # キャッシュの合計サイズの上限(DEFAULT = 500MB)
+DOCUMENT_CACHE_EVICT_RATIO = 0.1  # 上限のこの割合を書き込んだら、上限を超えたファイルの削除を確認する
+DOCUMENT_CACHE_EVICT_INTERVAL = 60*10  # 上限を超えたファイルの削除を確認する間隔(DEFAULT = 10分)
+API_CURSOR_PAGE_SIZE = 50  # カーソルページングの一ページの件数
+API_CURSOR_MAX_PAGE_SIZE = 1000  # カーソルページングで指定できる一ページの最大件数
+AUDIT_LOG_BATCH_SIZE = 100  # 操作ログを一回で登録する最大件数
+AUDIT_LOG_FLUSH_INTERVAL = 1  # 操作ログをまとめるために待つ時間(単位：秒)
+AUDIT_LOG_STOP_TIMEOUT = 10  # プロセス終了時に登録中の操作ログを待つ最大時間(単位：秒)
+QUERY_COUNT_WARNING = 50  # 一リクエストのSQL件数がこの件数を超えたら警告を出力する
+QUERY_DUPLICATE_THRESHOLD = 5  # 同じ形のSQLがこの件数以上実行された場合はN+1として警告を出力する
+UPLOAD_CHUNK_SIZE = 64 * 1024  # アップロードしたファイルを一回で読み込むサイズ
+UPLOAD_EXPIRE_SECONDS = 60*60*24  # 添付ファイルとして保存されなかったファイルを削除するまでの時間(DEFAULT = 1日)
+STAMP_MAX_PIXELS = 300  # 書類に埋め込む印鑑画像の縦横の最大ピクセル
 WORKING_STATUS_FORWARD = 2
 PROJECT_MEMBER_MONTHLY_REQUEST_FORWARD = 0  # 今月まで案件メンバー月別請求を作成する
-PARTNER_MEMBER_MONTHLY_REQUEST_FORWARD = 5  # 今月から六か月まで先の協力社員月別請求を作成
+PARTNER_MEMBER_MONTHLY_REQUEST_FORWARD = 5  # 来月から六か月まで先の協力社員月別請求を作成（毎日全ての月を比較する）
 ENCRYPT_DISPLAY_VALUE = '******'  # 権限なしの場合に表示する文字列
-EXPENSE_EXPORT_MAX_ROWS = 68  # 経費精算書出力時最大件数、この件数超えると出力できない、改頁が対応したら、この設定はいらない。
+EXPENSE_EXPORT_MAX_ROWS = 68  # 旧経費精算書の出力時最大件数（改頁に対応したので、経費精算書の出力では使わない）
+
+COUNT_EXACT = 'exact'  # 一覧の件数を正確に取得する
+COUNT_ESTIMATE = 'estimate'  # 一覧の件数を実行計画から概算する
+COUNT_NONE = 'none'  # 一覧の件数を取得しない
 
 CHOICE_ORG_TYPE = (
     ('01', "事業部"),
@@ -761,6 +790,7 @@ ERROR_UNKNOWN_MEMBER_TYPE = '識別できないメンバーの種類です。'
 ERROR_DATA_NOT_FOUND = '{name}が見つかりません。'
 ERROR_DATA_NOT_FOUND_FOR_REASON = '{name}が見つかりません、{reason}。'
 ERROR_FILE_NOT_FOUND = 'ファイル {name} は見つかりません。'
+ERROR_REQUIRE_LIBRARY = 'ライブラリ {name} がインストールされていません。'
 ERROR_FILE_SIZE_LIMIT = 'ファイルは大きすぎます、{limit}以下のファイルをアップロードしてください。'
 ERROR_REQUIRE_CALCULATE_HOURS = '{condition}の場合、契約計算用時間の設定が必要です。'
 ERROR_REQUIRE_MAX_HOURS = '{condition}の場合、上限時間の設定が必要です。'
@@ -821,12 +851,23 @@ INFO_CREATED_COUNT = '{success}/{count}件の{name}が作成されました。'
 INFO_DELETED_COUNT = '{success}/{count}件の{name}が削除されました。'
 INFO_CONTRACT_AUTO_UPDATED = '{name}（{start_date}～{end_date}）が作成されました。'
 INFO_CONTRACT_UPDATED_COUNT = '{count}件の契約が更新されました。'
+INFO_CONTRACT_AUTO_UPDATE_DRY_RUN = '[DRY RUN] {name}（{start_date}～{end_date}、契約番号：{contract_no}）が作成されます。'
+INFO_BATCH_PHASE = '{name}：処理時間 {elapsed:.3f}秒／SQL {count}件（{query_time:.3f}秒）'
+INFO_BATCH_RESUME = '{year}年{month}月　{name}（ID：{id}）の次から再開します。'
+INFO_BATCH_RESUME_FROM_START = '{year}年{month}月　最初の{name}から再開します。'
 INFO_FIREBASE_DEVICE_REGISTER = '{name}のデバイス({device})をトピック({topic})に登録しました。'
 INFO_FIREBASE_DEVICE_UNREGISTER = '{name}のデバイス({device})をトピック({topic})から解除しました。'
 INFO_FIREBASE_SEND_MESSAGE = 'トピック({topic})にメッセージを送信しました。'
 INFO_FIREBASE_NO_DEVICE = 'トピック({topic})に登録したデバイスがありません。'
+INFO_FIREBASE_SEND_RESULT = 'トピック({topic})にメッセージを送信しました（成功：{success}件／失敗：{failure}件）。'
+INFO_FIREBASE_DEVICE_PRUNED = '無効になった{count}件のデバイスを削除しました。'
+INFO_DOCUMENT_CACHE_EVICTED = 'キャッシュの{count}件のファイルを削除しました。'
 
 WARN_NO_CONTRACT = '{name}に{year}年{month}月に契約がありません。'
+WARN_BATCH_CANNOT_RESUME = '前回中断した位置から再開できません（{reason}）、最初から作成し直します。'
+WARN_QUERY_COUNT = '{method} {path}：処理時間 {elapsed:.3f}秒／SQL {count}件（{query_time:.3f}秒）'
+WARN_QUERY_DUPLICATED = '同じ形のSQLが{count}件実行されました（N+1）：{sql}'
+WARN_YM_NOT_SYNCED = '{name}に整数の年月が未設定のデータがあります（sync_ymを実行してください）。'
 
 NAME_PARTNER_REQUEST = '{company}{year}年{month}月_{organization}'
 NAME_ORGANIZATION_ATTENDANCE = "勤怠情報_{organization}_{year}年{month}月_{timestamp}"
@@ -1,18 +1,22 @@
 import os
 import io
+import json
 import base64
 import uuid
 import traceback
 import datetime
 from argparse import RawTextHelpFormatter
+from contextlib import contextmanager
 
+from django.conf import settings
 from django.core.files.base import ContentFile
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from django.utils import timezone
 from django.views.generic.base import View
 
-from utils import common
+from utils import common, constants
+from utils.query_counter import QueryCounter
 
 
 def blob_to_image(blob, ext):
@@ -34,6 +38,7 @@ def base64_to_image(base64_data):
 class BaseBatch(BaseCommand):
     BATCH_NAME = ''
     BATCH_TITLE = ''
+    BATCH_ATOMIC = True  # Falseの場合はバッチ全体を一つのトランザクションにしない（バッチ側でコミットする）
 
     def __init__(self, *args, **kwargs):
         super(BaseBatch, self).__init__(*args, **kwargs)
@@ -49,8 +54,14 @@ class BaseBatch(BaseCommand):
     def handle(self, *args, **options):
         pass
 
-    @transaction.atomic
     def execute(self, *args, **options):
+        if self.BATCH_ATOMIC:
+            with transaction.atomic():
+                return self.execute_batch(*args, **options)
+        else:
+            return self.execute_batch(*args, **options)
+
+    def execute_batch(self, *args, **options):
         self.logger.info("============== %s実行開始 ==============" % self.BATCH_TITLE)
         output = None
         try:
@@ -65,6 +76,53 @@ class BaseBatch(BaseCommand):
             self.logger.info("============== %s実行終了 ==============" % self.BATCH_TITLE)
         return output
 
+    @contextmanager
+    def phase(self, name):
+        """処理段階ごとの処理時間とSQL件数をログに出力する。
+
+        with self.phase('データ取得'):
+            ...
+
+        :param name: 処理段階の名称
+        :return:
+        """
+        with QueryCounter() as counter:
+            yield counter
+        self.logger.info(constants.INFO_BATCH_PHASE.format(
+            name=name, elapsed=counter.elapsed, count=counter.count, query_time=counter.query_time,
+        ))
+
+    def get_checkpoint_path(self):
+        return os.path.join(settings.LOG_ROOT, 'batch.%s.checkpoint' % self.BATCH_NAME)
+
+    def get_checkpoint(self):
+        """前回中断したバッチのチェックポイントを取得する。
+
+        :return: チェックポイントがない場合は None
+        """
+        path = self.get_checkpoint_path()
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def save_checkpoint(self, data):
+        """処理済の位置を保存する、バッチが中断した場合は次回この位置から再開する。
+
+        :param data: JSONに変換できるデータ
+        :return:
+        """
+        path = self.get_checkpoint_path()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def clear_checkpoint(self):
+        path = self.get_checkpoint_path()
+        if os.path.exists(path):
+            os.remove(path)
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--username',
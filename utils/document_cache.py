@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.template.loader import get_template
+
+from utils import common, constants
+
+logger = common.get_system_logger()
+
+
+class DocumentCache(object):
+    """作成したPDF・Excelなどのファイルをキャッシュする。
+
+    キーはテンプレートのバージョンと描画用データのハッシュとし、データが変わらない限り同じファイルを返す。
+    ファイルはDOCUMENT_CACHE_ROOT（MEDIA_ROOTの外で、公開しないフォルダー）に保存し、
+    合計サイズが上限を超えたら最近使っていないファイルから削除する。
+    削除の確認はフォルダー全体を走査するので、書き込むたびではなく、
+    書き込んだサイズが一定以上になった時、または前回の確認から一定時間が過ぎた時だけ行う。
+    """
+
+    def __init__(
+            self, root=None, max_size=constants.DOCUMENT_CACHE_MAX_SIZE,
+            evict_interval=constants.DOCUMENT_CACHE_EVICT_INTERVAL,
+    ):
+        self._root = root
+        self.max_size = max_size
+        self.evict_size = int(max_size * constants.DOCUMENT_CACHE_EVICT_RATIO)
+        self.evict_interval = evict_interval
+        self.hits = 0
+        self.misses = 0
+        self.written_size = 0
+        self.evicted_time = None
+        self.lock = threading.Lock()
+
+    @property
+    def root(self):
+        return self._root or settings.DOCUMENT_CACHE_ROOT
+
+    @classmethod
+    def get_template_version(cls, template_name):
+        """テンプレートファイルの更新日時とサイズからバージョンを取得する。
+
+        :param template_name: テンプレート名（例：request/project_request.html）またはファイルのパス
+        :return:
+        """
+        if os.path.isabs(template_name):
+            path = template_name
+        else:
+            path = get_template(template_name).origin.name
+        stat = os.stat(path)
+        return '{}:{}:{}'.format(template_name, stat.st_mtime_ns, stat.st_size)
+
+    @classmethod
+    def make_key(cls, template_name, context, version=None):
+        """キャッシュのキーを作成する。
+
+        :param template_name: テンプレート名またはファイルのパス
+        :param context: 描画用データ（JSONにできるデータ）
+        :param version: 描画処理のバージョン（処理を変更した場合に変える）
+        :return:
+        """
+        data = json.dumps(
+            [cls.get_template_version(template_name), version, context],
+            cls=DjangoJSONEncoder, sort_keys=True, ensure_ascii=False,
+        )
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def make_content_key(cls, content, version=None):
+        """作成元のデータ（HTMLなど）だけでキャッシュのキーを作成する。
+
+        :param content: 作成元のデータ（文字列）
+        :param version: 作成処理のバージョン
+        :return:
+        """
+        data = json.dumps([version, content], ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get_path(self, key, ext):
+        return os.path.join(self.root, key[:2], key + ext)
+
+    def get(self, key, ext):
+        """キャッシュしたファイルを取得する。
+
+        :param key: キャッシュのキー
+        :param ext: 拡張子（例：.pdf）
+        :return: バイナリーデータ、キャッシュがない場合はNone
+        """
+        path = self.get_path(key, ext)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            # 最近使ったファイルとして更新日時を更新する
+            os.utime(path, None)
+        except OSError:
+            content = None
+        with self.lock:
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return content
+
+    def set(self, key, ext, content):
+        """ファイルをキャッシュする。
+
+        :param key: キャッシュのキー
+        :param ext: 拡張子（例：.pdf）
+        :param content: バイナリーデータ
+        :return:
+        """
+        path = self.get_path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        if self.need_evict(len(content)):
+            self.evict()
+
+    def need_evict(self, size):
+        """上限を超えたファイルの削除を確認するか
+
+        :param size: 書き込んだサイズ
+        :return:
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.written_size += size
+            if (
+                    self.evicted_time is not None
+                    and self.written_size < self.evict_size
+                    and now - self.evicted_time < self.evict_interval
+            ):
+                return False
+            self.written_size = 0
+            self.evicted_time = now
+            return True
+
+    def get_or_create(self, key, ext, create_func):
+        """キャッシュしたファイルを取得し、ない場合は作成してキャッシュする。
+
+        :param key: キャッシュのキー
+        :param ext: 拡張子（例：.xlsx）
+        :param create_func: ファイルを作成する関数（バイナリーデータを返す）
+        :return: バイナリーデータ
+        """
+        content = self.get(key, ext)
+        if content is None:
+            content = create_func()
+            if content:
+                self.set(key, ext, content)
+        return content
+
+    def get_files(self):
+        files = []
+        for root, dirs, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    # 書き込み中のファイル
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def evict(self):
+        """合計サイズが上限を超えた場合、最近使っていないファイルから削除する。
+
+        :return: 削除件数
+        """
+        files = self.get_files()
+        total_size = sum(size for mtime, size, path in files)
+        cnt = 0
+        for mtime, size, path in sorted(files):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            cnt += 1
+        if cnt:
+            logger.info(constants.INFO_DOCUMENT_CACHE_EVICTED.format(count=cnt))
+        return cnt
+
+    def clear(self):
+        for mtime, size, path in self.get_files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        """キャッシュの使用状況を取得する。
+
+        :return:
+        """
+        files = self.get_files()
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'count': len(files),
+            'size': sum(size for mtime, size, path in files),
+        }
+
+
+document_cache = DocumentCache()
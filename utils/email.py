@@ -1,11 +1,10 @@
 import os
 import mimetypes
-import zipfile
 import traceback
-import subprocess
-import io
-import shutil
-import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
 
 from email import encoders
 from email.header import Header
@@ -16,16 +15,145 @@ from django.core.exceptions import ValidationError
 from django.core.mail import EmailMultiAlternatives, get_connection, SafeMIMEText
 from django.core.mail.message import MIMEBase
 from django.core.validators import validate_email
-from django.db import connection
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.encoding import smart_str
 
-from master.models import EmailLogEntry, Attachment
+from master.models import EmailLogEntry, Attachment, Config
 from utils import constants, common
-from utils.app_base import get_sub_tmp_path, get_tmp_file
+from utils.archive import compress_files, ENCRYPTION_ZIP_CRYPTO
 from utils.errors import CustomException
 
 
 logger = common.get_system_logger()
+MailConfig = namedtuple('MailConfig', ('host', 'port', 'username', 'password'))
+_mail_config = None
+_mail_config_time = 0
+_mail_config_lock = threading.Lock()
+
+
+def get_mail_config():
+    """メール送信サーバーの設定を取得する。
+
+    一定時間（MAIL_CONFIG_TIMEOUT）キャッシュし、システム設定が変更された場合は破棄する。
+
+    :return: MailConfig
+    """
+    global _mail_config, _mail_config_time
+    with _mail_config_lock:
+        if _mail_config is None or time.time() - _mail_config_time > constants.MAIL_CONFIG_TIMEOUT:
+            names = (
+                constants.CONFIG_EMAIL_SMTP_HOST, constants.CONFIG_EMAIL_SMTP_PORT,
+                constants.CONFIG_EMAIL_ADDRESS, constants.CONFIG_EMAIL_PASSWORD,
+            )
+            try:
+                values = dict(Config.objects.filter(name__in=names).values_list('name', 'value'))
+                _mail_config = MailConfig(
+                    host=str(values[constants.CONFIG_EMAIL_SMTP_HOST]),
+                    port=int(values[constants.CONFIG_EMAIL_SMTP_PORT]),
+                    username=str(values[constants.CONFIG_EMAIL_ADDRESS]),
+                    password=str(values[constants.CONFIG_EMAIL_PASSWORD]),
+                )
+            except Exception as ex:
+                logger.error(traceback.format_exc())
+                raise CustomException(constants.ERROR_CONFIG_EMAIL_SERVER)
+            _mail_config_time = time.time()
+        return _mail_config
+
+
+def invalidate_mail_config():
+    global _mail_config
+    with _mail_config_lock:
+        _mail_config = None
+
+
+@receiver(post_save, sender=Config)
+@receiver(post_delete, sender=Config)
+def config_changed(sender, instance, **kwargs):
+    invalidate_mail_config()
+
+
+class MailConnectionPool(object):
+    """SMTP接続をスレッドごとに再利用する。
+
+    with mail_connection_pool.connection() as mail_connection:
+        mail_connection.send_messages(messages)
+
+    一定時間（MAIL_CONNECTION_IDLE_TIMEOUT）使わなかった接続、切断された接続
+    またはメール設定が変更された場合は接続し直す。
+    """
+
+    def __init__(self, idle_timeout=constants.MAIL_CONNECTION_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.local = threading.local()
+
+    @contextmanager
+    def connection(self):
+        backend = self.acquire()
+        try:
+            yield backend
+        except Exception:
+            # エラーになった接続は再利用しない
+            self.discard()
+            raise
+        else:
+            self.local.last_used = time.monotonic()
+
+    def acquire(self):
+        config = get_mail_config()
+        backend = getattr(self.local, 'backend', None)
+        if backend is not None and (
+            self.local.config != config
+            or time.monotonic() - self.local.last_used > self.idle_timeout
+            or not self.is_alive(backend)
+        ):
+            self.discard()
+            backend = None
+        if backend is None:
+            backend = create_mail_connection(config)
+            backend.open()
+            self.local.backend = backend
+            self.local.config = config
+            self.local.last_used = time.monotonic()
+        return backend
+
+    def discard(self):
+        backend = getattr(self.local, 'backend', None)
+        self.local.backend = None
+        if backend is not None:
+            try:
+                backend.close()
+            except Exception as ex:
+                logger.warning(ex)
+
+    @classmethod
+    def is_alive(cls, backend):
+        if not hasattr(backend, 'connection'):
+            # SMTP以外（テスト用など）のバックエンド
+            return True
+        if backend.connection is None:
+            return False
+        try:
+            return backend.connection.noop()[0] == 250
+        except Exception:
+            return False
+
+
+def create_mail_connection(config):
+    """メール送信サーバーの設定からバックエンドを作成する（未接続）。
+
+    :param config: MailConfig
+    :return:
+    """
+    backend = get_connection()
+    backend.host = config.host
+    backend.port = config.port
+    backend.username = config.username
+    backend.password = config.password
+    return backend
+
+
+mail_connection_pool = MailConnectionPool()
 
 
 class Email(object):
@@ -48,7 +176,6 @@ class Email(object):
         self.pwd_title = pwd_title
         self.password = None
         self.pwd_body = pwd_body
-        self.temp_files = []
 
     def check_recipient(self):
         if not self.recipient_list:
@@ -111,66 +238,23 @@ class Email(object):
 
     @classmethod
     def get_mail_connection(cls):
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute(
-                    "select value from mst_config where name = %s "
-                    " union all "
-                    "select value from mst_config where name = %s "
-                    " union all "
-                    "select value from mst_config where name = %s "
-                    " union all "
-                    "select value from mst_config where name = %s ",
-                    [constants.CONFIG_EMAIL_SMTP_HOST, constants.CONFIG_EMAIL_SMTP_PORT,
-                     constants.CONFIG_EMAIL_ADDRESS, constants.CONFIG_EMAIL_PASSWORD]
-                )
-                host, port, username, password = cursor.fetchall()
-            backend = get_connection()
-            backend.host = str(host[0])
-            backend.port = int(port[0])
-            backend.username = str(username[0])
-            backend.password = str(password[0])
-            return backend
-        except Exception as ex:
-            logger.error(traceback.format_exc())
-            raise CustomException(constants.ERROR_CONFIG_EMAIL_SERVER)
+        return create_mail_connection(get_mail_config())
 
     def zip_attachments(self):
         if self.attachment_list:
-            if sys.platform in ("linux", "linux2"):
-                # tmpフォルダー配下の一時フォルダーを取得する
-                tmp_path = get_sub_tmp_path()
-                self.temp_files.append(tmp_path)
-                tmp_zip = get_tmp_file('zip')
-                self.temp_files.append(tmp_zip)
-                # 添付ファイルを一時フォルダーにコピーする
-                for attachment_file in self.attachment_list:
-                    new_path = os.path.join(tmp_path, attachment_file.filename)
-                    self.temp_files.append(new_path)
-                    if attachment_file.is_bytes():
-                        # バイナリーファイルを一時ファイルに書き込む
-                        with open(new_path, 'wb') as f:
-                            f.write(attachment_file.content)
-                    else:
-                        shutil.copy(attachment_file.filepath, new_path)
-                password = self.generate_password()
-                # tmpフォルダー配下すべてのファイル名をUTF8からShift-JISに変換する
-                subprocess.call(["convmv", "-r", "-f", "utf8", '-t', 'sjis', '--notest', tmp_path.rstrip('/') + '/'])
-                # 一時フォルダーを圧縮する
-                command = "zip --password {0} -j {1} {2}/*".format(password, tmp_zip, tmp_path.rstrip('/'))
-                subprocess.call(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                bytes_data = open(tmp_zip, 'rb', ).read()
-                return bytes_data
-            else:
-                buff = io.BytesIO()
-                in_memory_zip = zipfile.ZipFile(buff, mode='w')
-                for attachment_file in self.attachment_list:
-                    if attachment_file.is_bytes():
-                        in_memory_zip.writestr(attachment_file.filename, attachment_file.content)
-                    else:
-                        in_memory_zip.write(attachment_file.filename, attachment_file.filename)
-                in_memory_zip.close()
-                return buff.getvalue()
+            # パスワード付きのZIPをメモリ上で作成する（暗号化方式は設定のEMAIL_ZIP_ENCRYPTION）
+            # ファイル名はWindowsで文字化けしないようにcp932にする
+            files = []
+            for attachment_file in self.attachment_list:
+                if attachment_file.is_bytes():
+                    files.append((attachment_file.filename, attachment_file.content))
+                else:
+                    files.append((attachment_file.filename, attachment_file.filepath))
+            return compress_files(
+                files,
+                password=self.generate_password(),
+                encryption=getattr(settings, 'EMAIL_ZIP_ENCRYPTION', ENCRYPTION_ZIP_CRYPTO),
+            )
         else:
             return None
 
@@ -194,68 +278,39 @@ class Email(object):
         self.password = common.generate_password(length)
         return self.password
 
-    def send_email(self, user=None):
-        try:
-            self.check_mail_title()
-            self.check_recipient()
-            self.check_cc_list()
-            self.check_bcc_list()
-            self.check_attachment()
+    def check(self):
+        self.check_mail_title()
+        self.check_recipient()
+        self.check_cc_list()
+        self.check_bcc_list()
+        self.check_attachment()
 
-            mail_connection = self.get_mail_connection()
-            if not self.sender:
-                self.sender = mail_connection.username
+    def send_email(self, user=None):
+        self.send_many([self], user=user)
 
-            email = EmailMultiAlternativesWithEncoding(
-                subject=self.mail_title,
-                body=self.mail_body,
-                from_email=self.sender,
-                to=self.recipient_list,
-                cc=self.cc_list,
-                bcc=self.bcc_list,
-                connection=mail_connection
-            )
-            # email.attach_alternative(self.mail_body, constants.MIME_TYPE_HTML)
-            if self.is_encrypt is False:
-                for attachment in [item for item in self.attachment_list]:
-                    if attachment.is_bytes():
-                        email.attach(attachment.filename, attachment.content, constants.MIME_TYPE_ZIP)
-                    else:
-                        email.attach_file(attachment.filepath, constants.MIME_TYPE_STREAM)
-            else:
-                attachments = self.zip_attachments()
-                if attachments:
-                    email.attach('%s.zip' % self.mail_title, attachments, constants.MIME_TYPE_ZIP)
-            email.send()
-            # パスワードを送信する。
-            self.send_password(mail_connection, user=user)
-            logger.info(constants.INFO_EMAIL_SENT.format(
-                title=self.mail_title,
-                to=';'.join(self.recipient_list) if self.recipient_list else '',
-                cc=';'.join(self.cc_list) if self.cc_list else '',
-                bcc=';'.join(self.bcc_list) if self.bcc_list else '',
-            ))
+    @classmethod
+    def send_many(cls, emails, user=None):
+        """複数のメールを一つのSMTP接続でまとめて送信する。
 
+        :param emails: Emailのリスト
+        :param user: 送信者（指定した場合は送信ログを記録する）
+        :return:
+        """
+        try:
+            for email in emails:
+                email.check()
+            with mail_connection_pool.connection() as mail_connection:
+                messages = []
+                for email in emails:
+                    messages.extend(email.get_messages(mail_connection))
+                mail_connection.send_messages([message for message, log_entry in messages])
+            for email in emails:
+                email.log_sent()
             if user:
                 # 送信ログ
-                if self.attachment_list:
-                    attachment_name = ";".join([item.filename for item in self.attachment_list])
-                else:
-                    attachment_name = None
-                EmailLogEntry.objects.create(
-                    user=user,
-                    sender=self.sender,
-                    recipient=";".join(self.recipient_list),
-                    cc=";".join(self.cc_list) if self.cc_list else None,
-                    bcc=";".join(self.bcc_list) if self.bcc_list else None,
-                    title=self.mail_title,
-                    body=self.mail_body,
-                    attachments=attachment_name,
-                )
-        except subprocess.CalledProcessError as e:
-            logger.error(e.output)
-            logger.error(traceback.format_exc())
-            raise e
+                EmailLogEntry.objects.bulk_create([
+                    EmailLogEntry(user=user, **log_entry) for message, log_entry in messages
+                ])
         except SMTPAuthenticationError:
             raise CustomException(constants.ERROR_EMAIL_AUTHENTICATION)
         except SMTPRecipientsRefused:
@@ -263,17 +318,78 @@ class Email(object):
         except Exception as ex:
             logger.error(str(traceback.format_exc()))
             raise ex
-        finally:
-            # # 一時ファイルを削除
-            # for path in self.temp_files:
-            #     if os.path.exists(path):
-            #         if os.path.isdir(path):
-            #             shutil.rmtree(path)
-            #         else:
-            #             os.remove(path)
-            pass
+
+    def get_messages(self, mail_connection):
+        """送信するメッセージ（本体とパスワード）を作成する。
+
+        :param mail_connection: SMTP接続
+        :return: (メッセージ、送信ログの内容)のリスト
+        """
+        if not self.sender:
+            self.sender = mail_connection.username
+
+        email = EmailMultiAlternativesWithEncoding(
+            subject=self.mail_title,
+            body=self.mail_body,
+            from_email=self.sender,
+            to=self.recipient_list,
+            cc=self.cc_list,
+            bcc=self.bcc_list,
+            connection=mail_connection
+        )
+        # email.attach_alternative(self.mail_body, constants.MIME_TYPE_HTML)
+        if self.is_encrypt is False:
+            for attachment in [item for item in self.attachment_list]:
+                if attachment.is_bytes():
+                    email.attach(attachment.filename, attachment.content, constants.MIME_TYPE_ZIP)
+                else:
+                    email.attach_file(attachment.filepath, constants.MIME_TYPE_STREAM)
+        else:
+            attachments = self.zip_attachments()
+            if attachments:
+                email.attach('%s.zip' % self.mail_title, attachments, constants.MIME_TYPE_ZIP)
+        if self.attachment_list:
+            attachment_name = ";".join([item.filename for item in self.attachment_list])
+        else:
+            attachment_name = None
+        messages = [(email, self.get_log_entry(self.mail_title, self.mail_body, attachment_name))]
+        # パスワードを送信する。
+        password_message = self.get_password_message(mail_connection)
+        if password_message:
+            messages.append((password_message, self.get_log_entry(password_message.subject, password_message.body)))
+        return messages
+
+    def get_log_entry(self, title, body, attachments=None):
+        return dict(
+            sender=self.sender,
+            recipient=";".join(self.recipient_list),
+            cc=";".join(self.cc_list) if self.cc_list else None,
+            bcc=";".join(self.bcc_list) if self.bcc_list else None,
+            title=title,
+            body=body,
+            attachments=attachments,
+        )
+
+    def log_sent(self):
+        logger.info(constants.INFO_EMAIL_SENT.format(
+            title=self.mail_title,
+            to=';'.join(self.recipient_list) if self.recipient_list else '',
+            cc=';'.join(self.cc_list) if self.cc_list else '',
+            bcc=';'.join(self.bcc_list) if self.bcc_list else '',
+        ))
+        if self.attachment_list and self.is_encrypt and self.password:
+            logger.info(constants.INFO_PASSWORD_SENT.format(title=self.mail_title))
 
     def send_password(self, conn, user=None):
+        email = self.get_password_message(conn)
+        if email:
+            email.send()
+            logger.info(constants.INFO_PASSWORD_SENT.format(title=self.mail_title))
+            if user:
+                # パスワード送信ログ
+                EmailLogEntry.objects.create(user=user, **self.get_log_entry(email.subject, email.body))
+
+    def get_password_message(self, conn):
         if self.attachment_list and self.is_encrypt and self.password:
             subject = self.pwd_title or self.mail_title
             try:
@@ -290,20 +406,8 @@ class Email(object):
                 connection=conn
             )
             # email.attach_alternative(body, constants.MIME_TYPE_HTML)
-            email.send()
-            logger.info(constants.INFO_PASSWORD_SENT.format(title=self.mail_title))
-            if user:
-                # パスワード送信ログ
-                EmailLogEntry.objects.create(
-                    user=user,
-                    sender=self.sender,
-                    recipient=";".join(self.recipient_list),
-                    cc=";".join(self.cc_list) if self.cc_list else None,
-                    bcc=";".join(self.bcc_list) if self.bcc_list else None,
-                    title=subject,
-                    body=body,
-                    attachments=None,
-                )
+            return email
+        return None
 
 
 class AttachmentFile:
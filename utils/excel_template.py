@@ -0,0 +1,115 @@
+import os
+import pickle
+import threading
+import weakref
+
+import openpyxl as px
+from openpyxl.utils.cell import coordinate_to_tuple
+
+from utils import common
+
+logger = common.get_system_logger()
+# テンプレートから作成したブックと名前付き範囲の対応表
+_book_named_ranges = weakref.WeakKeyDictionary()
+
+
+def parse_named_ranges(book):
+    """ブックの名前付き範囲を（シート名、行、列）のリストに変換する。
+
+    :param book: openpyxlのブック
+    :return: 名前付き範囲の名前をキーとする辞書
+    """
+    named_ranges = dict()
+    for defined_name in book.defined_names.definedName:
+        destinations = []
+        for sheet_title, sheet_coords in defined_name.destinations:
+            # 複数セルの範囲（選択肢のリストなど）は左上のセルにする
+            row, column = coordinate_to_tuple(sheet_coords.replace('$', '').split(':')[0])
+            destinations.append((sheet_title, row, column))
+        named_ranges[defined_name.name] = destinations
+    return named_ranges
+
+
+def get_named_ranges(book):
+    """ブックの名前付き範囲を取得する。
+
+    テンプレートから作成したブックの場合は作成済みの対応表を使い、それ以外の場合は毎回解析する。
+
+    :param book: openpyxlのブック
+    :return:
+    """
+    named_ranges = _book_named_ranges.get(book)
+    if named_ranges is None:
+        named_ranges = parse_named_ranges(book)
+    return named_ranges
+
+
+class TemplateWorkbook(object):
+    """解析済みのテンプレート"""
+
+    def __init__(self, path):
+        self.path = path
+        self.version = self.get_version(path)
+        book = px.load_workbook(path)
+        self.named_ranges = parse_named_ranges(book)
+        # 解析済みのブックをシリアライズして保存し、コピーを作成する時はXMLの解析をしない
+        self.data = pickle.dumps(book, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def get_version(cls, path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def is_changed(self):
+        return self.get_version(self.path) != self.version
+
+    def copy(self):
+        book = pickle.loads(self.data)
+        _book_named_ranges[book] = self.named_ranges
+        return book
+
+
+class TemplateRegistry(object):
+    """Excelのテンプレートをプロセスごとに一回だけ解析する。
+
+    book = template_registry.load(path_template)
+
+    取得したブックはテンプレートのコピーなので、自由に値を設定できる。
+    テンプレートのファイルが更新された場合は解析し直す。
+    """
+
+    def __init__(self):
+        self.templates = dict()
+        self.lock = threading.Lock()
+
+    def get_template(self, path):
+        """解析済みのテンプレートを取得する。
+
+        :param path: テンプレートのパス
+        :return:
+        """
+        path = os.path.abspath(path)
+        template = self.templates.get(path)
+        if template is None or template.is_changed():
+            with self.lock:
+                template = self.templates.get(path)
+                if template is None or template.is_changed():
+                    logger.debug('テンプレート{}を解析します。'.format(path))
+                    template = TemplateWorkbook(path)
+                    self.templates[path] = template
+        return template
+
+    def load(self, path):
+        """テンプレートのコピーを取得する。
+
+        :param path: テンプレートのパス
+        :return: openpyxlのブック
+        """
+        return self.get_template(path).copy()
+
+    def clear(self):
+        with self.lock:
+            self.templates.clear()
+
+
+template_registry = TemplateRegistry()
@@ -1,20 +1,42 @@
-import os
-import firebase_admin
-from firebase_admin import credentials, messaging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from django.conf import settings
+from django.utils.module_loading import import_string
 
 from utils import common, constants
 
 logger = common.get_system_logger()
+_app = None
+_app_lock = threading.Lock()
 
 
-cred = credentials.Certificate(os.path.join(
-    settings.BASE_DIR,
-    'data',
-    'sales-yang-firebase-adminsdk-2ga7e-17745491f0.json'
-))
-firebase_admin.initialize_app(credential=cred)
+def get_messaging():
+    """Firebaseのmessagingを取得する。
+
+    Firebase SDKの読込とアプリの初期化は時間がかかるので、起動時ではなく初回送信時に一回だけ行う。
+
+    :return: firebase_admin.messaging
+    """
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                import firebase_admin
+                from firebase_admin import credentials
+                cred = credentials.Certificate(settings.FIREBASE_CREDENTIALS)
+                _app = firebase_admin.initialize_app(credential=cred)
+    from firebase_admin import messaging
+    return messaging
+
+
+def get_backend():
+    """設定（FIREBASE_BACKEND）によってメッセージの送信方法を取得する。
+
+    :return:
+    """
+    backend = getattr(settings, 'FIREBASE_BACKEND', 'utils.firebase.FirebaseBackend')
+    return import_string(backend)()
 
 
 # def subscribe_to_topic(registration_tokens, topic):
@@ -39,10 +61,195 @@ firebase_admin.initialize_app(credential=cred)
 #     return res.success_count, res.failure_count, res.errors
 
 
+class FirebaseBackend(object):
+    """firebase_adminでマルチキャストを送信する"""
+
+    def send_multicast(self, tokens, data):
+        """デバイスにメッセージを送信する。
+
+        :param tokens: デバイスのトークンリスト（上限500件）
+        :param data: 送信するデータ
+        :return: 成功件数、登録解除されたトークンのリスト
+        """
+        messaging = get_messaging()
+        message = messaging.MulticastMessage(data=data, tokens=tokens)
+        res = messaging.send_multicast(message, app=_app)
+        unregistered_tokens = [
+            token for token, response in zip(tokens, res.responses)
+            if not response.success and isinstance(response.exception, messaging.UnregisteredError)
+        ]
+        return res.success_count, unregistered_tokens
+
+
+class NullBackend(object):
+    """メッセージを送信しない（全件成功とする）"""
+
+    def send_multicast(self, tokens, data):
+        return len(tokens), []
+
+
+class RecordingBackend(object):
+    """メッセージを送信せずにoutboxに記録する（テスト用）
+
+    unregistered_tokensに設定したトークンは登録解除されたとして返す。
+    設定から作成したインスタンスの送信内容も確認できるように、outboxは全インスタンスで共有する（django.core.mail.outboxと同じ）。
+    テストごとにresetで空にする（BaseAPITestCaseはテストの開始時に呼び出す）。
+    """
+    outbox = []
+    unregistered_tokens = set()
+    _lock = threading.Lock()
+
+    @classmethod
+    def reset(cls, unregistered_tokens=None):
+        """送信内容と登録解除されたトークンを初期化する。
+
+        :param unregistered_tokens: 登録解除されたとするトークン
+        :return:
+        """
+        with cls._lock:
+            cls.outbox = []
+            cls.unregistered_tokens = set(unregistered_tokens or [])
+
+    def send_multicast(self, tokens, data):
+        with self._lock:
+            self.outbox.append((list(tokens), data))
+        unregistered_tokens = [token for token in tokens if token in self.unregistered_tokens]
+        return len(tokens) - len(unregistered_tokens), unregistered_tokens
+
+
+class NotificationDispatcher(object):
+    """メッセージをまとめてユーザーに通知する。
+
+    with NotificationDispatcher() as dispatcher:
+        dispatcher.add(topic, title, body)
+        ...
+
+    トピックのデバイスは一回だけ取得し、トークンを500件ずつのマルチキャストに分けて同時に送信する。
+    Firebaseから登録解除されたと返されたデバイスは削除する。
+    """
+
+    def __init__(self, backend=None, max_workers=constants.FIREBASE_SEND_WORKERS):
+        self.backend = backend or get_backend()
+        self.max_workers = max_workers
+        self.messages = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.dispatch()
+
+    def add(self, topic, title, body, forward=None):
+        """通知するメッセージを追加する。
+
+        :param topic: マスターに登録済のトピック（Firebaseに登録済のトピックではありません）
+        :param title: タイトル
+        :param body: メッセージ内容
+        :param forward: メッセージを押下後の遷移先
+        :return:
+        """
+        self.messages.append((topic, title, body, forward))
+
+    @classmethod
+    def add_notification(cls, topic, title, body, forward=None):
+        """画面の通知一覧に表示するメッセージを登録する。
+
+        :param topic: マスターに登録済のトピック
+        :param title: タイトル
+        :param body: メッセージ内容
+        :param forward: メッセージを押下後の遷移先
+        :return:
+        """
+        from account.models import Notification
+        Notification.add_by_topic(topic.name, title, body, forward=forward)
+
+    @classmethod
+    def get_tokens(cls, topic):
+        """トピックに登録したデバイスのトークンを取得する。
+
+        :param topic: マスターに登録済のトピック
+        :return:
+        """
+        from master.models import FirebaseDevice
+        return list(FirebaseDevice.objects.filter(
+            user__in=topic.users.all()
+        ).values_list('token', flat=True).distinct())
+
+    def dispatch(self):
+        """追加したメッセージを通知する。
+        メッセージを先にＤＢ登録してから通知します、
+        そうしないと画面の通知一覧にメッセージが表示できない場合があります。
+
+        :return: 送信成功件数
+        """
+        messages, self.messages = self.messages, []
+        dict_tokens = dict()
+        tasks = []
+        for topic, title, body, forward in messages:
+            self.add_notification(topic, title, body, forward=forward)
+            if topic.pk not in dict_tokens:
+                dict_tokens[topic.pk] = self.get_tokens(topic)
+            tokens = dict_tokens[topic.pk]
+            if not tokens:
+                # トピックに登録したデバイスがない場合
+                logger.info(constants.INFO_FIREBASE_NO_DEVICE.format(topic=topic.name))
+                continue
+            for i in range(0, len(tokens), constants.FIREBASE_MULTICAST_MAX_TOKENS):
+                tasks.append((
+                    topic.name,
+                    tokens[i:i + constants.FIREBASE_MULTICAST_MAX_TOKENS],
+                    {'title': title, 'body': body},
+                ))
+        dict_results, unregistered_tokens = self.send(tasks)
+        for topic_name, (success, failure) in dict_results.items():
+            if failure:
+                logger.info(constants.INFO_FIREBASE_SEND_RESULT.format(topic=topic_name, success=success, failure=failure))
+            else:
+                logger.info(constants.INFO_FIREBASE_SEND_MESSAGE.format(topic=topic_name))
+        if unregistered_tokens:
+            self.prune(unregistered_tokens)
+        return sum(success for success, failure in dict_results.values())
+
+    def send(self, tasks):
+        """マルチキャストを同時に送信する。
+
+        :param tasks: (トピック名称、トークンリスト、送信するデータ)のリスト
+        :return: トピックごとの（成功件数、失敗件数）、登録解除されたトークンのリスト
+        """
+        def send_task(task):
+            topic_name, tokens, data = task
+            try:
+                return self.backend.send_multicast(tokens, data)
+            except Exception as ex:
+                logger.error(ex)
+                return 0, []
+
+        dict_results = dict()
+        unregistered_tokens = []
+        if not tasks:
+            return dict_results, unregistered_tokens
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for (topic_name, tokens, data), (success, unregistered) in zip(tasks, executor.map(send_task, tasks)):
+                total_success, total_failure = dict_results.get(topic_name, (0, 0))
+                dict_results[topic_name] = (total_success + success, total_failure + len(tokens) - success)
+                unregistered_tokens.extend(unregistered)
+        return dict_results, sorted(set(unregistered_tokens))
+
+    @classmethod
+    def prune(cls, tokens):
+        """登録解除されたデバイスを削除する。
+
+        :param tokens: 登録解除されたトークンのリスト
+        :return:
+        """
+        from master.models import FirebaseDevice
+        count, dict_count = FirebaseDevice.objects.filter(token__in=tokens).delete()
+        logger.info(constants.INFO_FIREBASE_DEVICE_PRUNED.format(count=count))
+
+
 def send_message_to_topic(topic, title, body, forward=None):
     """ユーザーにメッセージを通知する
-    メッセージを先にＤＢ登録してから通知します、
-    そうしないと画面の通知一覧にメッセージが表示できない場合があります。
 
     :param topic: マスターに登録済のトピック（Firebaseに登録済のトピックではありません）
     :param title: タイトル
@@ -50,19 +257,5 @@ def send_message_to_topic(topic, title, body, forward=None):
     :param forward: メッセージを押下後の遷移先
     :return:
     """
-    from account.models import Notification
-    from master.models import FirebaseDevice
-    Notification.add_by_topic(topic.name, title, body, forward=forward)
-    devices = FirebaseDevice.objects.filter(user__in=topic.users.all())
-    if devices.count() == 0:
-        # トピックに登録したデバイスがない場合
-        logger.info(constants.INFO_FIREBASE_NO_DEVICE.format(topic=topic.name))
-        return
-    # ユーザーに通知する
-    message = messaging.MulticastMessage(data={
-        'title': title,
-        'body': body
-    }, tokens=[item.token for item in devices])
-
-    res = messaging.send_multicast(message)
-    logger.info(constants.INFO_FIREBASE_SEND_MESSAGE.format(topic=topic.name))
+    with NotificationDispatcher() as dispatcher:
+        dispatcher.add(topic, title, body, forward=forward)
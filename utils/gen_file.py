@@ -1,190 +1,654 @@
 import datetime
+import os
 import re
+import tempfile
+from copy import copy
+
 import openpyxl as px
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import NamedStyle
+from openpyxl.utils import quote_sheetname, range_boundaries
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+from openpyxl.worksheet.dimensions import ColumnDimension
 from openpyxl.writer.excel import save_virtual_workbook
 
+from django.db.models import Count, F, Max, Prefetch
+
 from utils import common, constants
 from utils.app_base import get_member_expense_template_path
+from utils.archive import compress_files
+from utils.document_cache import document_cache
 from utils.errors import CustomException
+from utils.excel_template import get_named_ranges, template_registry
 
+ATTENDANCE_START_ROW = 5  # 勤務時間統計表のデータ開始行
+ATTENDANCE_MIN_COL = 2  # 勤務時間統計表のデータ開始列
+ATTENDANCE_MAX_COL = 21  # 勤務時間統計表のデータ終了列
+EXPENSE_ITEM_END_ROW = 48  # 経費精算書テンプレートの明細終了行（次の行から合計などのフッター）
+EXPENSE_ITEM_NAMES = (  # 経費精算書テンプレートの明細の名前付き範囲（出力する順番）
+    'POS_ITEM_DATE',
+    'POS_ITEM_CONTENT',
+    'POS_ITEM_SUBJECT',
+    'POS_ITEM_PAY_DST',
+    'POS_ITEM_AMOUNT',
+    'POS_ITEM_TAX_RATE',
+    'POS_ITEM_AMOUNT_NO_TAX',
+    'POS_ITEM_TAX_AMOUNT',
+    'POS_ITEM_COMMENT',
+)
 
-def gen_attendance_by_month(path_template, results):
-    book = px.load_workbook(path_template)
-    sheet = book.get_sheet_by_name('Sheet1')
 
-    start_row = 5
-    count = len(results)
-    set_openpyxl_styles(sheet, start_row, start_row + (count - 1 if count else 0), 2, 21)
-    for i, row_data in enumerate(results):
+class StyleRegistry(object):
+    """テンプレートのセルのスタイルを名前付きスタイルとして出力先のブックに登録する。
+
+    同じスタイルのセルは一つの名前付きスタイルを共有するので、セルごとにスタイルをコピーしない。
+    """
+
+    def __init__(self, book):
+        self.book = book
+        self.names = dict()
+        self.style_arrays = dict()
+
+    def get_style_name(self, cell):
+        key = tuple(cell._style)
+        name = self.names.get(key)
+        if name is None:
+            name = 'template_{}'.format(len(self.names) + 1)
+            style = NamedStyle(
+                name=name,
+                font=copy(cell.font),
+                border=copy(cell.border),
+                fill=copy(cell.fill),
+                alignment=copy(cell.alignment),
+                number_format=cell.number_format,
+                protection=copy(cell.protection),
+            )
+            self.book.add_named_style(style)
+            self.names[key] = name
+        return name
+
+    def create_cell(self, sheet, template_cell, value=None):
+        cell = WriteOnlyCell(sheet, value=value)
+        if template_cell.has_style:
+            key = tuple(template_cell._style)
+            style_array = self.style_arrays.get(key)
+            if style_array is None:
+                cell.style = self.get_style_name(template_cell)
+                self.style_arrays[key] = style_array = cell._style
+            else:
+                # 名前付きスタイルの解決は一回だけにし、以降は同じスタイルの参照を使う
+                cell._style = style_array
+        return cell
+
+
+def copy_sheet_layout(src, dst, with_merged_cells=True):
+    """列幅、結合セル、フィルター、印刷設定などシートのレイアウトをコピーする。
+
+    :param src: テンプレートのシート
+    :param dst: 出力先のシート（write-onlyのシートも可）
+    :param with_merged_cells: 結合セルもコピーするか（行の位置が変わる場合は呼び出し側で結合する）
+    :return:
+    """
+    for key, dimension in src.column_dimensions.items():
+        dst.column_dimensions[key] = ColumnDimension(
+            dst, index=key, width=dimension.width, hidden=dimension.hidden,
+            min=dimension.min, max=dimension.max, customWidth=dimension.customWidth,
+        )
+    if with_merged_cells:
+        for merged_range in src.merged_cells.ranges:
+            dst.merged_cells.add(merged_range.coord)
+    dst.auto_filter.ref = src.auto_filter.ref
+    dst.page_setup.orientation = src.page_setup.orientation
+    dst.page_setup.paperSize = src.page_setup.paperSize
+    dst.page_setup.fitToWidth = src.page_setup.fitToWidth
+    dst.page_setup.fitToHeight = src.page_setup.fitToHeight
+    dst.page_setup.scale = src.page_setup.scale
+    dst.page_margins = copy(src.page_margins)
+    dst.print_options = copy(src.print_options)
+    dst.sheet_properties.pageSetUpPr = copy(src.sheet_properties.pageSetUpPr)
+    dst.sheet_format = copy(src.sheet_format)
+
+
+def get_attendance_row_values(row_data):
+    """勤務時間統計表の一行分の値を取得する。
+
+    :param row_data: 出勤情報
+    :return: 2列目から21列目までの値
+    """
+    return [
         # NO
-        sheet.cell(row=start_row + i, column=2).value = "=ROW() - 4"
+        "=ROW() - 4",
         # 隠し項目（Content Type ID)
-        sheet.cell(row=start_row + i, column=3).value = row_data.get('content_type_id') or ''
+        row_data.get('content_type_id') or '',
         # 隠し項目（Object ID)
-        sheet.cell(row=start_row + i, column=4).value = row_data.get('object_id') or ''
+        row_data.get('object_id') or '',
         # 隠し項目（Project ID)
-        sheet.cell(row=start_row + i, column=5).value = row_data.get('project_id') or ''
+        row_data.get('project_id') or '',
         # 社員番号
-        sheet.cell(row=start_row + i, column=6).value = row_data.get('code') or ''
+        row_data.get('code') or '',
         # 氏名
-        sheet.cell(row=start_row + i, column=7).value = row_data.get('full_name') or ''
+        row_data.get('full_name') or '',
         # 所在部署
-        sheet.cell(row=start_row + i, column=8).value = row_data.get('organization_name') or ''
+        row_data.get('organization_name') or '',
         # 所属会社
-        sheet.cell(row=start_row + i, column=9).value = row_data.get('company_name') or ''
+        row_data.get('company_name') or '',
         # 契約形態
-        sheet.cell(row=start_row + i, column=10).value = common.get_name_from_choice(
-            row_data.get('contract_type'), choice=constants.CHOICE_CONTRACT_TYPE
-        ) or ''
+        common.get_name_from_choice(row_data.get('contract_type'), choice=constants.CHOICE_CONTRACT_TYPE) or '',
         # 案件名
-        sheet.cell(row=start_row + i, column=11).value = row_data.get('project_name') or ''
+        row_data.get('project_name') or '',
         # 最寄駅
-        sheet.cell(row=start_row + i, column=12).value = row_data.get('nearest_station') or ''
+        row_data.get('nearest_station') or '',
         # 顧客会社
-        sheet.cell(row=start_row + i, column=13).value = row_data.get('client_name') or ''
+        row_data.get('client_name') or '',
         # 契約種類
-        sheet.cell(row=start_row + i, column=14).value = "一括" if row_data.get('is_blanket_contract') == 1 else 'SES'
+        "一括" if row_data.get('is_blanket_contract') == 1 else 'SES',
         # 勤務時間
-        sheet.cell(row=start_row + i, column=15).value = row_data.get('total_hours') or ''
+        row_data.get('total_hours') or '',
         # ＢＰ勤務時間
-        sheet.cell(row=start_row + i, column=16).value = row_data.get('total_hours_bp') or ''
+        row_data.get('total_hours_bp') or '',
         # 勤務日数
-        sheet.cell(row=start_row + i, column=17).value = row_data.get('total_days') or ''
+        row_data.get('total_days') or '',
         # 深夜日数
-        sheet.cell(row=start_row + i, column=18).value = row_data.get('night_days') or ''
+        row_data.get('night_days') or '',
         # 客先立替金
-        sheet.cell(row=start_row + i, column=19).value = ''
+        '',
         # 立替金
-        sheet.cell(row=start_row + i, column=20).value = ''
+        '',
         # 通勤交通費
-        sheet.cell(row=start_row + i, column=21).value = row_data.get('commuting_amount') or ''
+        row_data.get('commuting_amount') or '',
+    ]
+
+
+def gen_attendance_by_month(path_template, results):
+    """勤務時間統計表を作成する。
+
+    テンプレートからはヘッダー行と列ごとのスタイルだけを取得し、
+    データ行はwrite-onlyのシートに一行ずつ書き込むので、件数が増えてもメモリ使用量は変わらない。
+
+    :param path_template: テンプレートのパス
+    :param results: 出勤情報のリストまたはイテレーター（common.dictfetchiterなど）
+    :return:
+    """
+    template = template_registry.load(path_template)
+    template_sheet = template['Sheet1']
+    book = px.Workbook(write_only=True)
+    sheet = book.create_sheet(template_sheet.title)
+    copy_sheet_layout(template_sheet, sheet)
+    styles = StyleRegistry(book)
+    # ヘッダー
+    for row in template_sheet.iter_rows(min_row=1, max_row=ATTENDANCE_START_ROW - 1):
+        row_idx = row[0].row
+        if row_idx in template_sheet.row_dimensions:
+            sheet.row_dimensions[row_idx].height = template_sheet.row_dimensions[row_idx].height
+        sheet.append([styles.create_cell(sheet, cell, cell.value) for cell in row])
+    # データ行のスタイルはテンプレートの一行目から列ごとに取得する
+    template_cells = [
+        template_sheet.cell(row=ATTENDANCE_START_ROW, column=col)
+        for col in range(ATTENDANCE_MIN_COL, ATTENDANCE_MAX_COL + 1)
+    ]
+    leading_cells = [None] * (ATTENDANCE_MIN_COL - 1)
+    for row_data in results:
+        sheet.append(leading_cells + [
+            styles.create_cell(sheet, template_cell, value)
+            for template_cell, value in zip(template_cells, get_attendance_row_values(row_data))
+        ])
     return save_virtual_workbook(book)
 
 
-def gen_worker_roster(path_template, member):
-    contract = member.contracts.filter(end_date__gte=datetime.date.today()).order_by('start_date').first()
-    book = px.load_workbook(path_template)
-    # 氏名
-    set_named_range_value(book, 'POS_NAME', member.full_name)
-    # フリガナ
-    set_named_range_value(book, 'POS_NAME_FURIGANA', member.full_kana)
-    # 生年月日
-    set_named_range_value(book, 'POS_BIRTHDAY', member.birthday)
-    # 性別
-    set_named_range_value(book, 'POS_GENDER', member.get_gender_display())
+def get_residence_queryset(queryset):
+    """労働者名簿に出力する在留資格の順番に並び替える（有効期限が一番遅いものを出力する）。
+
+    :param queryset: 在留資格のクエリセット
+    :return:
+    """
+    return queryset.filter(is_deleted=False).order_by(F('expired_date').desc(nulls_last=True), '-pk')
+
+
+def get_worker_roster_values(member, contract, families, residence):
+    """労働者名簿の名前付き範囲に設定する値を取得する。
+
+    :param member: 社員
+    :param contract: 現在または次の契約
+    :param families: 扶養家族のリスト
+    :param residence: 在留資格
+    :return: (名前付き範囲の名前、値)のリスト
+    """
+    values = [
+        # 氏名
+        ('POS_NAME', member.full_name),
+        # フリガナ
+        ('POS_NAME_FURIGANA', member.full_kana),
+        # 生年月日
+        ('POS_BIRTHDAY', member.birthday),
+        # 性別
+        ('POS_GENDER', member.get_gender_display()),
+    ]
     if contract:
         # 業務の種類
-        set_named_range_value(book, 'POS_BUSINESS_TYPE', contract.get_business_type())
+        values.append(('POS_BUSINESS_TYPE', contract.get_business_type()))
     # 社員住所の郵便番号
-    set_named_range_value(book, 'POS_POSTCODE', member.post_code)
+    values.append(('POS_POSTCODE', member.post_code))
     # 社員の携帯番号
-    set_named_range_value(book, 'POS_TEL', member.phone)
+    values.append(('POS_TEL', member.phone))
     # 現住所
-    set_named_range_value(book, 'POS_ADDRESS', member.address)
-    if member.residence:
+    values.append(('POS_ADDRESS', member.address))
+    if residence:
         # 在留資格
-        if member.residence.residence_type:
-            set_named_range_value(book, 'POS_RESIDENCE_STATUS', member.residence.get_residence_type_display())
-        if member.residence.expired_date:
-            expired_date = member.residence.expired_date.strftime('%Y 年 %m 月 %d 日')
-            set_named_range_value(book, 'POS_RESIDENCE_EXPIRED_DATE', expired_date)
-        set_named_range_value(book, 'POS_RESIDENCE_NO', member.residence.residence_no)
+        if residence.residence_type:
+            values.append(('POS_RESIDENCE_STATUS', residence.get_residence_type_display()))
+        if residence.expired_date:
+            values.append(('POS_RESIDENCE_EXPIRED_DATE', residence.expired_date.strftime('%Y 年 %m 月 %d 日')))
+        values.append(('POS_RESIDENCE_NO', residence.residence_no))
     if member.join_date:
         # 雇入年月日
-        set_named_range_value(book, 'POS_JOIN_DATE', member.join_date.strftime('%Y 年 %m 月 %d 日'))
+        values.append(('POS_JOIN_DATE', member.join_date.strftime('%Y 年 %m 月 %d 日')))
     # 勤務交通費
-    set_named_range_value(book, 'POS_COMMUTATION_AMOUNT', member.get_commutation_amount())
+    values.append(('POS_COMMUTATION_AMOUNT', member.get_commutation_amount()))
     # 扶養家族情報
-    if contract and contract.has_health_insurance:
-        qs_family = member.families.filter(is_deleted=False)
-    else:
+    if not (contract and contract.has_health_insurance):
         # 社会保険を加入していない場合、扶養人情報の出力は不要
-        qs_family = member.families.none()
-    for i, family in enumerate(qs_family, start=1):
-        # 最大6件しか入力できない。
-        if i > 6:
-            break
-        # 続柄
-        set_named_range_value(book, 'POS_FAMILY_RELATIONSHIP_{}'.format(i), family.get_relationship_display())
-        # 氏名
-        set_named_range_value(book, 'POS_FAMILY_NAME_SPELL_{}'.format(i), family.kana)
-        set_named_range_value(book, 'POS_FAMILY_NAME_{}'.format(i), family.name)
-        # 生年月日
-        set_named_range_value(book, 'POS_FAMILY_BIRTHDAY_{}'.format(i), family.birthday)
-        # 性別
-        set_named_range_value(book, 'POS_FAMILY_GENDER_{}'.format(i), family.get_gender_display())
-        # 個人番号
-        set_named_range_value(book, 'POS_FAMILY_PERSONAL_NUMBER_{}'.format(i), family.personal_number)
-        # 同居
-        set_named_range_value(book, 'POS_FAMILY_LIVING_TOGETHER_{}'.format(i), '○' if family.is_living_together else '×')
-        # 年収
-        if family.has_income == '0':
-            set_named_range_value(book, 'POS_FAMILY_ANNUAL_INCOME_{}'.format(i), 'なし')
-        else:
-            set_named_range_value(book, 'POS_FAMILY_ANNUAL_INCOME_{}'.format(i), family.annual_income)
+        families = []
+    # 最大6件しか入力できない。
+    for i, family in enumerate(list(families)[:6], start=1):
+        values.extend([
+            # 続柄
+            ('POS_FAMILY_RELATIONSHIP_{}'.format(i), family.get_relationship_display()),
+            # 氏名
+            ('POS_FAMILY_NAME_SPELL_{}'.format(i), family.kana),
+            ('POS_FAMILY_NAME_{}'.format(i), family.name),
+            # 生年月日
+            ('POS_FAMILY_BIRTHDAY_{}'.format(i), family.birthday),
+            # 性別
+            ('POS_FAMILY_GENDER_{}'.format(i), family.get_gender_display()),
+            # 個人番号
+            ('POS_FAMILY_PERSONAL_NUMBER_{}'.format(i), family.personal_number),
+            # 同居
+            ('POS_FAMILY_LIVING_TOGETHER_{}'.format(i), '○' if family.is_living_together else '×'),
+            # 年収
+            ('POS_FAMILY_ANNUAL_INCOME_{}'.format(i), 'なし' if family.has_income == '0' else family.annual_income),
+        ])
     # 個人番号
-    set_named_range_value(book, 'POS_PERSONAL_NUMBER', member.personal_number)
+    values.append(('POS_PERSONAL_NUMBER', member.personal_number))
     # 基礎年金番号
     if contract and contract.has_health_insurance:
         basic_pension_no = member.basic_pension_no
     else:
         # 社会保険を加入していない場合、基礎年金番号を入力されても出力しない
         basic_pension_no = None
-    set_named_range_value(book, 'POS_BASIC_PENSION_NO', basic_pension_no)
+    values.append(('POS_BASIC_PENSION_NO', basic_pension_no))
     # 雇用保険証被保険者番号
-    set_named_range_value(book, 'POS_EMPLOYMENT_INSURANCE_NO', member.employment_insurance_no)
+    values.append(('POS_EMPLOYMENT_INSURANCE_NO', member.employment_insurance_no))
+    return values
+
+
+def render_worker_roster(path_template, values):
+    """労働者名簿を作成する。
+
+    :param path_template: テンプレートのパス
+    :param values: get_worker_roster_valuesで取得した値
+    :return: Excelのバイナリーデータ
+    """
+    book = template_registry.load(path_template)
+    for name, value in values:
+        set_named_range_value(book, name, value)
+    return save_virtual_workbook(book)
+
+
+def gen_worker_roster(path_template, member):
+    contract = member.contracts.filter(end_date__gte=datetime.date.today()).order_by('start_date').first()
+    families = member.families.filter(is_deleted=False)
+    residence = get_residence_queryset(member.residences.all()).first()
+    return render_worker_roster(path_template, get_worker_roster_values(member, contract, families, residence))
+
+
+def iter_worker_roster_values(queryset):
+    """複数社員の労働者名簿の値を取得する。
+
+    契約、扶養家族、在留資格はチャンクごとにまとめて取得する。
+
+    :param queryset: 社員のクエリセット
+    :return: (社員、get_worker_roster_valuesで取得した値)のイテレーター
+    """
+    today = datetime.date.today()
+    model = queryset.model
+    contract_model = model._meta.get_field('contracts').related_model
+    family_model = model._meta.get_field('families').related_model
+    residence_model = model._meta.get_field('residences').related_model
+    pk_list = list(queryset.order_by('pk').values_list('pk', flat=True))
+    for i in range(0, len(pk_list), constants.BATCH_CHUNK_SIZE):
+        members = model.objects.filter(pk__in=pk_list[i:i + constants.BATCH_CHUNK_SIZE]).order_by('pk').prefetch_related(
+            Prefetch(
+                'contracts',
+                queryset=contract_model.objects.filter(end_date__gte=today).order_by('start_date'),
+                to_attr='roster_contracts',
+            ),
+            Prefetch('families', queryset=family_model.objects.filter(is_deleted=False), to_attr='roster_families'),
+            Prefetch(
+                'residences',
+                queryset=get_residence_queryset(residence_model.objects.all()),
+                to_attr='roster_residences',
+            ),
+        )
+        for member in members:
+            contract = member.roster_contracts[0] if member.roster_contracts else None
+            residence = member.roster_residences[0] if member.roster_residences else None
+            yield member, get_worker_roster_values(member, contract, member.roster_families, residence)
+
+
+def get_unique_name(name, names, max_length=None):
+    """重複しない名前を取得する（シート名、ファイル名など）。
+
+    :param name: 名前
+    :param names: 使用済みの名前のセット（取得した名前を追加する）
+    :param max_length: 最大長さ
+    :return:
+    """
+    unique_name = name[:max_length] if max_length else name
+    i = 1
+    while unique_name in names:
+        i += 1
+        suffix = '({})'.format(i)
+        unique_name = (name[:max_length - len(suffix)] if max_length else name) + suffix
+    names.add(unique_name)
+    return unique_name
+
+
+def remove_sheet_defined_names(book, sheet):
+    """指定シートを参照する名前付き範囲を削除する（シートを削除する前に呼び出す）。
+
+    他のシートを参照する名前とブック全体の名前（定数など）はそのまま残す。
+
+    :param book: openpyxlのブック
+    :param sheet: 削除するシート
+    :return:
+    """
+    index = book.worksheets.index(sheet)
+    defined_names = []
+    for defined_name in book.defined_names.definedName:
+        if defined_name.localSheetId is not None:
+            if defined_name.localSheetId == index:
+                continue
+            elif defined_name.localSheetId > index:
+                # シートを削除すると、後ろのシートの番号がずれる
+                defined_name.localSheetId -= 1
+        if any(sheet_title == sheet.title for sheet_title, sheet_coords in defined_name.destinations):
+            continue
+        defined_names.append(defined_name)
+    book.defined_names.definedName = defined_names
+
+
+def gen_worker_roster_book(path_template, queryset):
+    """複数社員の労働者名簿を一つのブックに社員ごとのシートとして作成する。
+
+    :param path_template: テンプレートのパス
+    :param queryset: 社員のクエリセット
+    :return: Excelのバイナリーデータ
+    """
+    book = template_registry.load(path_template)
+    template_sheet = book.active
+    named_ranges = get_named_ranges(book)
+    titles = set(book.sheetnames)
+    for member, values in iter_worker_roster_values(queryset):
+        sheet = book.copy_worksheet(template_sheet)
+        sheet.title = get_unique_name(re.sub(r'[\\/*?:\[\]]', '', str(member.full_name)), titles, max_length=31)
+        if template_sheet.print_area:
+            sheet.print_area = template_sheet.print_area
+        for name, value in values:
+            for sheet_title, row, column in named_ranges.get(name, []):
+                sheet.cell(row=row, column=column, value=value)
+    if len(book.worksheets) > 1:
+        # テンプレートのシートを参照する名前付き範囲は、シートと一緒に削除する
+        remove_sheet_defined_names(book, template_sheet)
+        book.remove(template_sheet)
     return save_virtual_workbook(book)
 
 
+def gen_worker_roster_zip(path_template, queryset, fileobj=None, password=None):
+    """複数社員の労働者名簿を社員ごとのファイルとしてZIPにする。
+
+    作成したExcelは一件ずつ一時フォルダーに書き込み、メモリに溜めない。
+
+    :param path_template: テンプレートのパス
+    :param queryset: 社員のクエリセット
+    :param fileobj: ZIPの出力先（seek可能なファイルオブジェクト）、指定しない場合はメモリ上に作成する
+    :param password: ZIPのパスワード
+    :return: fileobjを指定した場合はfileobj、それ以外はZIPのバイナリーデータ
+    """
+    filenames = set()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = []
+        for i, (member, values) in enumerate(iter_worker_roster_values(queryset)):
+            name = get_unique_name(constants.NAME_WORKER_ROSTER_BY_MEMBER.format(name=member.full_name), filenames)
+            path = os.path.join(tmp_dir, '{}.xlsx'.format(i))
+            with open(path, 'wb') as f:
+                f.write(render_worker_roster(path_template, values))
+            files.append((name + '.xlsx', path))
+        return compress_files(files, password=password, fileobj=fileobj)
+
+
+class PagedSheetWriter(object):
+    """テンプレートの印刷範囲を一ページとして、明細の件数に合わせてページを追加しながら書き込む。
+
+    ページごとにシートを作成し、各シートにはテンプレートのヘッダーを出力する。
+    フッター（合計など）は最後のページだけに出力し、それ以外のページはフッターの行まで明細を出力する。
+    テンプレートは「ページに合わせて印刷」の設定なので、改ページではなくシートでページを分ける。
+    明細はwrite-onlyのシートに一行ずつ書き込むので、件数が増えてもメモリ使用量は変わらない。
+    """
+
+    def __init__(self, template_sheet, item_start_row, item_end_row, header_values=None):
+        """
+        :param template_sheet: テンプレートのシート
+        :param item_start_row: 明細の開始行
+        :param item_end_row: 最後のページの明細の終了行（次の行からフッター）
+        :param header_values: ヘッダーに設定する値（キーは(行、列)）
+        """
+        self.template_sheet = template_sheet
+        self.item_start_row = item_start_row
+        self.item_end_row = item_end_row
+        self.header_values = header_values or dict()
+        print_max_row = range_boundaries(template_sheet.print_area[0])[3]
+        # フッターがないページの明細の件数
+        self.page_rows = print_max_row - item_start_row + 1
+        # 最後のページの明細の件数
+        self.last_page_rows = item_end_row - item_start_row + 1
+        self.book = px.Workbook(write_only=True)
+        self.styles = StyleRegistry(self.book)
+        self.item_cells = template_sheet[item_start_row]
+        self.item_merged_cols = [
+            (merged_range.min_col, merged_range.max_col) for merged_range in template_sheet.merged_cells.ranges
+            if merged_range.min_row == merged_range.max_row == item_start_row
+        ]
+        self.item_range_re = re.compile(r'(?<![A-Za-z0-9!$])(\$?[A-Z]{1,3}\$?)%d:(\$?[A-Z]{1,3}\$?)%d(?!\d)' % (
+            item_start_row, item_end_row,
+        ))
+        self.pages = []
+        self.sheet = None
+        self.count = 0
+
+    def add_page(self):
+        if self.pages:
+            title = '{}({})'.format(self.template_sheet.title, len(self.pages) + 1)
+        else:
+            title = self.template_sheet.title
+        sheet = self.book.create_sheet(title)
+        copy_sheet_layout(self.template_sheet, sheet, with_merged_cells=False)
+        sheet.print_area = self.template_sheet.print_area
+        for merged_range in self.template_sheet.merged_cells.ranges:
+            if merged_range.max_row < self.item_start_row:
+                sheet.merged_cells.add(merged_range.coord)
+        self.copy_rows(sheet, 1, self.item_start_row - 1, lambda cell: self.header_values.get(
+            (cell.row, cell.column), cell.value
+        ))
+        self.pages.append(sheet)
+        self.sheet = sheet
+        self.count = 0
+
+    def copy_rows(self, sheet, min_row, max_row, get_value):
+        for row in self.template_sheet.iter_rows(min_row=min_row, max_row=max_row):
+            self.set_row_height(sheet, row[0].row, row[0].row)
+            sheet.append([self.styles.create_cell(sheet, cell, get_value(cell)) for cell in row])
+
+    def set_row_height(self, sheet, row_idx, template_row_idx):
+        if template_row_idx in self.template_sheet.row_dimensions:
+            sheet.row_dimensions[row_idx].height = self.template_sheet.row_dimensions[template_row_idx].height
+
+    def append(self, values=None):
+        """明細を一行追加する。
+
+        :param values: 明細の値（キーは列番号）、空行の場合はNone
+        :return:
+        """
+        if self.sheet is None or self.count >= self.page_rows:
+            self.add_page()
+        values = values or dict()
+        row_idx = self.item_start_row + self.count
+        self.set_row_height(self.sheet, row_idx, self.item_start_row)
+        for min_col, max_col in self.item_merged_cols:
+            self.sheet.merged_cells.add(CellRange(min_col=min_col, min_row=row_idx, max_col=max_col, max_row=row_idx))
+        self.sheet.append([
+            self.styles.create_cell(self.sheet, cell, values.get(cell.column)) for cell in self.item_cells
+        ])
+        self.count += 1
+
+    def get_footer_value(self, value):
+        """フッターの明細を参照する数式を、前のページの明細も参照するように変換する。
+
+        例：=SUM(F8:F48) → =(SUM(F8:F48))+(SUM('精算書年月 '!F8:F73))
+
+        :param value: テンプレートのセルの値
+        :return:
+        """
+        if len(self.pages) == 1 or not isinstance(value, str) or not value.startswith('='):
+            return value
+        expression = value[1:]
+        if not self.item_range_re.search(expression):
+            return value
+        end_row = self.item_start_row + self.page_rows - 1
+        expressions = [expression]
+        for sheet in self.pages[:-1]:
+            expressions.append(self.item_range_re.sub(lambda m: '{}!{}{}:{}{}'.format(
+                quote_sheetname(sheet.title), m.group(1), self.item_start_row, m.group(2), end_row,
+            ), expression))
+        return '=' + '+'.join('({})'.format(expression) for expression in expressions)
+
+    def copy_data_validations(self):
+        last_page = self.pages[-1]
+        for data_validation in self.template_sheet.data_validations.dataValidation:
+            ranges = list(data_validation.sqref.ranges)
+            is_item = all(
+                self.item_start_row <= cell_range.min_row and cell_range.max_row <= self.item_end_row
+                for cell_range in ranges
+            )
+            if not is_item:
+                last_page.data_validations.append(copy(data_validation))
+                continue
+            for sheet in self.pages:
+                dv = copy(data_validation)
+                end_row = self.item_end_row if sheet is last_page else self.item_start_row + self.page_rows - 1
+                dv.sqref = MultiCellRange([CellRange(
+                    min_col=cell_range.min_col, min_row=self.item_start_row, max_col=cell_range.max_col, max_row=end_row,
+                ) for cell_range in ranges])
+                if sheet is not last_page and dv.formula1 and not dv.formula1.startswith('"'):
+                    # 選択肢の範囲はフッターの下にあるので、最後のページを参照する
+                    dv.formula1 = '{}!{}'.format(quote_sheetname(last_page.title), dv.formula1)
+                sheet.data_validations.append(dv)
+
+    def save(self):
+        """残りの行とフッターを出力して保存する。
+
+        :return: Excelのバイナリーデータ
+        """
+        if self.sheet is None:
+            self.add_page()
+        if self.count > self.last_page_rows:
+            # フッターが入らない場合は空行でページを埋めて、次のページにフッターを出力する
+            while self.count < self.page_rows:
+                self.append()
+            self.add_page()
+        while self.count < self.last_page_rows:
+            self.append()
+        for merged_range in self.template_sheet.merged_cells.ranges:
+            if merged_range.min_row > self.item_end_row:
+                self.sheet.merged_cells.add(merged_range.coord)
+        self.copy_rows(
+            self.sheet, self.item_end_row + 1, self.template_sheet.max_row, lambda cell: self.get_footer_value(cell.value)
+        )
+        self.copy_data_validations()
+        return save_virtual_workbook(self.book)
+
+
 def gen_member_expense(member, year, month):
-    qs_expense = member.expenses.filter(
-        is_deleted=False, year=year, month=month, cost_type='01',
-    ).order_by('date')
-    first_expense = qs_expense.first()
-    data_count = qs_expense.count()
-    if first_expense is None:
+    """経費精算書を作成する。
+
+    キャッシュのキーは明細の件数と最終更新日時など、集計クエリ一回で取得できる値から作成し、
+    明細はキャッシュにない場合だけ一回のクエリで順番に読み込み、一ページに入りきらない場合はページを追加する。
+
+    :param member: 社員
+    :param year: 対象年
+    :param month: 対象月
+    :return: Excelのバイナリーデータ
+    """
+    qs_expense = member.expenses.filter(is_deleted=False, year=year, month=month, cost_type='01')
+    summary = qs_expense.aggregate(
+        count=Count('pk'),
+        updated_dt=Max('updated_dt'),
+        category_updated_dt=Max('category__updated_dt'),
+    )
+    if not summary['count']:
         raise CustomException(constants.ERROR_NO_EXPENSES.format(
             name=str(member),
             year=year,
             month=month,
         ))
-    elif data_count > constants.EXPENSE_EXPORT_MAX_ROWS:
-        raise CustomException(constants.ERROR_EXPENSE_COUNT_OVER.format(
-            name=str(member),
-            year=year,
-            month=month,
-            count=constants.EXPENSE_EXPORT_MAX_ROWS,
-        ))
-    if data_count <= 40:
-        path_template = get_member_expense_template_path()
-    else:
-        path_template = get_member_expense_template_path(is_row_over=True)
-    book = px.load_workbook(path_template)
-    # 氏名
-    set_named_range_value(book, 'POS_NAME', member.full_name)
-    # 作成者
-    set_named_range_value(book, 'POS_CREATOR', member.full_name)
+    qs_expense = qs_expense.order_by('date')
+    first_expense = qs_expense.select_related('organization').first()
     # 所属
     if first_expense.organization:
         organization = first_expense.organization
     else:
         organization = member.get_organization(first_expense.year, first_expense.month)
-    set_named_range_value(book, 'POS_ORGANIZATION', organization and organization.name)
-    # 申請日
     first_day = datetime.date(int(year), int(month), 1)
-    set_named_range_value(book, 'POS_SUBMIT_DATE', common.get_last_day_by_month(first_day))
-    for i, expense in enumerate(qs_expense):
-        set_named_range_value(book, 'POS_ITEM_DATE', expense.date, offset_row=i)
-        set_named_range_value(book, 'POS_ITEM_CONTENT', expense.content, offset_row=i)
-        set_named_range_value(book, 'POS_ITEM_SUBJECT', expense.category.name, offset_row=i)
-        set_named_range_value(book, 'POS_ITEM_PAY_DST', expense.payment_destination, offset_row=i)
-        set_named_range_value(book, 'POS_ITEM_AMOUNT', expense.amount, offset_row=i)
-        set_named_range_value(book, 'POS_ITEM_TAX_RATE', expense.tax_rate, offset_row=i)
-        set_named_range_value(book, 'POS_ITEM_AMOUNT_NO_TAX', expense.amount_no_tax, offset_row=i)
-        set_named_range_value(book, 'POS_ITEM_TAX_AMOUNT', expense.tax_amount, offset_row=i)
-        set_named_range_value(book, 'POS_ITEM_COMMENT', expense.comment, offset_row=i)
+    header_items = [
+        # 氏名
+        ('POS_NAME', member.full_name),
+        # 作成者
+        ('POS_CREATOR', member.full_name),
+        ('POS_ORGANIZATION', organization and organization.name),
+        # 申請日
+        ('POS_SUBMIT_DATE', common.get_last_day_by_month(first_day)),
+    ]
+    path_template = get_member_expense_template_path()
 
-    return save_virtual_workbook(book)
+    def create():
+        book = template_registry.load(path_template)
+        named_ranges = get_named_ranges(book)
+        header_values = dict()
+        for name, value in header_items:
+            for sheet_title, row, column in named_ranges.get(name, []):
+                header_values[(row, column)] = value
+        columns = [named_ranges[name][0][2] for name in EXPENSE_ITEM_NAMES]
+        writer = PagedSheetWriter(
+            book[named_ranges['POS_ITEM_DATE'][0][0]],
+            named_ranges['POS_ITEM_DATE'][0][1],
+            EXPENSE_ITEM_END_ROW,
+            header_values,
+        )
+        for expense in qs_expense.select_related('category').iterator(chunk_size=constants.BATCH_CHUNK_SIZE):
+            writer.append(dict(zip(columns, [
+                expense.date,
+                expense.content,
+                expense.category.name,
+                expense.payment_destination,
+                expense.amount,
+                expense.tax_rate,
+                expense.amount_no_tax,
+                expense.tax_amount,
+                expense.comment,
+            ])))
+        return writer.save()
+
+    key = document_cache.make_key(path_template, [member.pk, year, month, summary, header_items])
+    return document_cache.get_or_create(key, '.xlsx', create)
 
 
 def set_openpyxl_styles(ws, min_row, max_row, min_col, max_col):
@@ -222,11 +686,14 @@ def set_openpyxl_styles(ws, min_row, max_row, min_col, max_col):
 
 
 def set_named_range_value(book, name, value, offset_row=0, offset_col=0):
-    if name in book.defined_names:
-        for sheet_title, sheet_coords in book.defined_names[name].destinations:
-            sheet = book[sheet_title]
-            if offset_row > 0 or offset_col > 0:
-                cell = sheet[sheet_coords]
-                sheet.cell(row=cell.row + offset_row, column=cell.column + offset_col, value=value)
-            else:
-                sheet[sheet_coords].value = value
+    """名前付き範囲のセルに値を設定する。
+
+    :param book: ブック（template_registry.loadで取得したブックは名前付き範囲を解析しない）
+    :param name: 名前付き範囲の名前
+    :param value: 値
+    :param offset_row: 名前付き範囲からずらす行数
+    :param offset_col: 名前付き範囲からずらす列数
+    :return:
+    """
+    for sheet_title, row, column in get_named_ranges(book).get(name, []):
+        book[sheet_title].cell(row=row + offset_row, column=column + offset_col, value=value)
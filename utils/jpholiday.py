@@ -1,212 +1,225 @@
 # -*- coding: utf-8 -*-
 
+import bisect
 import datetime
+import functools
 import math
-import calendar
+
+YEAR_CACHE_SIZE = 256  # キャッシュする年数の上限
+START_DATE = datetime.date(1948, 7, 20)  # 国民の祝日に関する法律の施行日
 
 
 def get_holiday_name(date):
     """
     その日の祝日名を返します。
     """
-    return _holiday_name(date)
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    return _get_year_holidays(date.year).names.get(date)
 
 
 def is_holiday(date):
     """
     その日が祝日かどうかを返します。
     """
-    name = _holiday_name(date)
-    if name is None:
-        return False
-
-    return True
+    return get_holiday_name(date) is not None
 
 
 def year_holidays(year):
     """
     その年の祝日日、祝日名を返します。
     """
-    date = datetime.date(year, 1, 1)
+    year_holiday = _get_year_holidays(year)
+    return list(zip(year_holiday.dates, year_holiday.values))
 
-    output = []
-    while date.year == year:
-        name = _holiday_name(date)
-        if name is not None:
-            output.append((date, name))
 
-        date = date + datetime.timedelta(days=1)
+def month_holidays(year, month):
+    """
+    その月の祝日日、祝日名を返します。
+    """
+    year_holiday = _get_year_holidays(year)
+    start, end = year_holiday.get_month_range(month)
+    return list(zip(year_holiday.dates[start:end], year_holiday.values[start:end]))
+
 
+def holidays(start_date, end_date):
+    """
+    指定された期間の祝日日、祝日名を返します。
+    """
+    output = []
+    for year in range(start_date.year, end_date.year + 1):
+        year_holiday = _get_year_holidays(year)
+        start = bisect.bisect_left(year_holiday.dates, start_date)
+        end = bisect.bisect_right(year_holiday.dates, end_date)
+        output.extend(zip(year_holiday.dates[start:end], year_holiday.values[start:end]))
     return output
 
 
-def month_holidays(year, month):
+class _YearHolidays(object):
     """
-    その月の祝日日、祝日名を返します。
+    一年分の祝日（日付順）を保持します。
     """
-    date = datetime.date(year, month, 1)
 
-    output = []
-    while date.month == month:
-        name = _holiday_name(date)
-        if name is not None:
-            output.append((date, name))
+    def __init__(self, year, names):
+        self.names = names
+        self.dates = sorted(names)
+        self.values = [names[date] for date in self.dates]
+        # 各月の先頭の祝日の位置
+        self.month_index = [bisect.bisect_left(self.dates, datetime.date(year, month, 1)) for month in range(1, 13)]
+        self.month_index.append(len(self.dates))
 
-        date = date + datetime.timedelta(days=1)
+    def get_month_range(self, month):
+        return self.month_index[month - 1], self.month_index[month]
 
-    return output
 
+@functools.lru_cache(maxsize=YEAR_CACHE_SIZE)
+def _get_year_holidays(year):
+    return _YearHolidays(year, _generate_year_holidays(year))
 
-def holidays(start_date, end_date):
+
+def _generate_year_holidays(year):
     """
-    指定された期間の祝日日、祝日名を返します。
+    その年の祝日を規則に従って作成します。
     """
-    output = []
-    while start_date <= end_date:
-        name = _holiday_name(start_date)
-        if name is not None:
-            output.append((start_date, name))
+    if year < START_DATE.year:
+        return {}
 
-        start_date = start_date + datetime.timedelta(days=1)
+    names = _base_holidays(year)
+    if year == START_DATE.year:
+        names = {date: name for date, name in names.items() if date >= START_DATE}
 
-    return output
+    # 振替休日（日曜日の祝日の翌日の月曜日）
+    for date, name in list(names.items()):
+        monday = date + datetime.timedelta(days=1)
+        if date.isoweekday() == 7 and monday not in names:
+            names[monday] = name + ' 振替休日'
 
+    # 国民の休日（前日と翌日が祝日の日）
+    holiday_dates = set(names)
+    for date in holiday_dates:
+        middle = date + datetime.timedelta(days=1)
+        if middle not in holiday_dates and date + datetime.timedelta(days=2) in holiday_dates:
+            names[middle] = '国民の休日'
 
-def _holiday_name(date, search_national_holiday=True):
-    if date < datetime.date(1948, 7, 20):
-        return None
-    else:
-        name = None
+    return names
+
+
+def _base_holidays(year):
+    """
+    振替休日と国民の休日以外の祝日を返します。
+    """
+    names = dict()
+
+    def add(month, day, name):
+        names[datetime.date(year, month, day)] = name
 
     # 1月
-    if date.month == 1:
-        if date.day == 1:
-            name = '元日'
-        elif date.year <= 1999 and date.day == 15:
-            name = '成人の日'
-        elif date.year >= 2000 and date.day == _week_day(date, 2, 1).day:
-            name = '成人の日'
+    add(1, 1, '元日')
+    if year <= 1999:
+        add(1, 15, '成人の日')
+    else:
+        add(1, _nth_monday(year, 1, 2), '成人の日')
 
     # 2月
-    elif date.month == 2:
-        if date.year >= 1967 and date.day == 11:
-            name = '建国記念の日'
-        # 2019: 国民の祝日に関する法律(昭和23年法律第178号)の一部改正
-        elif date.year >= 2020 and date.day == 23:
-            name = '天皇誕生日'
-
+    if year >= 1967:
+        add(2, 11, '建国記念の日')
+    # 2019: 国民の祝日に関する法律(昭和23年法律第178号)の一部改正
+    if year >= 2020:
+        add(2, 23, '天皇誕生日')
 
     # 3月
-    elif date.month == 3:
-        if date.day == _vernal_equinox_day(date.year):
-            name = '春分の日'
+    _add_equinox_day(names, year, 3, _vernal_equinox_day(year), '春分の日')
 
     # 4月
-    elif date.month == 4:
-        if date.year <= 1988 and date.day == 29:
-            name = '天皇誕生日'
-        elif date.year >= 1989 and date.year <= 2006 and date.day == 29:
-            name = 'みどりの日'
-        elif date.year >= 2007 and date.day == 29:
-            name = '昭和の日'
+    if year <= 1988:
+        add(4, 29, '天皇誕生日')
+    elif year <= 2006:
+        add(4, 29, 'みどりの日')
+    else:
+        add(4, 29, '昭和の日')
 
     # 5月
-    elif date.month == 5:
-        if date.day == 3:
-            name = '憲法記念日'
-        elif date.year >= 2007 and date.day == 4:
-            name = 'みどりの日'
-        elif date.day == 5:
-            name = 'こどもの日'
-        elif date.day == 6 and date.isoweekday() in (2, 3):
-            holiday_name = _calc_date_holiday_name(date, datetime.timedelta(days=-date.isoweekday()))
-            if holiday_name is not None:
-                name = holiday_name + ' 振替休日'
+    add(5, 3, '憲法記念日')
+    if year >= 2007:
+        add(5, 4, 'みどりの日')
+    add(5, 5, 'こどもの日')
+    may6 = datetime.date(year, 5, 6)
+    if may6.isoweekday() in (2, 3):
+        sunday_name = names.get(may6 - datetime.timedelta(days=may6.isoweekday()))
+        if sunday_name is not None:
+            names[may6] = sunday_name + ' 振替休日'
 
     # 7月
-    elif date.month == 7:
-        if date.year >= 1996 and date.year <= 2002 and date.day == 20:
-            name = '海の日'
-        # 2020: 国民の祝日に関する法律の一部を改正する法律(平成30年法律第57号)
-        elif date.year >= 2003 and date.year != 2020 and date.day == _week_day(date, 3, 1).day:
-            name = '海の日'
+    if 1996 <= year <= 2002:
+        add(7, 20, '海の日')
+    # 2020: 国民の祝日に関する法律の一部を改正する法律(平成30年法律第57号)
+    elif year >= 2003 and year != 2020:
+        add(7, _nth_monday(year, 7, 3), '海の日')
 
     # 8月
-    elif date.month == 8:
-        # 2016: 国民の祝日に関する法律の一部を改正する法律(平成26年法律第43号)
-        # 2020: 国民の祝日に関する法律の一部を改正する法律(平成30年法律第57号)
-        if date.year >= 2016 and date.year != 2020 and date.day == 11:
-            name = '山の日'
+    # 2016: 国民の祝日に関する法律の一部を改正する法律(平成26年法律第43号)
+    # 2020: 国民の祝日に関する法律の一部を改正する法律(平成30年法律第57号)
+    if year >= 2016 and year != 2020:
+        add(8, 11, '山の日')
 
     # 9月
-    elif date.month == 9:
-        if date.year >= 1966 and date.year <= 2002 and date.day == 15:
-            name = '敬老の日'
-        elif date.year >= 2003 and date.day == _week_day(date, 3, 1).day:
-            name = '敬老の日'
-        elif date.day == _autumn_equinox_day(date.year):
-            name = '秋分の日'
+    if 1966 <= year <= 2002:
+        add(9, 15, '敬老の日')
+    elif year >= 2003:
+        add(9, _nth_monday(year, 9, 3), '敬老の日')
+    _add_equinox_day(names, year, 9, _autumn_equinox_day(year), '秋分の日')
 
     # 10月
-    elif date.month == 10:
-        if date.year >= 1966 and date.year <= 1999 and date.day == 10:
-            name = '体育の日'
-        elif date.year >= 2000 and date.year <= 2019 and date.day == _week_day(date, 2, 1).day:
-            name = '体育の日'
-        # 2020: 国民の祝日に関する法律の一部を改正する法律(平成30年法律第57号)
-        #       国民の祝日に関する法律(昭和23年法律第178号)の特例
-        elif date.year >= 2020 and date.year != 2020 and date.day == _week_day(date, 2, 1).day:
-            name = 'スポーツの日'
+    if 1966 <= year <= 1999:
+        add(10, 10, '体育の日')
+    elif 2000 <= year <= 2019:
+        add(10, _nth_monday(year, 10, 2), '体育の日')
+    # 2020: 国民の祝日に関する法律の一部を改正する法律(平成30年法律第57号)
+    #       国民の祝日に関する法律(昭和23年法律第178号)の特例
+    elif year >= 2021:
+        add(10, _nth_monday(year, 10, 2), 'スポーツの日')
 
     # 11月
-    elif date.month == 11:
-        if date.day == 3:
-            name = '文化の日'
-        elif date.day == 23:
-            name = '勤労感謝の日'
+    add(11, 3, '文化の日')
+    add(11, 23, '勤労感謝の日')
 
     # 12月
-    elif date.month == 12:
-        # 2019: 国民の祝日に関する法律(昭和23年法律第178号)の一部改正
-        if date.year <= 2018 and date.day == 23:
-            name = '天皇誕生日'
+    # 2019: 国民の祝日に関する法律(昭和23年法律第178号)の一部改正
+    if year <= 2018:
+        add(12, 23, '天皇誕生日')
 
     # 皇室慶弔行事に伴う祝日
     # 2019: 天皇の即位の日及び即位礼正殿の儀の行われる日を休日とする法律
-    if date == datetime.date(1959, 4, 10):
-        name = '皇太子・明仁親王の結婚の儀'
-    elif date == datetime.date(1989, 2, 24):
-        name = '昭和天皇の大喪の礼'
-    elif date == datetime.date(1990, 11, 12):
-        name = '即位の礼正殿の儀'
-    elif date == datetime.date(1993, 6, 9):
-        name = '皇太子・皇太子徳仁親王の結婚の儀'
-    elif date == datetime.date(2019, 5, 1):
-        name = '天皇の即位の日'
-    elif date == datetime.date(2019, 10, 22):
-        name = '即位礼正殿の儀'
-
     # 2020: 国民の祝日に関する法律(昭和23年法律第178号)の特例
-    if date == datetime.date(2020, 7, 23):
-        name = '海の日'
-    elif date == datetime.date(2020, 7, 24):
-        name = 'スポーツの日'
-    elif date == datetime.date(2020, 8, 10):
-        name = '山の日'
-
-    # 振替休日
-    if name is None and date.isoweekday() == 1:
-        prev_name = _calc_date_holiday_name(date, datetime.timedelta(days=-1))
-        if prev_name is not None:
-            name = prev_name + ' 振替休日'
-
-    # 国民の休日
-    if name is None and search_national_holiday == True:
-        if _calc_date_holiday_name(date, datetime.timedelta(days=-1)) is not None \
-                and _calc_date_holiday_name(date, datetime.timedelta(days=1)) is not None:
-            name = '国民の休日'
-
-    return name
+    for date, name in _SPECIAL_HOLIDAYS.get(year, ()):
+        names[date] = name
+
+    return names
+
+
+_SPECIAL_HOLIDAYS = {
+    1959: ((datetime.date(1959, 4, 10), '皇太子・明仁親王の結婚の儀'),),
+    1989: ((datetime.date(1989, 2, 24), '昭和天皇の大喪の礼'),),
+    1990: ((datetime.date(1990, 11, 12), '即位の礼正殿の儀'),),
+    1993: ((datetime.date(1993, 6, 9), '皇太子・皇太子徳仁親王の結婚の儀'),),
+    2019: (
+        (datetime.date(2019, 5, 1), '天皇の即位の日'),
+        (datetime.date(2019, 10, 22), '即位礼正殿の儀'),
+    ),
+    2020: (
+        (datetime.date(2020, 7, 23), '海の日'),
+        (datetime.date(2020, 7, 24), 'スポーツの日'),
+        (datetime.date(2020, 8, 10), '山の日'),
+    ),
+}
+
+
+def _add_equinox_day(names, year, month, day, name):
+    """
+    春分の日・秋分の日を追加します（同じ日に他の祝日がある場合はそちらを優先）。
+    """
+    if 1 <= day <= 31:
+        names.setdefault(datetime.date(year, month, day), name)
 
 
 def _vernal_equinox_day(year):
@@ -259,32 +272,9 @@ def _autumn_equinox_day(year):
     return math.floor(i + 0.242194 * (year - 1980) - math.floor((year - 1980) / 4))
 
 
-def _calc_date_holiday_name(date, timedelta):
-    """
-    日付計算後その日付の祝日名を返します。
-    """
-    new_date = date + timedelta
-    new_date_name = _holiday_name(new_date, False)
-    return new_date_name
-
-
-def _week_day(date, week, weekday):
+def _nth_monday(year, month, week):
     """
-    特定の月の第1月曜日などを返します。
+    特定の月の第N月曜日（日）を返します。
     """
-    if week < 1 or week > 5:
-        return None
-
-    if weekday < 1 or weekday > 7:
-        return None
-
-    lines = calendar.monthcalendar(date.year, date.month)
-
-    days = []
-    for line in lines:
-        if line[weekday - 1] == 0:
-            continue
-
-        days.append(line[weekday - 1])
-
-    return datetime.date(date.year, date.month, days[week - 1])
+    first_weekday = datetime.date(year, month, 1).weekday()
+    return (7 - first_weekday) % 7 + 1 + (week - 1) * 7
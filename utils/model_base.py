@@ -5,7 +5,8 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from django.core.validators import RegexValidator
 from django.db import models, transaction
-from django.db.models import Max, ProtectedError
+from django.db.models import Max, ProtectedError, Q, F, Value, ExpressionWrapper
+from django.db.models.functions import Cast, NullIf
 from django.utils import timezone
 
 from utils import constants, common
@@ -14,6 +15,32 @@ from utils.errors import CustomException
 logger = common.get_system_logger()
 
 
+def get_ym_lte_q(year, month, year_field='year', month_field='month'):
+    """文字列の年月が指定年月以前である条件を取得する。
+
+    Concat('year', 'month')で比較する場合と違って、年月のインデックスが使える。
+
+    :param year: 指定年（例：'2020'）
+    :param month: 指定月（例：'04'）
+    :param year_field: 年の項目名
+    :param month_field: 月の項目名
+    :return:
+    """
+    return Q(**{year_field + '__lt': year}) | Q(**{year_field: year, month_field + '__lte': month})
+
+
+def get_ym_gte_q(year, month, year_field='year', month_field='month'):
+    """文字列の年月が指定年月以降である条件を取得する。
+
+    :param year: 指定年（例：'2020'）
+    :param month: 指定月（例：'04'）
+    :param year_field: 年の項目名
+    :param month_field: 月の項目名
+    :return:
+    """
+    return Q(**{year_field + '__gt': year}) | Q(**{year_field: year, month_field + '__gte': month})
+
+
 class DefaultManager(models.Manager):
 
     def __init__(self, *args, **kwargs):
@@ -28,6 +55,140 @@ class DefaultManager(models.Manager):
         return self.get_queryset().filter(is_deleted=False)
 
 
+class YearMonthQuerySet(models.QuerySet):
+    """整数の年月（ym、end_ym）で検索・更新するクエリセット
+
+    文字列の年月をConcatで結合して比較すると、インデックスが使えないので、
+    年月の条件はym/end_ymの範囲検索にする。
+    """
+
+    def has_end_ym(self):
+        return any(ym_field == 'end_ym' for ym_field, year_field, month_field in self.model.ym_fields)
+
+    def in_month(self, year, month):
+        """指定年月の対象データを絞り込む。
+
+        終了年月がある場合、開始年月から終了年月までの期間に指定年月が含まれるデータも対象とする。
+
+        :param year: 指定年（例：'2020'）
+        :param month: 指定月（例：'04'）
+        :return:
+        """
+        ym = common.get_ym(year, month)
+        if self.has_end_ym():
+            return self.filter(Q(ym=ym, end_ym__isnull=True) | Q(ym__lte=ym, end_ym__gte=ym))
+        else:
+            return self.filter(ym=ym)
+
+    def overlapping(self, ym_from, ym_to):
+        """指定期間と重なっているデータを絞り込む。
+
+        :param ym_from: 開始年月（例：202004）
+        :param ym_to: 終了年月（例：202009）
+        :return:
+        """
+        if self.has_end_ym():
+            return self.filter(
+                Q(end_ym__isnull=True, ym__gte=ym_from) | Q(end_ym__gte=ym_from),
+                ym__lte=ym_to,
+            )
+        else:
+            return self.filter(ym__gte=ym_from, ym__lte=ym_to)
+
+    def sync_ym(self):
+        """既存データの整数の年月を文字列の年月から再設定する。
+
+        :return: 更新件数
+        """
+        return super(YearMonthQuerySet, self).update(**{
+            ym_field: self.get_ym_expression(F(year_field), F(month_field))
+            for ym_field, year_field, month_field in self.model.ym_fields
+        })
+
+    @classmethod
+    def get_ym_expression(cls, year, month):
+        """年月の整数を計算する式を取得する。
+
+        :param year: 年の値または式
+        :param month: 月の値または式
+        :return:
+        """
+        if not hasattr(year, 'resolve_expression') and not hasattr(month, 'resolve_expression'):
+            return common.get_ym(year, month)
+        if year in (None, '') or month in (None, ''):
+            return None
+        year = cls.get_int_expression(year)
+        month = cls.get_int_expression(month)
+        return ExpressionWrapper(year * 100 + month, output_field=models.IntegerField())
+
+    @classmethod
+    def get_int_expression(cls, value):
+        if hasattr(value, 'resolve_expression'):
+            # 空白はNULLにする（common.get_ymと同じく、年月をNoneにするため）
+            return Cast(NullIf(value, Value('')), models.IntegerField())
+        else:
+            return Value(int(value), output_field=models.IntegerField())
+
+    def update(self, **kwargs):
+        for ym_field, year_field, month_field in self.model.ym_fields:
+            if year_field in kwargs or month_field in kwargs:
+                kwargs[ym_field] = self.get_ym_expression(
+                    kwargs.get(year_field, F(year_field)),
+                    kwargs.get(month_field, F(month_field)),
+                )
+        return super(YearMonthQuerySet, self).update(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.set_ym()
+        return super(YearMonthQuerySet, self).bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.set_ym()
+        return super(YearMonthQuerySet, self).bulk_update(
+            objs, YearMonthMixin.get_ym_update_fields(self.model, fields), *args, **kwargs
+        )
+
+
+class YearMonthManager(DefaultManager.from_queryset(YearMonthQuerySet)):
+    pass
+
+
+class YearMonthMixin(object):
+    """文字列の年月と同期した整数の年月（例：202004）を持つモデルのMixin
+
+    ym_fieldsに（整数の年月の項目名、年の項目名、月の項目名）を定義する。
+    """
+    ym_fields = (('ym', 'year', 'month'),)
+
+    def set_ym(self):
+        for ym_field, year_field, month_field in self.ym_fields:
+            setattr(self, ym_field, common.get_ym(getattr(self, year_field), getattr(self, month_field)))
+
+    @classmethod
+    def get_ym_update_fields(cls, model, fields):
+        """年または月を更新する場合、整数の年月も更新対象に追加する。
+
+        :param model: モデル
+        :param fields: 更新する項目名のリスト
+        :return:
+        """
+        fields = list(fields)
+        for ym_field, year_field, month_field in model.ym_fields:
+            if (year_field in fields or month_field in fields) and ym_field not in fields:
+                fields.append(ym_field)
+        return fields
+
+    def save(self, *args, **kwargs):
+        self.set_ym()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = self.get_ym_update_fields(self, kwargs['update_fields'])
+        return super(YearMonthMixin, self).save(*args, **kwargs)
+
+
 class BaseModel(models.Model):
     created_dt = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
     updated_dt = models.DateTimeField(auto_now=True, verbose_name="更新日時")
@@ -433,12 +594,14 @@ class AbstractBankAccount(BaseModel):
         abstract = True
 
 
-class AbstractMonthlyRequest(BaseModel):
+class AbstractMonthlyRequest(YearMonthMixin, BaseModel):
     # 対象年月
     year = models.CharField(max_length=4, validators=(RegexValidator(regex=r'^\d{4}$'),), verbose_name="対象年")
     month = models.CharField(max_length=2, validators=(RegexValidator(regex=r'^\d{2}$'),), verbose_name="対象月")
     end_year = models.CharField(max_length=4, blank=True, null=True, verbose_name="終了年")
     end_month = models.CharField(max_length=2, blank=True, null=True, verbose_name="終了月")
+    ym = models.IntegerField(blank=True, null=True, editable=False, db_index=True, verbose_name="対象年月")
+    end_ym = models.IntegerField(blank=True, null=True, editable=False, db_index=True, verbose_name="終了年月")
     # 請求情報
     price = models.IntegerField(default=0, verbose_name="単価（税抜）")
     min_hours = models.DecimalField(max_digits=5, decimal_places=2, default=0, verbose_name="基準時間")
@@ -459,13 +622,17 @@ class AbstractMonthlyRequest(BaseModel):
     amount_other_memo = models.CharField(max_length=200, blank=True, null=True, verbose_name="その他の金額メモ")
     is_submitted = models.BooleanField(default=False, verbose_name="この精算条件でファイルを作成済なのか")
 
+    objects = YearMonthManager()
+    ym_fields = (('ym', 'year', 'month'), ('end_ym', 'end_year', 'end_month'))
+
     class Meta:
         abstract = True
 
 
-class AbstractRequest(BaseModel):
+class AbstractRequest(YearMonthMixin, BaseModel):
     year = models.CharField(max_length=4, validators=(RegexValidator(regex=r'^\d{4}$'),), verbose_name="請求年")
     month = models.CharField(max_length=2, validators=(RegexValidator(regex=r'^\d{2}$'),), verbose_name="請求月")
+    ym = models.IntegerField(blank=True, null=True, editable=False, db_index=True, verbose_name="請求年月")
     request_no = models.CharField(max_length=7, unique=True, verbose_name="請求番号")
     request_name = models.CharField(max_length=50, blank=True, null=True, verbose_name="請求名称")
     amount = models.PositiveIntegerField(default=0, verbose_name="請求金額（税込）")
@@ -473,6 +640,8 @@ class AbstractRequest(BaseModel):
     turnover_amount = models.IntegerField(default=0, verbose_name="売上金額(基本単価＋残業料)(税抜)")
     expense_amount = models.IntegerField(default=0, verbose_name="精算金額")
 
+    objects = YearMonthManager()
+
     class Meta:
         abstract = True
 
@@ -538,11 +707,12 @@ class AbstractRequestExpense(BaseModel):
         abstract = True
 
 
-class AbstractRequestDetail(BaseModel):
+class AbstractRequestDetail(YearMonthMixin, BaseModel):
     request_no = models.CharField(max_length=7, verbose_name="請求番号")
     # 基本情報
     year = models.CharField(max_length=4, verbose_name="請求年")
     month = models.CharField(max_length=2, verbose_name="請求月")
+    ym = models.IntegerField(blank=True, null=True, editable=False, db_index=True, verbose_name="請求年月")
     is_blanket_contract = models.BooleanField(verbose_name="一括")
     is_hourly_pay = models.BooleanField(verbose_name="時給")
     member_type = models.CharField(
@@ -566,6 +736,8 @@ class AbstractRequestDetail(BaseModel):
     item_expense_amount = models.IntegerField(default=0, verbose_name="精算金額")
     item_comment = models.CharField(max_length=200, blank=True, null=True, verbose_name="備考")
 
+    objects = YearMonthManager()
+
     class Meta:
         abstract = True
 
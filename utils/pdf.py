@@ -0,0 +1,171 @@
+import atexit
+import importlib.util
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from master.models import Config
+from utils import common, constants
+from utils.errors import CustomException
+
+logger = common.get_system_logger()
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class PdfResponse(object):
+    """ローカルで作成したPDF（リモートAPIのレスポンスと同じ属性を持つ）"""
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {'Content-Type': constants.MIME_TYPE_PDF}
+
+
+class RemotePdfBackend(object):
+    """PDF変換APIでHTMLをPDFに変換する。
+
+    スレッドごとにHTTPセッションを再利用し、タイムアウトと接続エラー時の再試行を設定する。
+    POSTは冪等ではないので、サーバーに届いた後の再試行はしない（5xxはそのまま呼び出し元に返す）。
+    """
+
+    def __init__(self, max_workers=constants.PDF_RENDER_WORKERS):
+        self.max_workers = max_workers
+        self.local = threading.local()
+
+    def get_session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            retry = Retry(
+                total=constants.PDF_CONVERT_RETRIES,
+                connect=constants.PDF_CONVERT_RETRIES,
+                read=0,
+                status=0,
+                backoff_factor=0.5,
+            )
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(max_retries=retry))
+            session.mount('https://', HTTPAdapter(max_retries=retry))
+            self.local.session = session
+        return session
+
+    def render(self, html, url=None):
+        """HTMLをPDFに変換する。
+
+        :param html: HTML
+        :param url: PDF変換APIのURL
+        :return: ステータスコード、レスポンス
+        """
+        url = url or Config.get_convert_to_pdf_api()
+        try:
+            res = self.get_session().post(url, {'content': html}, timeout=constants.PDF_CONVERT_TIMEOUT)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            raise CustomException(constants.ERROR_CANNOT_ESTABLISH_CONNECTION.format(name='PDFサーバー'))
+        return res.status_code, res
+
+    def render_many(self, html_list):
+        """複数のHTMLを同時にPDFに変換する。
+
+        :param html_list: HTMLのリスト
+        :return: HTMLと同じ順番の（ステータスコード、レスポンス）のリスト
+        """
+        url = Config.get_convert_to_pdf_api()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda html: self.render(html, url=url), html_list))
+
+
+def render_local_pdf(html, base_url=None):
+    """HTMLをweasyprintでPDFに変換する（プロセスプールで実行する）。
+
+    :param html: HTML
+    :param base_url: 画像などの相対パスの基準
+    :return: PDFのバイナリーデータ
+    """
+    from weasyprint import HTML
+    return HTML(string=html, base_url=base_url).write_pdf()
+
+
+class LocalPdfBackend(object):
+    """weasyprintでHTMLをPDFに変換する。
+
+    変換処理はCPUを使うので、上限付きのプロセスプールで実行する。
+    プロセスプールはプロセスごとに作成し（fork後の子プロセスでは作り直す）、終了時にシャットダウンする。
+    """
+
+    def __init__(self, max_workers=constants.PDF_RENDER_WORKERS):
+        if importlib.util.find_spec('weasyprint') is None:
+            raise CustomException(constants.ERROR_REQUIRE_LIBRARY.format(name='weasyprint'))
+        self.max_workers = max_workers
+        self.base_url = settings.BASE_DIR
+        self.executor = None
+        self.pid = None
+        self.lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None or self.pid != os.getpid():
+                # fork前の親プロセスのプールは子プロセスでは使えないので、破棄して作り直す
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                self.pid = os.getpid()
+            return self.executor
+
+    def shutdown(self):
+        """プロセスプールをシャットダウンする。
+
+        :return:
+        """
+        with self.lock:
+            if self.executor is not None and self.pid == os.getpid():
+                self.executor.shutdown(wait=True)
+            self.executor = None
+            self.pid = None
+
+    def render(self, html):
+        return self.render_many([html])[0]
+
+    def render_many(self, html_list):
+        executor = self.get_executor()
+        futures = [executor.submit(render_local_pdf, html, self.base_url) for html in html_list]
+        return [(200, PdfResponse(future.result())) for future in futures]
+
+
+def get_backend():
+    """設定（PDF_BACKEND）によってPDFの変換方法を取得する。
+
+    :return:
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend = getattr(settings, 'PDF_BACKEND', 'utils.pdf.RemotePdfBackend')
+                _backend = import_string(backend)()
+    return _backend
+
+
+def render(html):
+    """HTMLをPDFに変換する。
+
+    :param html: HTML
+    :return: ステータスコード、レスポンス
+    """
+    return get_backend().render(html)
+
+
+def render_many(html_list):
+    """複数のHTMLを同時にPDFに変換する。
+
+    :param html_list: HTMLのリスト
+    :return: HTMLと同じ順番の（ステータスコード、レスポンス）のリスト
+    """
+    if not html_list:
+        return []
+    return get_backend().render_many(html_list)
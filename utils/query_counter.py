@@ -0,0 +1,110 @@
+import collections
+import re
+import time
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from utils import common, constants
+
+logger = common.get_system_logger()
+_in_list_re = re.compile(r'\bIN \((?:%s, )*%s\)', re.IGNORECASE)
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def get_query_shape(sql):
+    """パラメーターと件数の違いを除いたSQLの形を取得する。
+
+    例：... WHERE id IN (%s, %s, %s) → ... WHERE id IN (...)
+
+    :param sql: SQL
+    :return:
+    """
+    sql = _in_list_re.sub('IN (...)', sql)
+    return _literal_re.sub('?', sql)
+
+
+def find_duplicate_queries(queries, threshold=constants.QUERY_DUPLICATE_THRESHOLD):
+    """同じ形のSQLを繰り返して実行している箇所（N+1）を探す。
+
+    :param queries: (SQL, 実行時間)のリスト
+    :param threshold: この件数以上同じ形のSQLがある場合にN+1とする
+    :return: (SQLの形、件数)のリスト（件数の多い順）
+    """
+    counter = collections.Counter(get_query_shape(sql) for sql, duration in queries)
+    return [(shape, count) for shape, count in counter.most_common() if count >= threshold]
+
+
+class QueryCounter(object):
+    """ブロック内で実行したSQLの件数と時間を記録する。
+
+    with QueryCounter() as counter:
+        ...
+    print(counter.count, counter.elapsed)
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.connection = connections[using]
+        self.queries = []  # (SQL, 実行時間)のリスト
+        self.start_time = None
+        self.elapsed = 0
+        self._wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start_time = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start_time))
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        self._wrapper = self.connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+        self.elapsed = time.perf_counter() - self.start_time
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def query_time(self):
+        """SQLの実行時間の合計
+
+        :return:
+        """
+        return sum(duration for sql, duration in self.queries)
+
+    def get_duplicates(self, threshold=constants.QUERY_DUPLICATE_THRESHOLD):
+        return find_duplicate_queries(self.queries, threshold)
+
+
+class QueryCountMiddleware(object):
+    """リクエストごとにSQLの件数と時間を記録する。
+
+    件数が上限（QUERY_COUNT_WARNING）を超えた場合、または同じ形のSQLを繰り返している（N+1）場合に警告を出力する。
+    DEBUGの場合はレスポンスのヘッダーにも件数と時間を設定する。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryCounter() as counter:
+            response = self.get_response(request)
+        duplicates = counter.get_duplicates()
+        if counter.count > constants.QUERY_COUNT_WARNING or duplicates:
+            logger.warning(constants.WARN_QUERY_COUNT.format(
+                method=request.method, path=request.get_full_path(), elapsed=counter.elapsed,
+                count=counter.count, query_time=counter.query_time,
+            ))
+            for shape, count in duplicates:
+                logger.warning(constants.WARN_QUERY_DUPLICATED.format(count=count, sql=shape))
+        if settings.DEBUG:
+            response['X-Query-Count'] = counter.count
+            response['X-Query-Time'] = '{:.3f}'.format(counter.query_time)
+        return response
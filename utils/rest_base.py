@@ -1,12 +1,18 @@
+import io
+import tempfile
 import traceback
 
-from django.db import transaction
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import connections, transaction
 from django.db.models.deletion import ProtectedError
+from django.http import FileResponse
 
 from rest_framework import status as rest_status
 from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView, exception_handler
 from rest_framework.generics import ListAPIView
+from rest_framework.pagination import CursorPagination
+from rest_framework.parsers import MultiPartParser
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from rest_framework.response import Response
 from rest_framework.serializers import ModelSerializer
@@ -14,8 +20,9 @@ from rest_framework.serializers import CharField
 from rest_framework.validators import UniqueTogetherValidator, qs_exists
 
 from middleware.request import get_request
-from utils import constants, common
+from utils import audit, constants, common, gen_file, upload
 from utils.app_base import check_file_size_limit, \
+    get_worker_roster_template_path, \
     log_action_for_add, \
     log_action_for_delete, \
     log_action_for_change
@@ -30,6 +37,62 @@ class BaseApiView(APIView):
     pass
 
 
+class FileUploadApiView(BaseApiView):
+    """ファイルをアップロードして一時保存し、UUIDを返す。
+
+    マルチパート（fileパラメーター）、またはリクエストの本文にBase64の文字列（name:xxx;data:image/jpeg;base64,...）を指定する。
+    どちらも受信しながらディスクに書き込み、サイズの上限（FILE_UPLOAD_MAX_MEMORY_SIZE）を超えた時点でエラーにする。
+    返したUUIDをUUIDFileFieldの値として保存すると、添付ファイルとして紐づける。
+    """
+    parser_classes = (MultiPartParser,)
+
+    def initialize_request(self, request, *args, **kwargs):
+        # マルチパートを解析する前に設定する必要がある
+        request.upload_handlers = [upload.SizeLimitUploadHandler(request), TemporaryFileUploadHandler(request)]
+        return super(FileUploadApiView, self).initialize_request(request, *args, **kwargs)
+
+    def post(self, request, *args, **kwargs):
+        upload.clear_expired_uploads()
+        if request.content_type.startswith('multipart/form-data'):
+            uploaded_file = request.FILES.get('file')
+            if uploaded_file is None:
+                raise CustomException(constants.ERROR_REQUIRE_DATA.format(name='ファイル'))
+            file_uuid = upload.save_uploaded_file(uploaded_file)
+        else:
+            file_uuid = upload.save_base64_stream(request.stream)
+        return Response({'uuid': file_uuid})
+
+
+class WorkerRosterDownloadApiView(BaseApiView):
+    """複数社員の労働者名簿をダウンロードする。
+
+    GET /api/member/worker-rosters/?members=1,2,3&file_type=zip
+    file_type=zipの場合は社員ごとのExcelをZIPにし、それ以外は一つのブックに社員ごとのシートとして出力する。
+    ZIPは一時ファイルに書き込みながら作成し、メモリに溜めずにそのまま返す。
+    """
+    permission_classes = (SalesModelPermission,)
+
+    def get_queryset(self):
+        from member.models import Member
+        return Member.objects.filter(is_deleted=False)
+
+    def get(self, request, *args, **kwargs):
+        member_id_list = [pk for pk in request.query_params.get('members', '').replace(' ', '').split(',') if pk.isdigit()]
+        if not member_id_list:
+            raise CustomException(constants.ERROR_REQUIRE_DATA.format(name='社員'))
+        queryset = self.get_queryset().filter(pk__in=member_id_list)
+        path_template = get_worker_roster_template_path()
+        if request.query_params.get('file_type') == 'zip':
+            fileobj = tempfile.TemporaryFile()
+            gen_file.gen_worker_roster_zip(path_template, queryset, fileobj=fileobj)
+            fileobj.seek(0)
+            filename = constants.NAME_WORKER_ROSTER + '.zip'
+        else:
+            fileobj = io.BytesIO(gen_file.gen_worker_roster_book(path_template, queryset))
+            filename = constants.NAME_WORKER_ROSTER + '.xlsx'
+        return FileResponse(fileobj, as_attachment=True, filename=filename)
+
+
 class BaseApiRetrieveView(BaseApiView):
 
     def get_context_data(self, **kwargs):
@@ -40,11 +103,78 @@ class BaseApiRetrieveView(BaseApiView):
         return Response(context)
 
 
+def estimate_count(queryset):
+    """実行計画からクエリセットの件数を概算する。
+
+    MySQL以外の場合は正確な件数を取得する。
+
+    :param queryset: クエリセット
+    :return:
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'mysql':
+        return queryset.count()
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN ' + sql, params)
+        columns = [col[0] for col in cursor.description]
+        row = dict(zip(columns, cursor.fetchone()))
+    # 最初に読み込むテーブルの推定行数と、条件に一致する割合
+    return int((row.get('rows') or 0) * float(row.get('filtered') or 100) / 100)
+
+
+class BaseCursorPagination(CursorPagination):
+    """インデックスのある並び順をキーとするページング。
+
+    OFFSETを使わないので、どのページでも一ページ目と同じ速さで取得できる。
+    並び順はビューのcursor_ordering（一意になるように最後にpkを指定する）、指定しない場合は -pk とする。
+    件数はデフォルトでは取得しない（count_modeまたはリクエストのcount_modeで指定する）。
+    """
+
+    ordering = '-pk'
+    page_size = constants.API_CURSOR_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = constants.API_CURSOR_MAX_PAGE_SIZE
+    count_mode = constants.COUNT_NONE
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', None)
+        if ordering:
+            return (ordering,) if isinstance(ordering, str) else tuple(ordering)
+        return super(BaseCursorPagination, self).get_ordering(request, queryset, view)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': data['count'],
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data['results'],
+        })
+
+
 class ListApiMixin(object):
+    # 件数の取得方法（constants.COUNT_EXACT／COUNT_ESTIMATE／COUNT_NONE）
+    # 指定しない場合はページングの設定に従い、ページングの設定もない場合は正確な件数を取得する
+    count_mode = None
+
+    def get_count_mode(self):
+        count_mode = self.request.query_params.get('count_mode')
+        if count_mode in (constants.COUNT_EXACT, constants.COUNT_ESTIMATE, constants.COUNT_NONE):
+            return count_mode
+        return self.count_mode or getattr(self.paginator, 'count_mode', constants.COUNT_EXACT)
+
+    def get_count(self, queryset):
+        count_mode = self.get_count_mode()
+        if count_mode == constants.COUNT_NONE:
+            return None
+        elif count_mode == constants.COUNT_ESTIMATE:
+            return estimate_count(queryset)
+        else:
+            return queryset.count()
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
-        count = queryset.count()
+        count = self.get_count(queryset)
 
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -55,9 +185,10 @@ class ListApiMixin(object):
             })
 
         serializer = self.get_serializer(queryset, many=True)
+        data = serializer.data
         return Response({
-            'count': count,
-            'results': serializer.data,
+            'count': len(data) if count is None else count,
+            'results': data,
         })
 
 
@@ -87,14 +218,19 @@ class BaseModelSerializer(ModelSerializer):
     def save(self, **kwargs):
         log = kwargs.pop('log', None)
         existed_uuids = dict()
+        tracked_fields = None
         if self.instance:
             is_add = False
             for name, field in self.fields.items():
                 if isinstance(field, UUIDFileField):
                     existed_uuids[name] = getattr(self.instance, name)
             # 変更前のデータを取得
-            if log is not False:
+            if log is not False and self.uses_legacy_changed_message():
                 original_data = self.__class__(self.instance).data
+            elif log is not False:
+                # 変更できるモデルのフィールドの値だけを取得する（シリアライズしない）
+                tracked_fields = audit.get_tracked_fields(self.instance, self.get_writable_model_field_names())
+                original_data = audit.get_field_values(self.instance, tracked_fields)
             else:
                 original_data = None
         else:
@@ -112,6 +248,9 @@ class BaseModelSerializer(ModelSerializer):
                     self.data.get(name),
                     existed_uuids.get(name)
                 )
+            elif isinstance(field, UUIDFileField) and upload.is_uploaded(data):
+                # 先にアップロードしたファイル（FileUploadApiView）
+                upload.save_attachment(instance, data, existed_uuids.get(name))
         # 操作ログを保存
         request = get_request()
         if request and log is not False:
@@ -119,10 +258,35 @@ class BaseModelSerializer(ModelSerializer):
                 log_action_for_add(request.user, instance)
             elif is_add is False:
                 # 変更の場合
-                changed_data = self.get_changed_message(original_data)
+                if tracked_fields is None:
+                    changed_data = self.get_changed_message(original_data)
+                else:
+                    changed_data = audit.get_changed_data(
+                        instance, tracked_fields, original_data, labels=self.get_field_labels(),
+                    )
                 log_action_for_change(request.user, instance, changed_data)
         return instance
 
+    def uses_legacy_changed_message(self):
+        """サブクラスがget_changed_messageを上書きした場合は、シリアライズしたデータで比較する。
+
+        :return:
+        """
+        return type(self).get_changed_message is not BaseModelSerializer.get_changed_message
+
+    def get_writable_model_field_names(self):
+        """変更できるモデルのフィールド名を取得する。
+
+        :return:
+        """
+        return {
+            field.source for field in self.fields.values()
+            if not field.read_only and field.source in self.validated_data
+        }
+
+    def get_field_labels(self):
+        return {field.source: field.label for field in self.fields.values() if field.source != '*'}
+
     def get_changed_message(self, original_data, prev_msg=None):
         """変更メッセージを取得する
 
@@ -219,6 +383,9 @@ class UUIDFileField(CharField):
         if common.is_base64_string(data):
             self.file_ext = common.get_ext_from_base64(data)
             return common.get_default_file_uuid()
+        elif upload.is_uploaded(data):
+            self.file_ext = upload.get_uploaded_ext(data)
+            return data
         else:
             return str(data)
 
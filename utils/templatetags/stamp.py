@@ -0,0 +1,14 @@
+from django import template
+
+from utils import app_base
+
+register = template.Library()
+
+
+@register.simple_tag
+def company_signature_src():
+    """会社の角印を<img src="">に設定する値を取得する。
+
+    :return:
+    """
+    return app_base.get_company_square_signature_src()
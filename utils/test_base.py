@@ -1,16 +1,26 @@
 import codecs
+import contextlib
 import os
 import openpyxl as px
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import connection
+from django.db import connection, DEFAULT_DB_ALIAS
 
 from rest_framework.test import APITestCase
 
+from utils import constants
+from utils.firebase import RecordingBackend
+from utils.query_counter import QueryCounter
+
 
 class BaseAPITestCase(APITestCase):
 
+    def _pre_setup(self):
+        # サブクラスのsetUpに関係なく、テストごとに通知の送信内容を空にする
+        super(BaseAPITestCase, self)._pre_setup()
+        RecordingBackend.reset()
+
     @classmethod
     def setUpTestData(cls):
         cls.create_ddl()
@@ -85,3 +95,48 @@ class BaseAPITestCase(APITestCase):
                         print(values)
                         print('↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑')
                         raise ex
+
+
+class QueryBudgetMixin(object):
+    """APIのSQL件数が上限を超えた場合、または同じ形のSQLを繰り返している（N+1）場合にテストを失敗させる。
+
+    class MemberApiTest(QueryBudgetMixin, BaseAPITestCase):
+        def test_list(self):
+            self.assertApiQueryBudget('/api/member/members/', 10)
+    """
+
+    query_duplicate_threshold = constants.QUERY_DUPLICATE_THRESHOLD
+
+    @contextlib.contextmanager
+    def assertQueryBudget(self, max_count, allow_duplicates=False, using=DEFAULT_DB_ALIAS):
+        """ブロック内で実行したSQLの件数を確認する。
+
+        :param max_count: SQL件数の上限
+        :param allow_duplicates: 同じ形のSQLの繰り返しを許可するか
+        :param using: DB
+        :return:
+        """
+        with QueryCounter(using) as counter:
+            yield counter
+        messages = []
+        if counter.count > max_count:
+            messages.append('SQL {}件（上限 {}件）'.format(counter.count, max_count))
+        if not allow_duplicates:
+            for shape, count in counter.get_duplicates(self.query_duplicate_threshold):
+                messages.append(constants.WARN_QUERY_DUPLICATED.format(count=count, sql=shape))
+        if messages:
+            self.fail('\n'.join(messages + ['実行したSQL：'] + [sql for sql, duration in counter.queries]))
+
+    def assertApiQueryBudget(self, path, max_count, method='get', allow_duplicates=False, **kwargs):
+        """APIを呼び出して、SQLの件数を確認する。
+
+        :param path: APIのパス
+        :param max_count: SQL件数の上限
+        :param method: HTTPメソッド
+        :param allow_duplicates: 同じ形のSQLの繰り返しを許可するか
+        :param kwargs: テストクライアントに渡すパラメーター
+        :return: レスポンス
+        """
+        with self.assertQueryBudget(max_count, allow_duplicates=allow_duplicates):
+            response = getattr(self.client, method)(path, **kwargs)
+        return response
@@ -0,0 +1,72 @@
+# 祝日の新旧実装の処理時間を比較する（確認用、テストではない）
+#
+#   python -m utils.tests.bench_jpholiday
+#   python -m utils.tests.bench_jpholiday --number 5
+import argparse
+import datetime
+import timeit
+
+from utils import jpholiday
+from utils.tests import legacy_jpholiday
+
+START_DATE = datetime.date(1948, 1, 1)
+END_DATE = datetime.date(2100, 12, 31)
+
+
+def iter_dates(start_date=START_DATE, end_date=END_DATE):
+    date = start_date
+    while date <= end_date:
+        yield date
+        date += datetime.timedelta(days=1)
+
+
+def get_cases(module):
+    """計測する処理を取得する。
+
+    :param module: 新実装（jpholiday）または旧実装（legacy_jpholiday）
+    :return: (処理名, 関数)のリスト
+    """
+    dates = list(iter_dates())
+    years = range(START_DATE.year, END_DATE.year + 1)
+    return [
+        ('get_holiday_name（毎日）', lambda: [module.get_holiday_name(date) for date in dates]),
+        ('year_holidays（毎年）', lambda: [module.year_holidays(year) for year in years]),
+        ('month_holidays（毎月）', lambda: [
+            module.month_holidays(year, month) for year in years for month in range(1, 13)
+        ]),
+        ('holidays（全期間）', lambda: module.holidays(START_DATE, END_DATE)),
+    ]
+
+
+def clear_cache():
+    jpholiday._get_year_holidays.cache_clear()
+
+
+def run(number=1):
+    """新旧実装の処理時間を出力する。
+
+    新実装は年ごとのキャッシュをクリアした場合（初回）と、キャッシュ済みの場合をそれぞれ計測する。
+
+    :param number: 繰り返し回数
+    :return:
+    """
+    print('{:%Y-%m-%d}～{:%Y-%m-%d}、{}回の合計（秒）'.format(START_DATE, END_DATE, number))
+    print('{:<24}{:>10}{:>10}{:>10}'.format('処理', '旧実装', '新(初回)', '新(済)'))
+    for (name, legacy_func), (_, new_func) in zip(get_cases(legacy_jpholiday), get_cases(jpholiday)):
+        legacy_time = timeit.timeit(legacy_func, number=number)
+        cold_time = sum(timeit.timeit(new_func, setup=clear_cache, number=1) for _ in range(number))
+        clear_cache()
+        new_func()
+        warm_time = timeit.timeit(new_func, number=number)
+        print('{:<24}{:>10.3f}{:>10.3f}{:>10.3f}'.format(name, legacy_time, cold_time, warm_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='祝日の新旧実装の処理時間を比較する。')
+    parser.add_argument('--number', type=int, default=1, help='繰り返し回数')
+    args = parser.parse_args()
+    run(args.number)
+
+
+if __name__ == '__main__':
+    main()
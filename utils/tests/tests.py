@@ -0,0 +1,355 @@
+import base64
+import datetime
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+import zlib
+from types import SimpleNamespace
+from unittest import mock
+
+import openpyxl as px
+from openpyxl.workbook.defined_name import DefinedName
+
+from utils import archive, jpholiday, constants
+from utils.errors import CustomException
+from utils.document_cache import DocumentCache
+from utils.excel_template import TemplateRegistry, get_named_ranges
+from utils.firebase import NotificationDispatcher, RecordingBackend
+from utils.query_counter import find_duplicate_queries, get_query_shape
+from utils.upload import Base64StreamDecoder
+from utils.tests import legacy_jpholiday
+
+
+class JpHolidayTest(unittest.TestCase):
+    start_date = datetime.date(1948, 1, 1)
+    end_date = datetime.date(2100, 12, 31)
+
+    def test_same_as_legacy(self):
+        # 1948年～2100年まで毎日旧実装と同じ祝日名であること
+        date = self.start_date
+        while date <= self.end_date:
+            self.assertEqual(jpholiday.get_holiday_name(date), legacy_jpholiday.get_holiday_name(date), date)
+            date += datetime.timedelta(days=1)
+        for year in range(self.start_date.year, self.end_date.year + 1):
+            self.assertEqual(jpholiday.year_holidays(year), legacy_jpholiday.year_holidays(year))
+            for month in range(1, 13):
+                self.assertEqual(jpholiday.month_holidays(year, month), legacy_jpholiday.month_holidays(year, month))
+
+    def test_holidays(self):
+        # 年ごとに作成した祝日も、キャッシュ済みの祝日も旧実装と同じであること
+        legacy_holidays = legacy_jpholiday.holidays(self.start_date, self.end_date)
+        jpholiday._get_year_holidays.cache_clear()
+        self.assertEqual(jpholiday.holidays(self.start_date, self.end_date), legacy_holidays)
+        self.assertEqual(jpholiday.holidays(self.start_date, self.end_date), legacy_holidays)
+
+
+class NotificationDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        RecordingBackend.reset(unregistered_tokens={'token-3', 'token-1001'})
+
+    def tearDown(self):
+        RecordingBackend.reset()
+
+    def test_dispatch(self):
+        # トピックのトークンを500件ずつのマルチキャストに分けて送信し、登録解除されたデバイスを削除すること
+        dict_tokens = {
+            1: ['token-{}'.format(i) for i in range(1200)],
+            2: ['token-{}'.format(i) for i in range(1000, 1100)],
+            3: [],
+        }
+        notifications = []
+        pruned = []
+
+        class Dispatcher(NotificationDispatcher):
+            @classmethod
+            def add_notification(cls, topic, title, body, forward=None):
+                notifications.append((topic.name, title))
+
+            @classmethod
+            def get_tokens(cls, topic):
+                return dict_tokens[topic.pk]
+
+            @classmethod
+            def prune(cls, tokens):
+                pruned.append(tokens)
+
+        with Dispatcher(backend=RecordingBackend()) as dispatcher:
+            for pk in (1, 2, 3):
+                dispatcher.add(SimpleNamespace(pk=pk, name='topic{}'.format(pk)), 'title{}'.format(pk), 'body')
+        self.assertEqual(notifications, [('topic1', 'title1'), ('topic2', 'title2'), ('topic3', 'title3')])
+        self.assertEqual(sorted(len(tokens) for tokens, data in RecordingBackend.outbox), [100, 200, 500, 500])
+        self.assertEqual(
+            sorted(token for tokens, data in RecordingBackend.outbox for token in tokens),
+            sorted(dict_tokens[1] + dict_tokens[2]),
+        )
+        self.assertEqual(pruned, [['token-1001', 'token-3']])
+
+    def test_dispatch_without_pruning(self):
+        # 登録解除されたデバイスがない場合は削除しないこと
+        RecordingBackend.reset()
+        pruned = []
+
+        class Dispatcher(NotificationDispatcher):
+            @classmethod
+            def add_notification(cls, topic, title, body, forward=None):
+                pass
+
+            @classmethod
+            def get_tokens(cls, topic):
+                return ['token-1', 'token-2']
+
+            @classmethod
+            def prune(cls, tokens):
+                pruned.append(tokens)
+
+        dispatcher = Dispatcher(backend=RecordingBackend())
+        dispatcher.add(SimpleNamespace(pk=1, name='topic'), 'title', 'body')
+        self.assertEqual(dispatcher.dispatch(), 2)
+        self.assertEqual(pruned, [])
+
+    def test_send_error(self):
+        # 送信エラーのマルチキャストは失敗とし、ほかのマルチキャストは送信すること
+        class ErrorBackend(RecordingBackend):
+            def send_multicast(self, tokens, data):
+                if 'token-0' in tokens:
+                    raise ValueError('error')
+                return super(ErrorBackend, self).send_multicast(tokens, data)
+
+        dispatcher = NotificationDispatcher(backend=ErrorBackend())
+        dict_results, unregistered_tokens = dispatcher.send([
+            ('topic1', ['token-0', 'token-1'], {}),
+            ('topic2', ['token-2', 'token-3'], {}),
+        ])
+        self.assertEqual(dict_results, {'topic1': (0, 2), 'topic2': (1, 1)})
+        self.assertEqual(unregistered_tokens, ['token-3'])
+
+
+class ZipWriterTest(unittest.TestCase):
+    files = [
+        ('請求書_2020年04月.pdf', os.urandom(1000) + b'abc' * 10000),
+        ('注文書.xlsx', b''),
+        ('readme.txt', 'テスト'.encode('utf-8') * 100),
+    ]
+
+    @classmethod
+    def get_filename(cls, info):
+        if info.flag_bits & 0x800:
+            return info.filename
+        else:
+            return info.filename.encode('cp437').decode('cp932')
+
+    def test_compress_without_password(self):
+        data = archive.compress_files(self.files)
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertIsNone(zf.testzip())
+            infos = zf.infolist()
+            self.assertEqual([self.get_filename(info) for info in infos], [name for name, content in self.files])
+            for info, (name, content) in zip(infos, self.files):
+                self.assertEqual(zf.read(info), content)
+
+    def test_compress_with_password(self):
+        # 従来のZIP暗号で暗号化し、正しいパスワードでしか解凍できないこと
+        data = archive.compress_files(self.files, password='Pass1234')
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            for info, (name, content) in zip(zf.infolist(), self.files):
+                self.assertTrue(info.flag_bits & 0x1)
+                self.assertEqual(self.get_filename(info), name)
+                self.assertEqual(zf.read(info, pwd=b'Pass1234'), content)
+                if content:
+                    # パスワードの確認は一バイトだけなので、1/256の確率で解凍時のエラーになる
+                    with self.assertRaises((RuntimeError, zlib.error, zipfile.BadZipFile)):
+                        zf.read(info, pwd=b'wrong')
+
+    def test_compress_without_process(self):
+        # 外部コマンドを実行せずに、同じプロセスで暗号化すること
+        with mock.patch('subprocess.Popen', side_effect=AssertionError), \
+                mock.patch.object(archive.ZipCryptoEncrypter, 'encrypt', side_effect=bytes) as encrypt:
+            archive.compress_files(self.files, password='Pass1234')
+        self.assertTrue(encrypt.called)
+
+    @unittest.skipIf(importlib.util.find_spec('pyzipper') is None, 'pyzipperがインストールされていません。')
+    def test_compress_with_aes(self):
+        import pyzipper
+        data = archive.compress_files(self.files, password='Pass1234', encryption=archive.ENCRYPTION_AES)
+        with pyzipper.AESZipFile(io.BytesIO(data)) as zf:
+            zf.setpassword(b'Pass1234')
+            for info, (name, content) in zip(zf.infolist(), self.files):
+                self.assertEqual(zf.read(info), content)
+
+    def test_compress_file_path(self):
+        # ファイルのパスとUTF-8のファイル名
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(os.urandom(1024 * 1024 + 1))
+            path = f.name
+        try:
+            data = archive.compress_files([('\u20ac_file.bin', path)], password='pwd', filename_encoding='cp932')
+            with zipfile.ZipFile(io.BytesIO(data)) as zf:
+                info = zf.infolist()[0]
+                self.assertTrue(info.flag_bits & 0x800)
+                self.assertEqual(info.filename, '\u20ac_file.bin')
+                with open(path, 'rb') as f:
+                    self.assertEqual(zf.read(info, pwd=b'pwd'), f.read())
+        finally:
+            os.remove(path)
+
+
+class DocumentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.template_path = os.path.join(self.tmp_dir.name, 'template.html')
+        with open(self.template_path, 'w') as f:
+            f.write('<html></html>')
+        self.cache = DocumentCache(root=os.path.join(self.tmp_dir.name, 'cache'), max_size=250)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_make_key(self):
+        context = {'amount': 1000, 'date': datetime.date(2020, 4, 1), 'items': ['a', 'b']}
+        key = DocumentCache.make_key(self.template_path, context)
+        self.assertEqual(key, DocumentCache.make_key(self.template_path, dict(context)))
+        self.assertNotEqual(key, DocumentCache.make_key(self.template_path, dict(context, amount=2000)))
+        self.assertNotEqual(key, DocumentCache.make_key(self.template_path, context, version=2))
+        # テンプレートを変更したらキーも変わる
+        with open(self.template_path, 'w') as f:
+            f.write('<html><body></body></html>')
+        self.assertNotEqual(key, DocumentCache.make_key(self.template_path, context))
+
+    def test_get_or_create(self):
+        created = []
+
+        def create():
+            created.append(1)
+            return b'x' * 100
+
+        self.assertEqual(self.cache.get_or_create('a' * 64, '.pdf', create), b'x' * 100)
+        self.assertEqual(self.cache.get_or_create('a' * 64, '.pdf', create), b'x' * 100)
+        self.assertEqual(len(created), 1)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['count'], stats['size']), (1, 1, 1, 100))
+
+    def test_evict(self):
+        # 上限を超えたら最近使っていないファイルから削除する
+        for i, key in enumerate(('a' * 64, 'b' * 64)):
+            self.cache.set(key, '.pdf', b'x' * 100)
+            os.utime(self.cache.get_path(key, '.pdf'), (1000 + i, 1000 + i))
+        self.assertIsNotNone(self.cache.get('a' * 64, '.pdf'))  # aを使ったので、bの方が古くなる
+        self.cache.set('c' * 64, '.pdf', b'x' * 100)
+        self.assertIsNotNone(self.cache.get('a' * 64, '.pdf'))
+        self.assertIsNone(self.cache.get('b' * 64, '.pdf'))
+        self.assertIsNotNone(self.cache.get('c' * 64, '.pdf'))
+
+    def test_evict_threshold(self):
+        # 書き込むたびにフォルダーを走査せず、書き込んだサイズが上限の一定割合を超えた時だけ削除を確認する
+        cache = DocumentCache(root=os.path.join(self.tmp_dir.name, 'cache2'), max_size=1000)
+        with mock.patch.object(cache, 'evict', wraps=cache.evict) as evict:
+            for i in range(10):
+                cache.set('{:064d}'.format(i), '.pdf', b'x' * 30)
+            # 最初の一回と、合計100バイト（上限の10%）を超えた時
+            self.assertEqual(evict.call_count, 3)
+            cache.evicted_time -= constants.DOCUMENT_CACHE_EVICT_INTERVAL
+            cache.set('a' * 64, '.pdf', b'x')
+            # 前回の確認から一定時間が過ぎた時
+            self.assertEqual(evict.call_count, 4)
+
+    def test_make_content_key(self):
+        key = DocumentCache.make_content_key('<html></html>')
+        self.assertEqual(key, DocumentCache.make_content_key('<html></html>'))
+        self.assertNotEqual(key, DocumentCache.make_content_key('<html> </html>'))
+        self.assertNotEqual(key, DocumentCache.make_content_key('<html></html>', version=2))
+
+
+class TemplateRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'template.xlsx')
+        self.save_template('A1')
+        self.registry = TemplateRegistry()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def save_template(self, coord):
+        book = px.Workbook()
+        book.active.title = 'テンプレート'
+        book.defined_names.append(DefinedName('POS_NAME', attr_text="'テンプレート'!${}${}".format(coord[0], coord[1:])))
+        book.save(self.path)
+
+    def test_load(self):
+        book = self.registry.load(self.path)
+        self.assertEqual(get_named_ranges(book), {'POS_NAME': [('テンプレート', 1, 1)]})
+        book['テンプレート']['A1'].value = 'テスト'
+        # 解析は一回だけで、取得したブックはそれぞれのコピー
+        template = self.registry.get_template(self.path)
+        other = self.registry.load(self.path)
+        self.assertIs(template, self.registry.get_template(self.path))
+        self.assertIsNone(other['テンプレート']['A1'].value)
+
+    def test_reload(self):
+        template = self.registry.get_template(self.path)
+        self.save_template('B2')
+        os.utime(self.path, ns=(template.version[0] + 10 ** 9, template.version[0] + 10 ** 9))
+        book = self.registry.load(self.path)
+        self.assertIsNot(template, self.registry.get_template(self.path))
+        self.assertEqual(get_named_ranges(book), {'POS_NAME': [('テンプレート', 2, 2)]})
+
+
+class QueryShapeTest(unittest.TestCase):
+
+    def test_get_query_shape(self):
+        self.assertEqual(
+            get_query_shape('SELECT * FROM member WHERE id IN (%s, %s, %s) AND code = \'A01\' LIMIT 21'),
+            'SELECT * FROM member WHERE id IN (...) AND code = ? LIMIT ?',
+        )
+        self.assertEqual(get_query_shape('SELECT T1.id FROM member T1'), 'SELECT T1.id FROM member T1')
+
+    def test_find_duplicate_queries(self):
+        queries = [('SELECT * FROM member WHERE id = %s', 0.001)] * 5 + [
+            ('SELECT * FROM member WHERE id IN (%s)', 0.001),
+            ('SELECT * FROM member WHERE id IN (%s, %s)', 0.001),
+        ]
+        self.assertEqual(find_duplicate_queries(queries, threshold=5), [('SELECT * FROM member WHERE id = %s', 5)])
+        self.assertEqual(find_duplicate_queries(queries, threshold=2), [
+            ('SELECT * FROM member WHERE id = %s', 5),
+            ('SELECT * FROM member WHERE id IN (...)', 2),
+        ])
+
+
+class Base64StreamDecoderTest(unittest.TestCase):
+    content = os.urandom(100000)
+    data = 'name:{};data:application/pdf;base64,{}'.format(
+        base64.b64encode('契約書.pdf'.encode('utf-8')).decode('ascii'),
+        base64.b64encode(content).decode('ascii'),
+    )
+
+    def decode(self, chunk_size, limit=None):
+        buff = io.BytesIO()
+        decoder = Base64StreamDecoder(buff, limit=limit)
+        for i in range(0, len(self.data), chunk_size):
+            decoder.feed(self.data[i:i + chunk_size].encode('ascii'))
+        decoder.close()
+        return decoder, buff.getvalue()
+
+    def test_decode_by_chunks(self):
+        # チャンクの区切りが4文字単位やヘッダーの途中でもデコードできる
+        for chunk_size in (7, 1000, 65536):
+            decoder, content = self.decode(chunk_size)
+            self.assertEqual(content, self.content)
+            self.assertEqual(decoder.size, len(self.content))
+            self.assertTrue(decoder.header.endswith(';base64,'))
+
+    def test_size_limit(self):
+        with self.assertRaises(CustomException):
+            self.decode(1000, limit=50000)
+
+    def test_invalid_data(self):
+        decoder = Base64StreamDecoder(io.BytesIO())
+        decoder.feed('data:application/pdf;base64,QUJ')
+        with self.assertRaises(CustomException):
+            decoder.close()
@@ -0,0 +1,645 @@
+# Djangoの設定とDBが必要なテスト（python manage.py test で実行する）
+import base64
+import os
+import datetime
+import io
+import pathlib
+import tempfile
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+from unittest import mock
+
+import openpyxl as px
+from openpyxl.workbook.defined_name import DefinedName
+
+from django.conf import settings
+from django.contrib.admin.models import ADDITION, LogEntry
+from django.contrib.auth.models import Group, Permission, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import F, Value
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.serializers import ModelSerializer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from utils import app_base, audit, common, constants, gen_file, pdf, rest_base, upload
+from utils.document_cache import DocumentCache
+from utils.errors import CustomException
+from utils.model_base import YearMonthQuerySet
+from utils.query_counter import QueryCounter, QueryCountMiddleware
+
+
+class PdfServerHandler(BaseHTTPRequestHandler):
+    """PDF変換APIの代わり（status_listの順番でステータスコードを返す）"""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests += 1
+        status = self.server.status_list.pop(0) if self.server.status_list else 200
+        self.send_response(status)
+        self.send_header('Content-Type', constants.MIME_TYPE_PDF)
+        self.end_headers()
+        self.wfile.write(b'%PDF' if status == 200 else b'error')
+
+    def log_message(self, *args):
+        pass
+
+
+class RemotePdfBackendTest(SimpleTestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), PdfServerHandler)
+        self.server.requests = 0
+        self.server.status_list = []
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def render(self, status_list):
+        self.server.status_list = list(status_list)
+        with mock.patch.object(constants, 'PDF_CONVERT_RETRIES', 2), mock.patch('urllib3.util.retry.Retry.sleep'):
+            return pdf.RemotePdfBackend().render('<html></html>', url=self.url)
+
+    def test_render(self):
+        status_code, res = self.render([])
+        self.assertEqual(status_code, 200)
+        self.assertEqual(res.content, b'%PDF')
+
+    def test_not_retry_5xx(self):
+        # POSTは冪等ではないので、5xxは再試行せずにそのまま返すこと
+        status_code, res = self.render([503, 503])
+        self.assertEqual(status_code, 503)
+        self.assertEqual(res.content, b'error')
+        self.assertEqual(self.server.requests, 1)
+
+    def test_connection_error(self):
+        # 接続できない場合は再試行した上で例外にすること
+        self.server.server_close()
+        with mock.patch('urllib3.util.retry.Retry.sleep') as m:
+            with self.assertRaises(CustomException):
+                pdf.RemotePdfBackend().render('<html></html>', url=self.url)
+        self.assertEqual(m.call_count, constants.PDF_CONVERT_RETRIES)
+
+
+class LocalPdfBackendTest(SimpleTestCase):
+
+    def get_backend(self):
+        with mock.patch('importlib.util.find_spec', return_value=object()), \
+                mock.patch('utils.pdf.atexit.register') as m:
+            backend = pdf.LocalPdfBackend(max_workers=1)
+        m.assert_called_once_with(backend.shutdown)
+        return backend
+
+    def test_executor_per_process(self):
+        # fork後の子プロセスではプロセスプールを作り直すこと
+        backend = self.get_backend()
+        with mock.patch('utils.pdf.ProcessPoolExecutor', side_effect=lambda **kwargs: mock.Mock()) as m:
+            executor = backend.get_executor()
+            self.assertIs(backend.get_executor(), executor)
+            with mock.patch('os.getpid', return_value=os.getpid() + 1):
+                self.assertIsNot(backend.get_executor(), executor)
+        self.assertEqual(m.call_count, 2)
+
+    def test_shutdown(self):
+        backend = self.get_backend()
+        with mock.patch('utils.pdf.ProcessPoolExecutor'):
+            executor = backend.get_executor()
+        backend.shutdown()
+        executor.shutdown.assert_called_once_with(wait=True)
+        self.assertIsNone(backend.executor)
+
+
+class ConvertHtmlToPdfTest(SimpleTestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        cache = DocumentCache(root=tmp_dir.name)
+        self.rendered = []
+        for patcher in (
+                mock.patch.object(app_base, 'document_cache', cache),
+                mock.patch.object(pdf, 'render', side_effect=lambda html: self.render_many([html])[0]),
+                mock.patch.object(pdf, 'render_many', side_effect=self.render_many),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def render_many(self, html_list):
+        self.rendered.extend(html_list)
+        return [
+            (500, pdf.PdfResponse(b'', status_code=500)) if 'error' in html else (200, pdf.PdfResponse(html.encode()))
+            for html in html_list
+        ]
+
+    def test_convert_html_to_pdf(self):
+        # 同じHTMLは二回目からキャッシュから返すこと
+        self.assertEqual(app_base.convert_html_to_pdf('<p>a</p>')[1].content, b'<p>a</p>')
+        self.assertEqual(app_base.convert_html_to_pdf('<p>a</p>')[1].content, b'<p>a</p>')
+        self.assertEqual(self.rendered, ['<p>a</p>'])
+
+    def test_convert_html_list_to_pdf(self):
+        # キャッシュにないHTMLだけを一回ずつ変換し、変換できなかったものはキャッシュしないこと
+        app_base.convert_html_to_pdf('<p>a</p>')
+        results = app_base.convert_html_list_to_pdf(['<p>a</p>', '<p>b</p>', 'error', '<p>b</p>'])
+        self.assertEqual([status_code for status_code, res in results], [200, 200, 500, 200])
+        self.assertEqual(results[1][1].content, b'<p>b</p>')
+        self.assertEqual(self.rendered, ['<p>a</p>', '<p>b</p>', 'error'])
+        app_base.convert_html_list_to_pdf(['error'])
+        self.assertEqual(self.rendered[-1], 'error')
+        self.assertEqual(len(self.rendered), 4)
+
+    @override_settings(MEDIA_ROOT='/tmp/media', DOCUMENT_CACHE_ROOT='/tmp/cache/document')
+    def test_root(self):
+        # キャッシュは公開されるMEDIA_ROOTではなく、DOCUMENT_CACHE_ROOTに保存すること
+        self.assertEqual(DocumentCache().root, '/tmp/cache/document')
+
+
+class CompanyStampTest(SimpleTestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        os.makedirs(os.path.join(tmp_dir.name, 'stamp'))
+        with open(os.path.join(tmp_dir.name, 'stamp', 'square_signature.png'), 'wb') as f:
+            f.write(b'original')
+        patcher = override_settings(MEDIA_ROOT=tmp_dir.name)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def get_stamp(self):
+        value = app_base.get_company_square_signature_base64()
+        return base64.b64decode(value[len('data:image/png;base64,'):])
+
+    def test_not_optimize(self):
+        # デフォルトでは縮小せずにそのまま埋め込むこと
+        with mock.patch.object(app_base, 'optimize_stamp_image') as optimize_stamp_image:
+            self.assertEqual(self.get_stamp(), b'original')
+            self.assertEqual(self.get_stamp(), b'original')
+        optimize_stamp_image.assert_not_called()
+
+    def test_optimize(self):
+        with mock.patch.object(app_base, 'optimize_stamp_image', return_value=b'optimized') as optimize_stamp_image:
+            with self.settings(STAMP_OPTIMIZE=True):
+                self.assertEqual(self.get_stamp(), b'optimized')
+                self.assertEqual(self.get_stamp(), b'optimized')
+            self.assertEqual(self.get_stamp(), b'original')
+        optimize_stamp_image.assert_called_once_with(
+            app_base.get_company_square_signature_path(), constants.STAMP_MAX_PIXELS,
+        )
+
+    def test_src(self):
+        # ローカルでPDFに変換する場合は画像を埋め込まずにファイルを参照すること
+        template = Template('{% load stamp %}{% company_signature_src %}')
+        with mock.patch.object(pdf, 'get_backend', return_value=mock.Mock(spec=pdf.LocalPdfBackend)):
+            src = template.render(Context())
+        self.assertTrue(src.startswith(pathlib.Path(app_base.get_company_square_signature_path()).as_uri() + '#'))
+        with mock.patch.object(pdf, 'get_backend', return_value=mock.Mock(spec=pdf.RemotePdfBackend)):
+            src = template.render(Context())
+        self.assertEqual(src, app_base.get_company_square_signature_base64())
+
+
+class WorkerRosterTest(SimpleTestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        # テンプレートに他のシートを参照する名前付き範囲を追加する
+        book = px.load_workbook(os.path.join(os.path.dirname(__file__), '../../media/template/worker_roster.xlsx'))
+        book.create_sheet('選択肢')
+        book.defined_names.append(DefinedName('LIST_GENDER', attr_text="'選択肢'!$A$1:$A$2"))
+        self.path_template = os.path.join(tmp_dir.name, 'worker_roster.xlsx')
+        book.save(self.path_template)
+        self.members = [self.get_member('山田 太郎', '1234'), self.get_member('山田 太郎', None)]
+
+    @classmethod
+    def get_member(cls, full_name, residence_no):
+        # 在留資格は引数で渡すので、member.residenceを参照しないこと
+        member = SimpleNamespace(
+            full_name=full_name, full_kana='ヤマダ タロウ', birthday=datetime.date(1990, 1, 1), post_code='1000001',
+            phone='09012345678', address='東京都', join_date=datetime.date(2020, 4, 1), personal_number=None,
+            basic_pension_no='1111', employment_insurance_no='2222',
+            get_gender_display=lambda: '男', get_commutation_amount=lambda: 10000,
+        )
+        residence = residence_no and SimpleNamespace(
+            residence_type='01', expired_date=datetime.date(2025, 3, 31), residence_no=residence_no,
+            get_residence_type_display=lambda: '技術・人文知識・国際業務',
+        )
+        return member, gen_file.get_worker_roster_values(member, None, [], residence)
+
+    def test_get_worker_roster_values(self):
+        values = dict(self.members[0][1])
+        self.assertEqual(values['POS_RESIDENCE_NO'], '1234')
+        self.assertEqual(values['POS_RESIDENCE_EXPIRED_DATE'], '2025 年 03 月 31 日')
+        self.assertEqual(values['POS_COMMUTATION_AMOUNT'], 10000)
+        # 社会保険を加入していない場合は基礎年金番号を出力しない
+        self.assertIsNone(values['POS_BASIC_PENSION_NO'])
+        self.assertNotIn('POS_RESIDENCE_NO', dict(self.members[1][1]))
+
+    def test_gen_worker_roster_book(self):
+        with mock.patch.object(gen_file, 'iter_worker_roster_values', return_value=iter(self.members)):
+            data = gen_file.gen_worker_roster_book(self.path_template, None)
+        book = px.load_workbook(io.BytesIO(data))
+        self.assertEqual(book.sheetnames, ['選択肢', '山田 太郎', '山田 太郎(2)'])
+        self.assertEqual(book['山田 太郎']['F13'].value, '東京都')
+        # テンプレートのシートを参照する名前は削除し、他のシートを参照する名前は残すこと
+        self.assertEqual([defined_name.name for defined_name in book.defined_names.definedName], ['LIST_GENDER'])
+
+    def test_gen_worker_roster_zip(self):
+        with mock.patch.object(gen_file, 'iter_worker_roster_values', return_value=iter(self.members)):
+            with tempfile.TemporaryFile() as f:
+                self.assertIs(gen_file.gen_worker_roster_zip(self.path_template, None, fileobj=f, password='pwd'), f)
+                f.seek(0)
+                with zipfile.ZipFile(f) as zf:
+                    infos = zf.infolist()
+                    self.assertEqual(
+                        [info.filename.encode('cp437').decode('cp932') for info in infos],
+                        ['労働者名簿_山田 太郎.xlsx', '労働者名簿_山田 太郎(2).xlsx'],
+                    )
+                    book = px.load_workbook(io.BytesIO(zf.read(infos[0], pwd=b'pwd')))
+                    self.assertEqual(book.active['F13'].value, '東京都')
+
+
+class QueryCountMiddlewareTest(TestCase):
+
+    def get_response(self, count):
+        def view(request):
+            for i in range(count):
+                list(Group.objects.filter(pk=i))
+            return HttpResponse()
+        return QueryCountMiddleware(view)(RequestFactory().get('/api/test/'))
+
+    @override_settings(DEBUG=True)
+    def test_count(self):
+        with self.assertRaises(AssertionError), self.assertLogs('system', 'WARNING'):
+            response = self.get_response(2)
+        self.assertEqual(response['X-Query-Count'], '2')
+        self.assertIn('X-Query-Time', response)
+
+    @override_settings(DEBUG=False)
+    def test_duplicated(self):
+        # 同じ形のSQLを繰り返した場合はN+1として警告を出力すること
+        with self.assertLogs('system', 'WARNING') as logs:
+            response = self.get_response(constants.QUERY_DUPLICATE_THRESHOLD)
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn('GET /api/test/', logs.output[0])
+        self.assertIn('auth_group', logs.output[1])
+        # DEBUGでない場合はヘッダーを設定しない
+        self.assertNotIn('X-Query-Count', response)
+
+    def test_too_many(self):
+        with self.assertLogs('system', 'WARNING') as logs:
+            with mock.patch.object(QueryCounter, 'get_duplicates', return_value=[]):
+                self.get_response(constants.QUERY_COUNT_WARNING + 1)
+        self.assertEqual(len(logs.output), 1)
+
+
+class GroupSerializer(ModelSerializer):
+
+    class Meta:
+        model = Group
+        fields = ('id', 'name')
+
+
+class GroupListView(rest_base.BaseListAPIView):
+    queryset = Group.objects.all()
+    serializer_class = GroupSerializer
+    pagination_class = rest_base.BaseCursorPagination
+    cursor_ordering = None
+    authentication_classes = ()
+    permission_classes = ()
+
+
+class BaseCursorPaginationTest(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.groups = [Group.objects.create(name='group-{}'.format(i)) for i in range(5)]
+
+    def get_list(self, path, view=GroupListView, **kwargs):
+        response = view.as_view(**kwargs)(self.factory.get(path))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def get_ids(self, data):
+        return [item['id'] for item in data['results']]
+
+    def test_next_previous(self):
+        # デフォルトは -pk の順で、前後のページはカーソルで取得すること
+        ids = [group.pk for group in reversed(self.groups)]
+        data = self.get_list('/groups/?page_size=2')
+        self.assertEqual(self.get_ids(data), ids[:2])
+        self.assertIsNone(data['previous'])
+        self.assertIsNone(data['count'])
+        data = self.get_list(data['next'])
+        self.assertEqual(self.get_ids(data), ids[2:4])
+        next_url = data['next']
+        data = self.get_list(data['previous'])
+        self.assertEqual(self.get_ids(data), ids[:2])
+        data = self.get_list(next_url)
+        self.assertEqual(self.get_ids(data), ids[4:])
+        self.assertIsNone(data['next'])
+
+    def test_cursor_ordering(self):
+        # ビューのcursor_orderingの順で取得すること
+        data = self.get_list('/groups/?page_size=3', cursor_ordering=('name', 'pk'))
+        self.assertEqual(self.get_ids(data), [group.pk for group in self.groups[:3]])
+
+    def test_count_mode(self):
+        # リクエストのcount_mode、ビューのcount_mode、ページングのcount_modeの順で件数の取得方法を決めること
+        for path, kwargs, count in (
+                ('/groups/?count_mode=exact', {}, 5),
+                ('/groups/?count_mode=estimate', {}, 5),
+                ('/groups/?count_mode=none', {'count_mode': constants.COUNT_EXACT}, None),
+                ('/groups/?count_mode=unknown', {'count_mode': constants.COUNT_EXACT}, 5),
+                ('/groups/', {}, None),
+        ):
+            with self.subTest(path=path, **kwargs):
+                data = self.get_list(path, **kwargs)
+                self.assertEqual(data['count'], count)
+                self.assertEqual(len(data['results']), 5)
+
+    def test_count_none_without_query(self):
+        # 件数を取得しない場合はCOUNTのSQLを実行しないこと
+        with QueryCounter() as counter:
+            self.get_list('/groups/')
+        self.assertFalse([sql for sql, duration in counter.queries if 'COUNT(' in sql.upper()])
+
+    def test_without_pagination(self):
+        # ページングしない場合、件数を取得しなければ結果の件数を返すこと
+        data = self.get_list('/groups/?count_mode=none', pagination_class=None)
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(len(data['results']), 5)
+        # ページングの設定もない場合は正確な件数を取得すること
+        with QueryCounter() as counter:
+            data = self.get_list('/groups/', pagination_class=None)
+        self.assertEqual(data['count'], 5)
+        self.assertTrue([sql for sql, duration in counter.queries if 'COUNT(' in sql.upper()])
+
+
+class AuditTest(TestCase):
+
+    def setUp(self):
+        self.content_type = ContentType.objects.get_for_model(Group)
+        self.permission = Permission.objects.create(
+            name='テスト権限', content_type=self.content_type, codename='test_permission',
+        )
+
+    def test_get_tracked_fields(self):
+        # 自動採番のフィールドは対象外で、名前はフィールド名とattnameのどちらでも指定できること
+        fields = audit.get_tracked_fields(self.permission)
+        self.assertEqual([field.name for field in fields], ['name', 'content_type', 'codename'])
+        fields = audit.get_tracked_fields(self.permission, ['content_type_id', 'codename'])
+        self.assertEqual([field.name for field in fields], ['content_type', 'codename'])
+
+    def test_get_field_values(self):
+        # 外部キーはIDを取得し、関連オブジェクトを取得しないこと
+        permission = Permission.objects.get(pk=self.permission.pk)
+        fields = audit.get_tracked_fields(permission)
+        with self.assertNumQueries(0):
+            values = audit.get_field_values(permission, fields)
+        self.assertEqual(values, {
+            'name': 'テスト権限', 'content_type': self.content_type.pk, 'codename': 'test_permission',
+        })
+
+    def test_get_added_message(self):
+        # 外部キーは取得済みの関連オブジェクトを出力すること
+        message = audit.get_added_message(self.permission)
+        self.assertIn('nameを テスト権限 に設定しました。', message)
+        self.assertIn('content typeを {} に設定しました。'.format(self.content_type), message)
+
+    def test_get_changed_data(self):
+        # 変更したフィールドだけを出力し、外部キーは変更前と変更後ともにIDで出力すること
+        fields = audit.get_tracked_fields(self.permission)
+        original_values = audit.get_field_values(self.permission, fields)
+        content_type = ContentType.objects.get_for_model(Permission)
+        self.permission.name = ''
+        self.permission.content_type = content_type
+        self.permission.save()
+        changed_data = audit.get_changed_data(
+            self.permission, fields, original_values, labels={'name': '名称'}, prev_msg='権限',
+        )
+        self.assertEqual(changed_data, [
+            '権限の名称 を テスト権限 から None に変更しました。',
+            '権限のcontent type を {} から {} に変更しました。'.format(self.content_type.pk, content_type.pk),
+        ])
+
+
+class AuditLogWriterTest(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='audit')
+        self.content_type = ContentType.objects.get_for_model(Group)
+
+    def get_entries(self, count):
+        return [LogEntry(
+            action_time=timezone.now(),
+            user_id=self.user.pk,
+            content_type_id=self.content_type.pk,
+            object_id=str(i),
+            object_repr='group-{}'.format(i),
+            action_flag=ADDITION,
+            change_message='',
+        ) for i in range(count)]
+
+    @override_settings(AUDIT_LOG_ASYNC=False)
+    def test_put_sync(self):
+        # 非同期でない場合はその場で登録すること
+        writer = audit.AuditLogWriter()
+        writer.put(self.get_entries(1)[0])
+        self.assertEqual(LogEntry.objects.count(), 1)
+        self.assertIsNone(writer.thread)
+
+    @override_settings(AUDIT_LOG_ASYNC=True)
+    def test_put_async(self):
+        # スレッドでまとめて登録し、flushで残りを登録してスレッドを終了すること
+        writer = audit.AuditLogWriter(batch_size=2, interval=0.01)
+        with mock.patch.object(writer, 'write', wraps=writer.write) as write:
+            for entry in self.get_entries(5):
+                writer.put(entry)
+            thread = writer.thread
+            writer.flush()
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(LogEntry.objects.count(), 5)
+        self.assertTrue(all(len(call[0][0]) <= 2 for call in write.call_args_list))
+
+    @override_settings(AUDIT_LOG_ASYNC=True)
+    def test_flush_in_flight(self):
+        # スレッドが取り出し済みの操作ログも、登録し終わるまで待つこと
+        writer = audit.AuditLogWriter(batch_size=3, interval=0.01)
+        started = threading.Event()
+        write = writer.write
+
+        def slow_write(entries):
+            started.set()
+            time.sleep(0.2)
+            write(entries)
+
+        with mock.patch.object(writer, 'write', side_effect=slow_write):
+            for entry in self.get_entries(3):
+                writer.put(entry)
+            self.assertTrue(started.wait(5))
+            self.assertTrue(writer.queue.empty())
+            writer.flush()
+        self.assertEqual(LogEntry.objects.count(), 3)
+
+
+class UploadGroupSerializer(rest_base.BaseModelSerializer):
+    name = rest_base.UUIDFileField()
+
+    class Meta:
+        model = Group
+        fields = ('id', 'name')
+
+
+class FileUploadApiViewTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='upload')
+        self.factory = APIRequestFactory()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(
+            MEDIA_ROOT=os.path.join(media_root.name, 'media'), UPLOAD_ROOT=os.path.join(media_root.name, 'upload'),
+        )
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def post(self, data, **kwargs):
+        request = self.factory.post('/api/upload/', data, **kwargs)
+        force_authenticate(request, self.user)
+        return rest_base.FileUploadApiView.as_view()(request)
+
+    def read_upload(self, file_uuid):
+        with open(upload.get_upload_path(file_uuid), 'rb') as f:
+            return f.read()
+
+    def test_upload_multipart(self):
+        # マルチパートのファイルを一時保存し、ファイル名と小文字の拡張子を記録すること
+        response = self.post({'file': SimpleUploadedFile('見積書.TXT', b'hello', 'text/plain')}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        file_uuid = response.data['uuid']
+        self.assertTrue(upload.is_uploaded(file_uuid))
+        self.assertEqual(upload.get_uploaded_info(file_uuid), ('見積書.TXT', '.txt'))
+        self.assertEqual(self.read_upload(file_uuid), b'hello')
+        # 公開されるMEDIA_ROOTには保存しないこと
+        self.assertFalse(os.path.exists(settings.MEDIA_ROOT))
+
+    def test_upload_multipart_without_file(self):
+        response = self.post({'name': 'test'}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+    def test_upload_base64(self):
+        # 本文のBase64の文字列をデコードして一時保存すること
+        data = 'name:{};data:image/png;base64,{}'.format(
+            base64.b64encode('写真.png'.encode('utf-8')).decode('ascii'),
+            base64.b64encode(b'\x89PNG').decode('ascii'),
+        )
+        response = self.post(data, content_type='text/plain')
+        self.assertEqual(response.status_code, 200)
+        file_uuid = response.data['uuid']
+        self.assertEqual(upload.get_uploaded_info(file_uuid), ('写真.png', '.png'))
+        self.assertEqual(self.read_upload(file_uuid), b'\x89PNG')
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024 * 1024)
+    def test_upload_multipart_size_limit(self):
+        # 受信中にサイズの上限を超えたらエラーにし、一時ファイルを残さないこと
+        response = self.post(
+            {'file': SimpleUploadedFile('large.bin', b'0' * (1024 * 1024 + 1), 'application/octet-stream')},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], constants.ERROR_FILE_SIZE_LIMIT.format(limit='1MB'))
+        self.assertEqual(os.listdir(upload.get_upload_root()), [])
+        response = self.post(
+            {'file': SimpleUploadedFile('small.bin', b'0' * 1024 * 1024, 'application/octet-stream')},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_save_attachment_by_serializer(self):
+        # アップロードしたUUIDを保存すると、「UUID＋拡張子」のファイル名で添付ファイルとして紐づけること
+        from master.models import Attachment
+        response = self.post({'file': SimpleUploadedFile('../見積書.TXT', b'hello', 'text/plain')}, format='multipart')
+        file_uuid = response.data['uuid']
+        serializer = UploadGroupSerializer(data={'name': file_uuid})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        group = serializer.save()
+        self.assertEqual(group.name, file_uuid)
+        self.assertFalse(upload.is_uploaded(file_uuid))
+        attachment = Attachment.get_by_uuid(file_uuid)
+        self.assertEqual(attachment.name, '見積書.TXT')
+        self.assertEqual(os.path.basename(attachment.path.name), file_uuid + '.txt')
+        with attachment.path.open('rb') as f:
+            self.assertEqual(f.read(), b'hello')
+
+
+class YearMonthExpressionTest(TestCase):
+
+    def test_get_ym_expression(self):
+        # 空白の年はcommon.get_ymと同じくNoneになること
+        for name in ('2020', ''):
+            Group.objects.create(name=name)
+        qs = Group.objects.annotate(
+            ym=YearMonthQuerySet.get_ym_expression(F('name'), Value('04')),
+        ).order_by('-name')
+        self.assertEqual(list(qs.values_list('ym', flat=True)), [202004, None])
+        self.assertEqual([common.get_ym(group.name, '04') for group in qs], [202004, None])
+        self.assertIsNone(YearMonthQuerySet.get_ym_expression(F('name'), ''))
+
+
+class MonthlyRequestDiffTest(SimpleTestCase):
+    month_list = [datetime.date(2020, month, 1) for month in range(5, 11)]
+    updated_dt = datetime.datetime(2020, 4, 1)
+
+    def get_contract(self, pk, start_date, end_date, is_blanket_contract=False):
+        return SimpleNamespace(
+            pk=pk, start_date=start_date, end_date=end_date,
+            is_blanket_contract=is_blanket_contract, updated_dt=self.updated_dt,
+        )
+
+    def test_diff(self):
+        # 足りない月だけ作成し、不要になった未使用の月別請求は削除すること
+        contracts = {1: self.get_contract(1, datetime.date(2020, 4, 1), datetime.date(2020, 7, 31))}
+        deleted, created = app_base.diff_monthly_requests(contracts, self.month_list, [
+            (11, 1, 202005, None, True, self.updated_dt),
+            (12, 1, 202008, None, False, self.updated_dt),
+            (13, 1, 202009, None, True, self.updated_dt),
+        ])
+        self.assertEqual(deleted, [12])
+        self.assertEqual(created, [(1, 202006), (1, 202007)])
+
+    def test_contract_changed(self):
+        # 契約が変更された場合、未使用の月別請求を作成し直すこと
+        contract = self.get_contract(1, datetime.date(2020, 5, 1), datetime.date(2020, 5, 31))
+        deleted, created = app_base.diff_monthly_requests({1: contract}, self.month_list, [
+            (11, 1, 202005, None, False, self.updated_dt - datetime.timedelta(days=1)),
+        ])
+        self.assertEqual((deleted, created), ([11], [(1, 202005)]))
+
+    def test_blanket_contract(self):
+        # 一括契約は期間前から始まる月別請求（終了年月なし）があれば作成しないこと
+        contracts = {
+            1: self.get_contract(1, datetime.date(2020, 3, 1), datetime.date(2020, 12, 31), True),
+            2: self.get_contract(2, datetime.date(2020, 3, 1), datetime.date(2020, 12, 31), True),
+            3: self.get_contract(3, datetime.date(2020, 6, 1), datetime.date(2020, 12, 31), True),
+        }
+        deleted, created = app_base.diff_monthly_requests(contracts, self.month_list, [
+            (11, 1, 202003, None, False, self.updated_dt),
+        ])
+        self.assertEqual(deleted, [])
+        self.assertEqual(created, [(2, 202005), (3, 202006)])
+
+    def test_without_ym(self):
+        # 整数の年月が未設定の月別請求は比較しないこと
+        contracts = {1: self.get_contract(1, datetime.date(2020, 5, 1), datetime.date(2020, 5, 31), True)}
+        deleted, created = app_base.diff_monthly_requests(contracts, self.month_list, [
+            (11, 1, None, None, False, self.updated_dt),
+        ])
+        self.assertEqual((deleted, created), ([], [(1, 202005)]))
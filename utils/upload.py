@@ -0,0 +1,265 @@
+import base64
+import binascii
+import json
+import os
+import re
+import shutil
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadhandler import FileUploadHandler
+
+from utils import common, constants
+from utils.errors import CustomException
+
+_BASE64_SEPARATOR = ';base64,'
+_MAX_HEADER_LENGTH = 1024  # 「name:xxx;data:image/jpeg;base64,」の最大長さ
+
+
+def get_upload_limit():
+    return settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+
+
+def raise_size_limit(limit):
+    raise CustomException(constants.ERROR_FILE_SIZE_LIMIT.format(
+        limit='{}MB'.format(int(limit / 1024 / 1024))
+    ))
+
+
+class Base64StreamDecoder(object):
+    """Base64のファイルを少しずつデコードしてファイルに書き込む。
+
+    先頭の「name:xxx;data:image/jpeg;base64,」の部分は読み込んだ時点で解析し、
+    デコードしたサイズが上限を超えたらその時点でエラーにする。
+    """
+
+    def __init__(self, fileobj, limit=None):
+        self.fileobj = fileobj
+        self.limit = limit
+        self.header = None
+        self.buffer = ''
+        self.size = 0
+
+    def feed(self, data):
+        """Base64の文字列の一部を追加する。
+
+        :param data: 文字列またはバイト列
+        :return:
+        """
+        if isinstance(data, bytes):
+            data = data.decode('ascii', errors='replace')
+        data = self.buffer + data
+        if self.header is None:
+            index = data.find(_BASE64_SEPARATOR)
+            if index < 0:
+                if len(data) > _MAX_HEADER_LENGTH:
+                    raise CustomException(constants.ERROR_UNKNOWN_ATTACHMENT)
+                self.buffer = data
+                return
+            self.header = data[:index + len(_BASE64_SEPARATOR)]
+            data = data[index + len(_BASE64_SEPARATOR):]
+        data = re.sub(r'\s', '', data)
+        # 4文字単位でデコードし、残りは次の文字列と一緒にデコードする
+        length = len(data) - len(data) % 4
+        self.buffer = data[length:]
+        self.write(data[:length])
+
+    def write(self, data):
+        if not data:
+            return
+        try:
+            content = base64.b64decode(data, validate=True)
+        except (binascii.Error, ValueError):
+            raise CustomException(constants.ERROR_UNKNOWN_ATTACHMENT)
+        self.size += len(content)
+        if self.limit and self.size > self.limit:
+            raise_size_limit(self.limit)
+        self.fileobj.write(content)
+
+    def close(self):
+        if self.header is None or self.buffer:
+            raise CustomException(constants.ERROR_UNKNOWN_ATTACHMENT)
+
+
+class SizeLimitUploadHandler(FileUploadHandler):
+    """マルチパートのファイルを受信しながらサイズの上限をチェックする。"""
+
+    def __init__(self, request=None, limit=None):
+        super(SizeLimitUploadHandler, self).__init__(request)
+        self.limit = limit or get_upload_limit()
+        self.size = 0
+
+    def new_file(self, *args, **kwargs):
+        super(SizeLimitUploadHandler, self).new_file(*args, **kwargs)
+        self.size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > self.limit:
+            raise_size_limit(self.limit)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def get_upload_root():
+    path = settings.UPLOAD_ROOT
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_upload_path(file_uuid):
+    """アップロードしたファイルの一時保存先を取得する。
+
+    :param file_uuid: ファイルのUUID
+    :return: UUIDの形式が正しくない場合はNone
+    """
+    if not isinstance(file_uuid, str) or not re.match(constants.REG_FILE_UUID, file_uuid):
+        return None
+    return os.path.join(get_upload_root(), file_uuid)
+
+
+def is_uploaded(file_uuid):
+    """アップロード済みで、まだ添付ファイルとして保存していないファイルであるか
+
+    :param file_uuid: ファイルのUUID
+    :return:
+    """
+    path = get_upload_path(file_uuid)
+    return path is not None and os.path.exists(path + '.json')
+
+
+def get_uploaded_info(file_uuid):
+    """アップロードしたファイルの情報を取得する。
+
+    :param file_uuid: ファイルのUUID
+    :return: ファイル名、拡張子
+    """
+    with open(get_upload_path(file_uuid) + '.json', 'r') as f:
+        info = json.load(f)
+    return info.get('name'), info.get('ext')
+
+
+def get_uploaded_ext(file_uuid):
+    name, ext = get_uploaded_info(file_uuid)
+    return ext
+
+
+def finish_upload(file_uuid, tmp_path, name, ext):
+    path = get_upload_path(file_uuid)
+    os.replace(tmp_path, path)
+    with open(path + '.json', 'w') as f:
+        json.dump({'name': name, 'ext': ext}, f)
+    return file_uuid
+
+
+def save_base64_stream(stream, limit=None, chunk_size=constants.UPLOAD_CHUNK_SIZE):
+    """ストリームからBase64のファイルを少しずつ読み込んで、デコードしながら一時フォルダーに保存する。
+
+    :param stream: 読み込み元（リクエストなど、readできるオブジェクト）
+    :param limit: サイズの上限（指定しない場合はFILE_UPLOAD_MAX_MEMORY_SIZE）
+    :param chunk_size: 一回で読み込むサイズ
+    :return: ファイルのUUID
+    """
+    file_uuid = common.get_default_file_uuid()
+    tmp_path = get_upload_path(file_uuid) + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            decoder = Base64StreamDecoder(f, limit or get_upload_limit())
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                decoder.feed(chunk)
+            decoder.close()
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    name = common.get_name_from_base64(decoder.header)
+    ext = common.get_ext_from_base64(decoder.header)
+    return finish_upload(file_uuid, tmp_path, name, ext)
+
+
+def save_uploaded_file(uploaded_file, limit=None):
+    """マルチパートでアップロードしたファイルを一時フォルダーに保存する。
+
+    :param uploaded_file: DjangoのUploadedFile
+    :param limit: サイズの上限（指定しない場合はFILE_UPLOAD_MAX_MEMORY_SIZE）
+    :return: ファイルのUUID
+    """
+    limit = limit or get_upload_limit()
+    if uploaded_file.size > limit:
+        raise_size_limit(limit)
+    file_uuid = common.get_default_file_uuid()
+    tmp_path = get_upload_path(file_uuid) + '.tmp'
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        # 受信時に一時ファイルに保存済みの場合は移動するだけ
+        shutil.move(uploaded_file.temporary_file_path(), tmp_path)
+        uploaded_file.close()
+    else:
+        with open(tmp_path, 'wb') as f:
+            for chunk in uploaded_file.chunks():
+                f.write(chunk)
+    name = uploaded_file.name
+    ext = os.path.splitext(name)[1].lower() or common.get_ext_from_content_type(uploaded_file.content_type) or ''
+    return finish_upload(file_uuid, tmp_path, name, ext)
+
+
+def remove_upload(file_uuid):
+    path = get_upload_path(file_uuid)
+    for p in (path, path + '.json'):
+        if os.path.exists(p):
+            os.remove(p)
+
+
+def clear_expired_uploads(expire=constants.UPLOAD_EXPIRE_SECONDS):
+    """添付ファイルとして保存されなかった古いファイルを削除する。
+
+    :param expire: 有効期間（秒）
+    :return: 削除件数
+    """
+    root = get_upload_root()
+    now = time.time()
+    cnt = 0
+    for filename in os.listdir(root):
+        path = os.path.join(root, filename)
+        try:
+            if now - os.path.getmtime(path) > expire:
+                os.remove(path)
+                cnt += 1
+        except OSError:
+            continue
+    return cnt
+
+
+def save_attachment(instance, file_uuid, existed_uuid=None):
+    """アップロードしたファイルを添付ファイルとしてオブジェクトに紐づける。
+
+    ファイルはストレージに少しずつコピーするので、メモリに読み込まない。
+    ファイル名はBase64の添付ファイル（Attachment.save_from_base64）と同じく「UUID＋拡張子」とし、
+    保存先のフォルダーはモデルのupload_toに従う（クライアントのファイル名は表示名としてだけ使う）。
+
+    :param instance: 紐づけるオブジェクト
+    :param file_uuid: アップロードしたファイルのUUID
+    :param existed_uuid: 変更前のファイルのUUID（指定した場合は変更前の添付ファイルを削除する）
+    :return:
+    """
+    from django.contrib.contenttypes.fields import GenericForeignKey
+    from master.models import Attachment
+    name, ext = get_uploaded_info(file_uuid)
+    attachment = Attachment(uuid=file_uuid, name=name)
+    for field in Attachment._meta.private_fields:
+        if isinstance(field, GenericForeignKey):
+            setattr(attachment, field.name, instance)
+    with open(get_upload_path(file_uuid), 'rb') as f:
+        attachment.path.save(file_uuid + (ext or ''), File(f), save=False)
+    attachment.save()
+    remove_upload(file_uuid)
+    if existed_uuid and existed_uuid != file_uuid:
+        old_attachment = Attachment.get_by_uuid(existed_uuid)
+        if old_attachment:
+            old_attachment.delete()
+    return attachment